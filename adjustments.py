@@ -0,0 +1,93 @@
+from buffers import pool
+from lazy import LazyModule
+from parallel import executor
+from profiling import profiler
+
+cv2 = LazyModule("cv2")
+np = LazyModule("numpy")
+
+ADJUSTMENT_DEFAULTS = {"hue": 0, "saturation": 100, "luminosity": 100}
+ADJUSTMENTS = tuple(ADJUSTMENT_DEFAULTS)
+
+
+def hue_lut(hue_value):
+    """Lookup table rotating OpenCV hues (0-179) by a slider value in degrees (0-360)"""
+    hue_shift = int((hue_value / 100) * 50)  # OpenCV hue range is 0-179, so we scale it
+    lut = np.arange(256, dtype=np.uint8)
+    lut[:180] = (np.arange(180) + hue_shift) % 180
+    return lut
+
+
+def scale_lut(percent):
+    """Lookup table multiplying values by `percent` / 100 and clipping to 0-255"""
+    return np.clip(np.arange(256) * (percent / 100), 0, 255).astype(np.uint8)
+
+
+def hsv_lut(hue = 0, saturation = 100, luminosity = 100):
+    """(1, 256, 3) lookup table applying all three adjustments to an HSV image in one cv2.LUT call"""
+    return np.dstack([hue_lut(hue), scale_lut(saturation), scale_lut(luminosity)])
+
+
+def adjust_in_place(image, lut):
+    """Applies an hsv_lut to a (small) BGR image or tile, writing the result back into it"""
+    hsv = pool.take_like(image)
+    cv2.cvtColor(image, cv2.COLOR_BGR2HSV, dst=hsv)
+    cv2.LUT(hsv, lut, dst=hsv)
+    cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR, dst=image)
+    pool.give(hsv)
+
+
+class HSVAdjuster:
+    """Applies hue/saturation/luminosity through 256-entry LUTs on cached HSV planes of a source image
+
+    Every step runs band by band on the shared tile executor.
+    """
+
+    def __init__(self, image):
+        self.source = image
+        self.planes = None  # H, S, V planes of the source, computed on first use
+
+    def prepare(self):
+        """Converts the source to HSV once and allocates the reusable output buffers"""
+        hsv_image = pool.take_like(self.source)
+        self.planes = [pool.take(self.source.shape[:2]) for _ in range(3)]
+
+        def convert(y1, y2):
+            cv2.cvtColor(self.source[y1:y2], cv2.COLOR_BGR2HSV, dst=hsv_image[y1:y2])
+            for index, plane in enumerate(self.planes):
+                cv2.extractChannel(hsv_image[y1:y2], index, dst=plane[y1:y2])
+        with profiler.span("convert bgr->hsv"):
+            executor.map_rows(convert, self.source.shape)
+        self.adjusted_planes = [pool.take_like(plane) for plane in self.planes]
+        self.hsv_buffer = hsv_image  # Reused as destination for merging the adjusted planes
+        self.output = np.empty_like(self.source)
+
+    def release(self):
+        """Returns the HSV buffers to the pool when the adjuster is replaced (the output may still be shown)"""
+        if self.planes is not None:
+            pool.give(self.hsv_buffer, *self.planes, *self.adjusted_planes)
+            self.planes = None
+
+    def adjust_plane(self, index, lut):
+        """Applies a LUT to one source plane (0 = H, 1 = S, 2 = V) and returns the reused result plane"""
+        if self.planes is None:
+            self.prepare()
+        return executor.lut(self.planes[index], lut, self.adjusted_planes[index])
+
+    def compose(self, planes):
+        """Merges H, S, V planes (None = unchanged source plane) back into a BGR image"""
+        if self.planes is None:
+            self.prepare()
+        planes = [plane if plane is not None else source for plane, source in zip(planes, self.planes)]
+
+        def convert(y1, y2):
+            cv2.merge([plane[y1:y2] for plane in planes], dst=self.hsv_buffer[y1:y2])
+            cv2.cvtColor(self.hsv_buffer[y1:y2], cv2.COLOR_HSV2BGR, dst=self.output[y1:y2])
+        with profiler.span("convert hsv->bgr"):
+            executor.map_rows(convert, self.output.shape)
+        return self.output
+
+    def apply(self, hue = 0, saturation = 100, luminosity = 100):
+        """Returns the source adjusted by the given slider values (written into a reused buffer)"""
+        luts = (hue_lut(hue), scale_lut(saturation), scale_lut(luminosity))
+        return self.compose([self.adjust_plane(index, lut) for index, lut in enumerate(luts)])
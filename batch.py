@@ -0,0 +1,204 @@
+"""Headless batch processing: applies an edit recipe to many images without the GUI.
+
+Usage: python main.py batch RECIPE INPUT [INPUT ...] -o OUTPUT_DIR [--workers N] [--max-memory MB]
+
+RECIPE is a JSON file with a list of operations applied in order, e.g.
+
+    [
+        {"op": "crop", "rect": [0, 0, 1920, 1080]},
+        {"op": "rotate", "angle": 90},
+        {"op": "hue", "value": 40},
+        {"op": "saturation", "value": 120},
+        {"op": "luminosity", "value": 90}
+    ]
+
+INPUT can be image files, directories or glob patterns.
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import cv2
+
+from fileio import write_image
+from geometry import clip_rect, geometry_transform
+from parallel import executor
+from pipeline import ADJUSTMENTS, Pipeline
+from tiles import image_size
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+WORKING_COPIES = 6  # Rough number of full-size buffers one image needs while being processed
+
+
+def load_recipe(path):
+    with open(path) as file:
+        recipe = json.load(file)
+    if isinstance(recipe, dict):
+        recipe = recipe.get("operations", [])
+
+    if not isinstance(recipe, list):
+        raise ValueError("A recipe is a list of operations")
+
+    for step in recipe:
+        if not isinstance(step, dict):
+            raise ValueError(f"Operations are objects with an \"op\", not {json.dumps(step)}")
+        op = step.get("op")
+        if op == "crop":
+            rect = step.get("rect")
+            if not isinstance(rect, list) or len(rect) != 4 or not all(is_number(value) for value in rect):
+                raise ValueError("crop needs \"rect\": [x1, y1, x2, y2]")
+        elif op == "rotate":
+            if not is_number(step.get("angle")):
+                raise ValueError("rotate needs a numeric \"angle\"")
+        elif op in ADJUSTMENTS:
+            if not is_number(step.get("value")):
+                raise ValueError(f"{op} needs a numeric \"value\"")
+        else:
+            raise ValueError(f"Unknown operation: {op}")
+    return recipe
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def apply_recipe(image, recipe):
+    """Runs the recipe through the same Pipeline the editor window uses"""
+    pipeline = Pipeline(image)
+    for step in recipe:
+        op = step["op"]
+        if op == "crop":
+            x1, y1, x2, y2 = (int(value) for value in step["rect"])
+            w, h = geometry_transform(pipeline.geometry, image.shape)[1]
+            rect = clip_rect((x1, y1, x2 - x1, y2 - y1), (h, w))
+            if rect is None:
+                raise ValueError(f"crop {[x1, y1, x2, y2]} lies outside the {w}x{h} image")
+            pipeline.add_geometry(("crop", rect))
+        elif op == "rotate":
+            pipeline.add_geometry(("rotate", step["angle"]))
+        else:
+            pipeline.set_adjustment(op, step["value"])
+    return pipeline.render()
+
+
+def find_inputs(patterns):
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            candidates = sorted(os.path.join(pattern, name) for name in os.listdir(pattern))
+        else:
+            candidates = sorted(glob.glob(pattern)) or [pattern]
+        paths.extend(path for path in candidates if path.lower().endswith(IMAGE_EXTENSIONS) and os.path.isfile(path))
+    return paths
+
+
+def output_path(path, output_dir, extension):
+    stem, original_extension = os.path.splitext(os.path.basename(path))
+    return os.path.join(output_dir, stem + (extension or original_extension))
+
+
+def estimate_memory(path):
+    """Bytes one worker needs for an image, from its header"""
+    size = image_size(path)
+    if size is None:
+        return 0
+    return size[0] * size[1] * 3 * WORKING_COPIES
+
+
+def init_worker():
+    # One OpenCV thread and no tile threads per process: the pool already keeps every core busy
+    cv2.setNumThreads(1)
+    executor.configure(workers=1)
+
+
+def process_file(path, destination, recipe):
+    """Decode, edit and encode one image in a worker process; returns (path, error or None)"""
+    try:
+        image = cv2.imread(path)
+        if image is None:
+            return path, "could not be read"
+        result = apply_recipe(image, recipe)
+    except Exception as error:  # One bad image must not stop the batch
+        return path, f"could not be processed: {error}"
+    try:
+        write_image(destination, result)  # Atomic: an interrupted batch leaves no truncated files
+    except (OSError, ValueError):
+        return path, "could not be written"
+    return path, None
+
+
+def run(recipe, paths, output_dir, workers, max_memory = None, extension = None):
+    """Processes the files on a process pool; returns (succeeded, failed, seconds)
+
+    Images are submitted only while the estimated memory of the images in flight stays
+    under `max_memory` bytes, so large files lower the effective parallelism.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    started = time.perf_counter()
+    succeeded = failed = 0
+    queue = list(paths)
+    in_flight = {}  # future -> estimated bytes
+    submitted = {}  # future -> path
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as pool:
+        while queue or in_flight:
+            while queue and len(in_flight) < workers:
+                needed = estimate_memory(queue[0])
+                if in_flight and max_memory is not None and sum(in_flight.values()) + needed > max_memory:
+                    break
+                path = queue.pop(0)
+                future = pool.submit(process_file, path, output_path(path, output_dir, extension), recipe)
+                in_flight[future], submitted[future] = needed, path
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                del in_flight[future]
+                path = submitted.pop(future)
+                try:
+                    error = future.result()[1]
+                except Exception as exception:  # E.g. the worker process died
+                    error = f"failed: {exception!r}"
+                if error is None:
+                    succeeded += 1
+                else:
+                    failed += 1
+                    print(f"Error: {path} {error}", file=sys.stderr)
+
+                elapsed = time.perf_counter() - started
+                print(f"[{succeeded + failed}/{len(paths)}] {path} ({(succeeded + failed) / elapsed:.2f} images/sec)")
+
+    return succeeded, failed, time.perf_counter() - started
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog="main.py batch", description="Apply an Edify-X edit recipe to many images.")
+    parser.add_argument("recipe", help="JSON file with the operations to apply")
+    parser.add_argument("inputs", nargs="+", help="image files, directories or glob patterns")
+    parser.add_argument("-o", "--output", required=True, help="directory for the edited images")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 1, help="worker processes (default: CPU count)")
+    parser.add_argument("--max-memory", type=int, help="approximate memory limit for images in flight, in MB")
+    parser.add_argument("--format", choices=["png", "jpg"], help="output format (default: same as input)")
+    args = parser.parse_args(argv)
+
+    try:
+        recipe = load_recipe(args.recipe)
+    except (OSError, ValueError) as error:
+        print(f"Error: invalid recipe: {error}", file=sys.stderr)
+        return 2
+
+    paths = find_inputs(args.inputs)
+    if not paths:
+        print("No images found.", file=sys.stderr)
+        return 1
+
+    max_memory = args.max_memory * 1024 * 1024 if args.max_memory else None
+    extension = f".{args.format}" if args.format else None
+    succeeded, failed, seconds = run(recipe, paths, args.output, max(1, args.workers), max_memory, extension)
+
+    print(f"Processed {succeeded} images ({failed} failed) in {seconds:.1f} s: {succeeded / seconds:.2f} images/sec")
+    return 1 if failed else 0
@@ -0,0 +1,156 @@
+"""Export benchmark: in-memory rendering versus the strip-by-strip streaming export.
+
+Builds an edit stack (rotation, crop, adjustments, hard and soft brush strokes, an
+adjustment layer) on a small image, replays it on a memory-mapped synthetic source of
+the given size and saves the result as PNG, either through Pipeline.render() and
+write_image() or through export_streaming(). Every export runs in its own process and
+reports its wall time, throughput, the tracemalloc peak of its allocations and the
+process' peak RSS (which includes the pages of the mapped source it read).
+
+    python benchmarks/export.py --megapixels 16 64 256
+    python benchmarks/export.py --megapixels 4 --modes stream --save export.json
+    python benchmarks/export.py --megapixels 8 --verify
+
+With --verify the two outputs of every size are compared, and the exit status is 1 if
+they differ by more than the edges of shapes moving by a pixel (polygon filling depends
+on where the strip starts): any 2x2 block of differing pixels is a failure.
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+MODES = ("memory", "stream")
+STRIP_ROWS = 1024  # Rows of the synthetic source generated at a time
+
+
+def synthetic_source(megapixels, seed = 0):
+    """Gradients plus noise in a 3:2 memory-mapped image, generated strip by strip"""
+    from tiles import TiledImage
+    width = int((megapixels * 1_000_000 * 1.5) ** 0.5)
+    height = int(megapixels * 1_000_000 / width)
+    image = TiledImage(height, width)
+    rng = np.random.default_rng(seed)
+    columns = np.linspace(0, 255, width, dtype=np.uint8)
+    for y in range(0, height, STRIP_ROWS):
+        strip = image.array[y:y + STRIP_ROWS]
+        strip[..., 0] = columns[None, :]
+        strip[..., 1] = (np.arange(y, y + len(strip)) * 255 // height).astype(np.uint8)[:, None]
+        strip[..., 2] = rng.integers(0, 256, strip.shape[:2], dtype=np.uint8)
+    return image.array
+
+
+def sample_edits():
+    """Pipeline.edits() of a representative edit stack, made on a 1500x1000 image"""
+    from layers import AdjustmentLayer
+    from pipeline import Pipeline
+    pipeline = Pipeline(np.zeros((1000, 1500, 3), dtype=np.uint8))
+    layer = pipeline.layers[0]
+    pipeline.draw_polyline(layer, [(100, 120), (700, 380), (1400, 900)], (0, 0, 255), 15)
+    pipeline.add_geometry(("rotate", 12))
+    w, h = pipeline.render().shape[1::-1]
+    pipeline.add_geometry(("crop", (w // 10, h // 10, w - w // 10, h - h // 10)))
+    w, h = pipeline.render().shape[1::-1]
+    pipeline.draw_stamps(layer, [(200 + i * 9.5, 150 + i * 4.5) for i in range(80)], (0, 200, 40), 61, 0.3)
+    pipeline.draw_polyline(layer, [(20, h - 30), (w - 20, 40)], (255, 0, 0), 7)
+    pipeline.set_adjustment("hue", 20)
+    pipeline.set_adjustment("saturation", 130)
+    adjustment = AdjustmentLayer("Adjustment", {"hue": 40, "saturation": 110, "luminosity": 90})
+    adjustment.opacity = 0.5
+    pipeline.set_layers(pipeline.layers + [adjustment])
+    return pipeline.edits()
+
+
+def export(mode, source, edits, path):
+    from fileio import write_image
+    from pipeline import Pipeline
+    from streaming import export_streaming
+    if mode == "stream":
+        export_streaming(path, source, edits)
+    else:
+        write_image(path, Pipeline.from_edits(source, edits).render())
+
+
+def run_child(mode, megapixels, path):
+    """Runs in a fresh process: one export, its measurements as a JSON line"""
+    source = synthetic_source(megapixels)
+    edits = sample_edits()
+    tracemalloc.start()
+    started = time.perf_counter()
+    export(mode, source, edits, path)
+    seconds = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(json.dumps({
+        "seconds": seconds,
+        "mp_per_s": source.shape[0] * source.shape[1] / 1e6 / seconds,
+        "peak_mb": peak / 1024 / 1024,
+        "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "file_mb": os.path.getsize(path) / 1024 / 1024,
+    }))
+
+
+def compare(first, second):
+    """(pixels, 2x2 blocks of pixels) of two image files that differ, or None if their sizes do"""
+    import cv2
+    a, b = cv2.imread(first), cv2.imread(second)
+    if a.shape != b.shape:
+        return None
+    differing = (a != b).any(axis=2).astype(np.uint8)
+    return int(differing.sum()), int(cv2.erode(differing, np.ones((2, 2), np.uint8), borderValue=0).sum())
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description="Compare the in-memory and the streaming Edify-X export.")
+    parser.add_argument("--megapixels", type=float, nargs="+", default=[16, 64])
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--verify", action="store_true", help="compare the outputs of the modes")
+    parser.add_argument("--save", help="write the results as JSON")
+    parser.add_argument("--child", nargs=3, metavar=("MODE", "MEGAPIXELS", "PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        run_child(args.child[0], float(args.child[1]), args.child[2])
+        return 0
+
+    print(f"{'megapixels':>10}  {'mode':<8}{'seconds':>9}{'MP/s':>8}{'peak MB':>10}{'RSS MB':>9}{'file MB':>9}")
+    results = {}
+    status = 0
+    with tempfile.TemporaryDirectory() as directory:
+        for megapixels in args.megapixels:
+            paths = {}
+            for mode in args.modes:
+                paths[mode] = os.path.join(directory, f"{mode}.png")
+                output = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", mode, str(megapixels),
+                                         paths[mode]], check=True, stdout=subprocess.PIPE, text=True).stdout
+                m = results[f"{mode}@{megapixels:g}mp"] = json.loads(output.splitlines()[-1])
+                print(f"{megapixels:>10g}  {mode:<8}{m['seconds']:>9.2f}{m['mp_per_s']:>8.1f}{m['peak_mb']:>10.1f}"
+                      f"{m['rss_mb']:>9.0f}{m['file_mb']:>9.1f}")
+            if args.verify and len(paths) == 2:
+                differing = compare(paths["memory"], paths["stream"])
+                results[f"differing@{megapixels:g}mp"] = differing
+                if differing is None:
+                    print(f"{'':>10}  outputs differ in size")
+                else:
+                    print(f"{'':>10}  outputs differ in {differing[0]} pixels, {differing[1]} of them in 2x2 blocks")
+                if differing is None or differing[1]:
+                    status = 1
+
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(results, file, indent=2)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+"""Scaling benchmark for the tile-parallel executor.
+
+Times the pixel operations that run on the tile executor (rotation, HSV adjustment,
+layer compositing, pyramid building) on a synthetic image with a growing number of
+worker threads and reports the speedup over a single worker.
+
+    python benchmarks/parallel.py --megapixels 24 --workers 1 2 4 8 16
+    python benchmarks/parallel.py --tile-rows 128 --save scaling.json
+
+The results of every worker count are also checked to be identical to the single
+worker ones (band edges must not leave seams).
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from adjustments import HSVAdjuster
+from geometry import apply_transform, geometry_transform
+from layers import AdjustmentLayer, Compositor, PaintLayer
+from parallel import PARALLEL_TILE_ROWS, executor
+from pyramid import ImagePyramid
+from run import synthetic_image
+
+
+def bench_rotate(image):
+    geometry = [("rotate", 15), ("crop", (100, 100, image.shape[1] - 100, image.shape[0] - 100))]
+    return apply_transform(image, *geometry_transform(geometry, image.shape))
+
+
+def bench_hsv(image):
+    return HSVAdjuster(image).apply(hue=40, saturation=130, luminosity=90)
+
+
+def bench_composite(image):
+    paint = PaintLayer()
+    paint.draw_polyline(image.shape, [(0, 0), (image.shape[1] - 1, image.shape[0] - 1)], (0, 0, 255), 25)
+    paint.opacity = 0.5
+    adjustment = AdjustmentLayer("Adjustment", {"hue": 30, "saturation": 120, "luminosity": 80})
+    return Compositor().composite(image, [paint, adjustment])
+
+
+def bench_pyramid(image):
+    return ImagePyramid(image).levels[1]
+
+
+BENCHMARKS = {
+    "rotate": bench_rotate,
+    "hsv": bench_hsv,
+    "composite": bench_composite,
+    "pyramid": bench_pyramid,
+}
+
+
+def default_workers():
+    """1, 2, 4, ... up to the number of cores"""
+    cores = os.cpu_count() or 1
+    counts = [1]
+    while counts[-1] * 2 < cores:
+        counts.append(counts[-1] * 2)
+    return counts + [cores] if cores > 1 else counts
+
+
+def measure(function, image, repeats):
+    """Median milliseconds of a call, and its result"""
+    result = function(image)  # Warm up (and start the pool's threads)
+    samples = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        result = function(image)
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples), result
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description="Measure how Edify-X pixel operations scale with worker threads.")
+    parser.add_argument("--megapixels", type=float, default=24)
+    parser.add_argument("--workers", type=int, nargs="+", default=default_workers())
+    parser.add_argument("--tile-rows", type=int, default=PARALLEL_TILE_ROWS, help="height of the bands")
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS), help="run only these benchmarks")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--save", help="write the results as JSON")
+    args = parser.parse_args(argv)
+
+    image = synthetic_image(args.megapixels)
+    print(f"{image.shape[1]}x{image.shape[0]}, {os.cpu_count()} cores, bands of {args.tile_rows} rows")
+    print(f"{'operation':<12}{'workers':>8}{'p50 ms':>10}{'speedup':>9}{'efficiency':>12}")
+
+    results = {}
+    mismatches = []
+    for name in args.only or BENCHMARKS:
+        baseline = reference = None
+        for workers in args.workers:
+            executor.configure(workers=workers, tile_rows=args.tile_rows)
+            milliseconds, result = measure(BENCHMARKS[name], image, args.repeats)
+            if reference is None:
+                baseline, reference = milliseconds, result.copy()
+            elif not np.array_equal(result, reference):
+                mismatches.append(f"{name} with {workers} workers")
+            speedup = baseline / milliseconds
+            results[f"{name}@{workers}"] = {"p50_ms": milliseconds, "speedup": speedup}
+            print(f"{name:<12}{workers:>8}{milliseconds:>10.1f}{speedup:>9.2f}{speedup / workers * args.workers[0]:>12.0%}")
+
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(results, file, indent=2)
+
+    if mismatches:
+        print("\nResults differ from the first worker count:")
+        for mismatch in mismatches:
+            print(f"  {mismatch}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,248 @@
+"""Benchmarks for Edify-X image operations and GUI repaint paths.
+
+Runs headless (QT_QPA_PLATFORM=offscreen) on synthetic images and reports, per operation
+and image size, latency percentiles, the tracemalloc peak of temporary allocations and
+the number of scratch buffers the pool had to allocate (both once warmed up), and the
+process' peak RSS.
+
+    python benchmarks/run.py --sizes 1 4 16 --save baseline.json
+    python benchmarks/run.py --sizes 1 4 16 --compare baseline.json --threshold 0.25
+
+With --compare the exit status is 1 when any metric got worse than the baseline by more
+than the threshold (a fraction, 0.25 = 25%).
+"""
+
+import argparse
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from PyQt6.QtCore import QEvent, QPoint, QPointF, Qt
+from PyQt6.QtGui import QMouseEvent
+from PyQt6.QtWidgets import QApplication
+
+import gui
+from buffers import pool
+
+DEFAULT_SIZES = (1, 4, 16)  # Megapixels
+# Compared metrics and the absolute change below which a difference is treated as noise
+COMPARED_METRICS = {"p50_ms": 1.0, "p90_ms": 1.0, "peak_mb": 1.0, "buffers": 1}
+
+
+def synthetic_image(megapixels, seed = 0):
+    """Smooth gradients plus noise, in a 3:2 aspect ratio"""
+    width = int((megapixels * 1_000_000 * 1.5) ** 0.5)
+    height = int(megapixels * 1_000_000 / width)
+    rng = np.random.default_rng(seed)
+    image = np.empty((height, width, 3), dtype=np.uint8)
+    image[..., 0] = np.linspace(0, 255, width, dtype=np.uint8)[None, :]
+    image[..., 1] = np.linspace(0, 255, height, dtype=np.uint8)[:, None]
+    image[..., 2] = rng.integers(0, 256, (height, width), dtype=np.uint8)
+    return image
+
+
+def mouse_event(x, y, kind = QEvent.Type.MouseMove):
+    position = QPointF(x, y)
+    return QMouseEvent(kind, position, position, Qt.MouseButton.LeftButton, Qt.MouseButton.LeftButton,
+                       Qt.KeyboardModifier.NoModifier)
+
+
+# Every benchmark is a function (window, iteration) that performs one operation
+
+def bench_update_image_display(window, i):
+    window.zoom_factor = (0.25, 0.5, 1.0, 2.0)[i % 4]
+    window.update_image_display()
+
+
+def brush_benchmark(hardness, samples):
+    def bench(window, i):
+        window.brush_hardness = hardness
+        if i == 0 or window.last_point is None:
+            window.start_drawing(mouse_event(100, 100, QEvent.Type.MouseButtonPress))
+        # `samples` pointer events arriving within one frame, then the frame's painting
+        for sample in range(samples):
+            step = i * samples + sample
+            window.draw(mouse_event(100 + (step * 7) % 400, 100 + (step * 5) % 300))
+        window.paint_samples()
+    return bench
+
+
+def bench_rotate_image_by_angle(window, i):
+    window.rotate_image_by_angle(window.cv_image, 15 + i)
+
+
+def bench_rotate_quarter_turn(window, i):
+    window.rotate_image_by_angle(window.cv_image, (90, 180, 270)[i % 3])
+
+
+def bench_crop_image(window, i):
+    width, height = window.image_label.width(), window.image_label.height()
+    window.start_point = QPoint(width // 4, height // 4)
+    window.end_point = QPoint(width * 3 // 4, height * 3 // 4)
+    window.crop_image()
+
+
+def blending_benchmark(name, values):
+    def bench(window, i):
+        # The work the render worker does for a slider tick, run synchronously
+        with window.renderer.exclusive():
+            window.pipeline.set_adjustment(name, values[i % len(values)])
+        window.render_pipeline()
+    return bench
+
+
+BENCHMARKS = {
+    "update_image_display": bench_update_image_display,
+    "draw": brush_benchmark(1.0, 1),
+    "draw_coalesced": brush_benchmark(1.0, 8),  # A high polling rate mouse
+    "draw_soft": brush_benchmark(0.5, 1),
+    "rotate_image_by_angle": bench_rotate_image_by_angle,
+    "rotate_quarter_turn": bench_rotate_quarter_turn,
+    "crop_image": bench_crop_image,
+    "update_hue": blending_benchmark("hue", (40, 80, 120)),
+    "update_saturation": blending_benchmark("saturation", (50, 150, 120)),
+    "update_luminosity": blending_benchmark("luminosity", (50, 150, 120)),
+}
+
+# Benchmarks that change the image get a fresh copy of the edit state before every iteration
+RESETS = {"crop_image"}
+
+
+def reset(window, image):
+    window.zoom_factor = 1.0
+    window.set_image(image, "synthetic")
+    window.brush_color = (0, 0, 255)
+    window.brush_size = 5
+    window.brush_hardness = 1.0
+    window.is_drawing = True
+    window.last_point = None
+
+
+def percentile(samples, q):
+    return float(np.percentile(samples, q)) if samples else 0.0
+
+
+def run_benchmark(window, image, name, repeats, warmup):
+    bench = BENCHMARKS[name]
+    reset(window, image)
+
+    # Latency pass (no tracemalloc, it slows allocations down)
+    samples = []
+    for i in range(warmup + repeats):
+        if name in RESETS:
+            reset(window, image)
+        started = time.perf_counter()
+        bench(window, i)
+        if i >= warmup:
+            samples.append((time.perf_counter() - started) * 1000)
+
+    # Memory pass, in steady state: the first iteration (untraced) sets up the reused buffers
+    reset(window, image)
+    bench(window, 0)
+    tracemalloc.start()
+    peak = 0
+    allocations = 0
+    for i in range(1, min(repeats, 3) + 1):
+        if name in RESETS:
+            reset(window, image)
+        tracemalloc.reset_peak()
+        current, _ = tracemalloc.get_traced_memory()
+        allocated = pool.allocations
+        bench(window, i)
+        allocations += pool.allocations - allocated
+        peak = max(peak, tracemalloc.get_traced_memory()[1] - current)
+    tracemalloc.stop()
+
+    return {
+        "p50_ms": percentile(samples, 50),
+        "p90_ms": percentile(samples, 90),
+        "p99_ms": percentile(samples, 99),
+        "max_ms": max(samples),
+        "peak_mb": peak / 1024 / 1024,
+        "buffers": allocations,
+        "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def compare(results, baseline, threshold):
+    """Returns a list of regression descriptions"""
+    regressions = []
+    for key, metrics in results.items():
+        reference = baseline.get(key)
+        if reference is None:
+            continue
+        for metric, noise in COMPARED_METRICS.items():
+            old, new = reference.get(metric), metrics[metric]
+            if old is None or new - old < noise:
+                continue
+            if new > old * (1 + threshold):
+                regressions.append(f"{key} {metric}: {old:.2f} -> {new:.2f}")
+    return regressions
+
+
+def print_table(results):
+    print(f"{'operation':<34}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}{'peak MB':>10}{'buffers':>10}"
+          f"{'RSS MB':>10}")
+    for key, m in results.items():
+        print(f"{key:<34}{m['p50_ms']:>10.2f}{m['p90_ms']:>10.2f}{m['p99_ms']:>10.2f}{m['max_ms']:>10.2f}"
+              f"{m['peak_mb']:>10.1f}{m.get('buffers', 0):>10}{m['rss_mb']:>10.0f}")
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description="Benchmark Edify-X operations on synthetic images.")
+    parser.add_argument("--sizes", type=float, nargs="+", default=DEFAULT_SIZES, help="image sizes in megapixels (1 to 100)")
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS), help="run only these benchmarks")
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--save", help="write the results as JSON (e.g. to use as a baseline)")
+    parser.add_argument("--compare", help="baseline JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed relative regression (default 0.25)")
+    parser.add_argument("--full-resolution", action="store_true", help="edit at full resolution instead of through a proxy")
+    args = parser.parse_args(argv)
+
+    app = QApplication.instance() or QApplication([])
+    window = gui.Window()
+    window.proxy_editing = not args.full_resolution
+    window.autosave_enabled = False  # Synthetic images aren't worth keeping
+    window.show()
+    app.processEvents()
+
+    results = {}
+    for megapixels in args.sizes:
+        image = synthetic_image(megapixels)
+        for name in args.only or BENCHMARKS:
+            key = f"{name}@{megapixels:g}MP"
+            results[key] = run_benchmark(window, image, name, args.repeats, args.warmup)
+            print(f"  {key}: p50 {results[key]['p50_ms']:.2f} ms", file=sys.stderr)
+        window.clear_canvas()
+        del image
+
+    window.close()
+    print_table(results)
+
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(results, file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print("\nRegressions:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print("\nNo regressions.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,112 @@
+"""Time-to-first-window benchmark for Edify-X.
+
+Starts a fresh Python process per run (from a scratch directory, so asset paths are
+checked too), builds the editor window, waits for its first paint and reports the
+elapsed wall time, plus any heavy module that got imported before the window was shown.
+
+    python benchmarks/startup.py --save startup.json
+    python benchmarks/startup.py --compare startup.json --threshold 0.25
+
+The exit status is 1 when the median got slower than the baseline by more than the
+threshold, when it exceeds --budget, or when OpenCV/NumPy are imported at startup.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ("cv2", "numpy", "PIL")  # Must not be needed to show the window
+MIN_REGRESSION_MS = 20.0  # Differences below this are treated as noise
+
+# Runs in the child process; prints one line once the window has been painted
+CHILD = f"""
+import sys
+sys.path.insert(0, {ROOT!r})
+from PyQt6.QtWidgets import QApplication
+import gui
+app = QApplication([])
+window = gui.Window()
+window.show()
+app.processEvents()
+print("ready", ",".join(name for name in {HEAVY_MODULES!r} if name in sys.modules), flush=True)
+"""
+
+
+def measure_once(env, directory):
+    """Milliseconds from process start to the first painted window, and the heavy modules loaded by then"""
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-c", CHILD], cwd=directory, env=env,
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    line = process.stdout.readline()
+    elapsed = (time.perf_counter() - started) * 1000
+    process.wait()
+    if not line.startswith("ready"):
+        raise RuntimeError("The editor window did not start")
+    loaded = line.split()[1].split(",") if len(line.split()) > 1 else []
+    return elapsed, loaded
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description="Measure Edify-X time-to-first-window.")
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=1, help="unmeasured runs (fill OS file caches and the icon cache)")
+    parser.add_argument("--save", help="write the result as JSON (e.g. to use as a baseline)")
+    parser.add_argument("--compare", help="baseline JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed relative regression (default 0.25)")
+    parser.add_argument("--budget", type=float, help="fail if the median exceeds this many milliseconds")
+    args = parser.parse_args(argv)
+
+    env = dict(os.environ)
+    env.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+    samples = []
+    loaded = []
+    with tempfile.TemporaryDirectory() as directory:
+        for i in range(args.warmup + args.repeats):
+            elapsed, loaded = measure_once(env, directory)
+            if i >= args.warmup:
+                samples.append(elapsed)
+
+    samples.sort()
+    result = {"startup": {
+        "p50_ms": statistics.median(samples),
+        "min_ms": samples[0],
+        "max_ms": samples[-1],
+    }}
+    print(f"time to first window: {result['startup']['p50_ms']:.0f} ms median "
+          f"({samples[0]:.0f}-{samples[-1]:.0f} ms over {len(samples)} runs)")
+
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(result, file, indent=2)
+
+    failures = []
+    if loaded:
+        failures.append(f"heavy modules imported at startup: {', '.join(loaded)}")
+    if args.budget is not None and result["startup"]["p50_ms"] > args.budget:
+        failures.append(f"median {result['startup']['p50_ms']:.0f} ms exceeds the {args.budget:.0f} ms budget")
+    if args.compare:
+        with open(args.compare) as file:
+            old = json.load(file)["startup"]["p50_ms"]
+        new = result["startup"]["p50_ms"]
+        if new - old >= MIN_REGRESSION_MS and new > old * (1 + args.threshold):
+            failures.append(f"startup p50_ms: {old:.0f} -> {new:.0f}")
+
+    if failures:
+        print("\nRegressions:")
+        for failure in failures:
+            print(f"  {failure}")
+        return 1
+    if args.compare or args.budget is not None:
+        print("\nNo regressions.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,42 @@
+import functools
+import math
+
+from lazy import LazyModule
+
+np = LazyModule("numpy")
+
+BRUSH_SPACING = 0.25  # Distance between the stamps of a soft brush, as a fraction of its size
+
+
+@functools.lru_cache(maxsize=32)
+def brush_stamp(size, hardness):
+    """Alpha (float32, 0-1) of a round brush `size` pixels across
+
+    The alpha is 1 up to `hardness` (0-1) of the radius and falls off smoothly to 0 at the
+    edge. Stamps are cached, so a stroke reuses one array for all its dabs (don't modify it).
+    """
+    radius = size / 2
+    center = (size - 1) / 2
+    y, x = np.ogrid[:size, :size]
+    distance = np.sqrt((x - center) ** 2 + (y - center) ** 2) / max(radius, 0.5)
+    t = np.clip((1 - distance) / max(1 - hardness, 1e-6), 0, 1)
+    stamp = (t * t * (3 - 2 * t)).astype(np.float32)  # Smoothstep
+    stamp.flags.writeable = False
+    return stamp
+
+
+def spaced_points(points, spacing, offset = 0.0):
+    """Evenly spaced positions along a polyline, the first one `offset` past its start
+
+    Returns (positions, offset) where the returned offset is where the next position lies
+    past the end, so a stroke painted in batches keeps a constant spacing.
+    """
+    positions = []
+    for (x1, y1), (x2, y2) in zip(points, points[1:]):
+        length = math.hypot(x2 - x1, y2 - y1)
+        while offset <= length:
+            t = offset / length if length else 0.0
+            positions.append((x1 + (x2 - x1) * t, y1 + (y2 - y1) * t))
+            offset += spacing
+        offset -= length
+    return positions, offset
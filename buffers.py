@@ -0,0 +1,88 @@
+import threading
+import weakref
+
+from lazy import LazyModule
+from profiling import profiler
+
+np = LazyModule("numpy")
+
+BUFFER_POOL_LIMIT = 512 * 1024 * 1024  # Bytes of idle buffers kept for reuse
+
+
+class BufferPool:
+    """Scratch arrays reused by shape and dtype, so repeated renders stop allocating
+
+    Arrays come from take() and go back with give() once nothing uses them anymore;
+    give() ignores arrays the pool did not hand out, so callers can pass whatever they
+    replace. Idle buffers of the shapes returned least recently are freed beyond `limit`.
+    """
+
+    def __init__(self, limit = BUFFER_POOL_LIMIT):
+        self.limit = limit
+        self.lock = threading.Lock()
+        self.idle = {}  # (shape, dtype) -> idle arrays, least recently returned shapes first
+        self.idle_bytes = 0
+        self.lent = {}  # id -> weak reference of every array handed out and not returned
+        self.allocations = 0  # Arrays that had to be allocated (for benchmarks)
+
+    def take(self, shape, dtype = "uint8"):
+        """An uninitialized array of the given shape and dtype"""
+        key = (tuple(shape), np.dtype(dtype).str)
+        with self.lock:
+            arrays = self.idle.get(key)
+            array = arrays.pop() if arrays else None
+            if array is not None:
+                self.idle_bytes -= array.nbytes
+            else:
+                self.allocations += 1
+            if len(self.lent) > 4096:
+                # Arrays never given back are forgotten once they are garbage collected
+                self.lent = {key: ref for key, ref in self.lent.items() if ref() is not None}
+
+        if array is None:
+            profiler.count("buffer allocations")
+            array = np.empty(shape, dtype=dtype)
+        else:
+            profiler.count("buffer reuses")
+        with self.lock:
+            self.lent[id(array)] = weakref.ref(array)
+        return array
+
+    def take_like(self, array):
+        return self.take(array.shape, array.dtype)
+
+    def zeros(self, shape, dtype = "uint8"):
+        array = self.take(shape, dtype)
+        array.fill(0)
+        return array
+
+    def give(self, *arrays):
+        """Makes arrays from take() available again (the caller must not use them anymore)"""
+        with self.lock:
+            for array in arrays:
+                if array is None:
+                    continue
+                ref = self.lent.pop(id(array), None)
+                if ref is None or ref() is not array:
+                    continue
+                key = (array.shape, array.dtype.str)
+                self.idle[key] = self.idle.pop(key, [])  # Moves the shape to the most recent end
+                self.idle[key].append(array)
+                self.idle_bytes += array.nbytes
+
+            while self.idle_bytes > self.limit:
+                key = next(iter(self.idle))
+                arrays = self.idle[key]
+                if arrays:
+                    self.idle_bytes -= arrays.pop(0).nbytes
+                if not arrays:
+                    del self.idle[key]
+
+    def clear(self):
+        """Frees every idle buffer"""
+        with self.lock:
+            self.idle = {}
+            self.idle_bytes = 0
+
+
+pool = BufferPool()  # Shared by the GUI thread, the render worker and the tile threads
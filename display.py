@@ -0,0 +1,41 @@
+from PyQt6.QtGui import QImage
+
+from lazy import LazyModule
+
+np = LazyModule("numpy")
+
+
+class DisplayBuffer:
+    """Persistent BGR pixel buffer shown through a Format_BGR888 QImage sharing its memory
+
+    OpenCV results are written straight into `array` (no RGB conversion, no QPixmap copy).
+    The underlying storage only grows, so repaints of the same or a smaller size reuse it.
+    """
+
+    def __init__(self):
+        self.storage = None
+        self.array = None  # Current (height, width, 3) view into storage
+        self.qimage = None
+
+    def resize(self, width, height):
+        """Returns a (height, width, 3) BGR view to render into, reusing the storage when possible"""
+        if self.storage is None or self.storage.shape[0] < height or self.storage.shape[1] < width:
+            capacity_h = max(height, 0 if self.storage is None else self.storage.shape[0])
+            capacity_w = max(width, 0 if self.storage is None else self.storage.shape[1])
+            self.storage = np.empty((capacity_h, capacity_w, 3), dtype=np.uint8)
+
+        if self.array is None or self.array.shape[:2] != (height, width) or self.array.base is not self.storage:
+            self.array = self.storage[:height, :width]
+            # The QImage only points at the storage; keeping both on this object keeps the memory alive
+            bytes_per_line = self.storage.strides[0]
+            self.qimage = QImage(self.storage.data, width, height, bytes_per_line, QImage.Format.Format_BGR888)
+        return self.array
+
+    def clear(self):
+        """Stops showing anything (the storage is kept for the next frame)"""
+        self.array = None
+        self.qimage = None
+
+    @property
+    def empty(self):
+        return self.qimage is None
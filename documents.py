@@ -0,0 +1,205 @@
+import itertools
+import os
+import pickle
+import tempfile
+import threading
+import zlib
+
+from history import History
+from lazy import LazyModule
+from profiling import profiler
+from pyramid import ImagePyramid
+
+cv2 = LazyModule("cv2")
+np = LazyModule("numpy")
+
+DOCUMENT_MEMORY_BUDGET = 2 * 1024 * 1024 * 1024  # Bytes of decoded images and render buffers kept for open documents
+EVICTED_PREVIEW_SIZE = 2048  # Longest side of the largest pyramid level kept for an evicted document
+
+
+def resident_bytes(arrays):
+    """Memory held by a list of arrays, counting shared buffers once and skipping memory-mapped files"""
+    owners = {}
+    for array in arrays:
+        while isinstance(array.base, np.ndarray):
+            array = array.base
+        if not isinstance(array, np.memmap):
+            owners[id(array)] = array.nbytes
+    return sum(owners.values())
+
+
+class Document:
+    """One open image: its edit stack, history and how it was being viewed
+
+    A document is either resident (decoded source and render buffers in memory) or
+    evicted: then its source and paint layers live in a compressed file, and only the
+    smaller pyramid levels stay in memory so it can be shown right away when switched to.
+    """
+
+    def __init__(self, image_path):
+        # Window state saved while another document is shown (see Window.store_document)
+        self.image_path = image_path
+        self.cv_image = None
+        self.original_image = None
+        self.pipeline = None
+        self.history = History()
+        self.pyramid = None
+        self.tiled_image = None
+        self.zoom_factor = 1.0
+        self.image_pos = None
+        self.active_layer = None
+        self.proxy_scale = 1.0
+        self.project = None  # Project file the edits are saved to (see project.Project)
+        self.saved_version = None  # history.version when the edited image was last saved (not to autosave it then)
+
+        self.last_used = 0
+        self.preview_scale = 1.0  # Full resolution width / width of the kept preview while evicted
+        self.evicted = False  # Set on the GUI thread as soon as eviction is requested
+        self.restoring = False  # Set while a restore started by a switch runs in the background
+        self.spill_path = None
+        self.lock = threading.Lock()  # Serializes eviction and restoring on worker threads
+
+    @property
+    def name(self):
+        return os.path.basename(self.image_path) if self.image_path else "Untitled"
+
+    @property
+    def nbytes(self):
+        arrays = [] if self.pyramid is None else list(self.pyramid.levels)
+        if self.cv_image is not None:
+            arrays.append(self.cv_image)
+        if self.pipeline is not None and not self.evicted:
+            arrays += self.pipeline.arrays()
+        return resident_bytes(arrays)
+
+    def keep_preview(self):
+        """Drops the large pyramid levels, keeping the ones the current zoom needs (up to EVICTED_PREVIEW_SIZE)"""
+        levels = self.pyramid.levels
+        index, _ = self.pyramid.level_for_zoom(self.zoom_factor)
+        while index + 1 < len(levels) and max(levels[index].shape[:2]) > EVICTED_PREVIEW_SIZE:
+            index += 1
+        self.pyramid = ImagePyramid.from_levels(levels[index:])
+        self.cv_image = self.pyramid.base
+        return levels[0].shape[1] / self.cv_image.shape[1]  # Full resolution / preview width
+
+    def evict(self, directory):
+        """Writes the source and paint layers to a compressed file and frees them (worker thread)"""
+        with self.lock:
+            if not self.evicted or self.spill_path is not None or self.pipeline is None:
+                return  # Switched back to, or closed, before this got to run
+
+            pipeline = self.pipeline
+            encoded = {}  # Pipeline attribute -> PNG data
+            # Lossless; Huffman-only coding was both the fastest and the smallest in our measurements
+            params = [cv2.IMWRITE_PNG_COMPRESSION, 1, cv2.IMWRITE_PNG_STRATEGY, cv2.IMWRITE_PNG_STRATEGY_HUFFMAN_ONLY]
+            for name in ("source", "original"):  # The proxy and the full resolution image, when editing a proxy
+                image = getattr(pipeline, name)
+                # A memory-mapped image (large files) is already backed by a file
+                if image is not None and not isinstance(image, np.memmap):
+                    with profiler.span("evict encode"):
+                        ok, encoded[name] = cv2.imencode(".png", image, params)
+                    if not ok:
+                        return
+            layers = zlib.compress(pickle.dumps(pipeline.snapshot_layers(), pickle.HIGHEST_PROTOCOL), 1)
+
+            fd, self.spill_path = tempfile.mkstemp(suffix=".document", dir=directory)
+            with os.fdopen(fd, "wb") as file:
+                pickle.dump((encoded, layers), file, pickle.HIGHEST_PROTOCOL)
+
+            for layer in pipeline.paint_layers():
+                layer.restore(None)
+            pipeline.release()
+            for name in encoded:
+                setattr(pipeline, name, None)
+            if pipeline.full_source is None:
+                self.original_image = None
+
+    def restore(self):
+        """Brings an evicted document back and renders it (worker thread); returns (image, pyramid)"""
+        with self.lock:
+            pipeline = self.pipeline
+            if pipeline is None:
+                return None, None  # Closed in the meantime
+            if self.spill_path is not None:
+                with open(self.spill_path, "rb") as file:
+                    encoded, layers = pickle.load(file)
+                for name, data in encoded.items():
+                    with profiler.span("restore decode"):
+                        setattr(pipeline, name, cv2.imdecode(data, cv2.IMREAD_UNCHANGED))
+                pipeline.restore_layers(pipeline.paint_layers(), pickle.loads(zlib.decompress(layers)))
+                self.discard()
+            pipeline.invalidate("geometry")
+            image = pipeline.render()
+            return image, ImagePyramid(image)
+
+    def discard(self):
+        if self.spill_path is not None:
+            os.remove(self.spill_path)
+            self.spill_path = None
+
+    def close(self):
+        with self.lock:
+            self.discard()
+            self.history.clear()
+            self.pipeline = None
+
+
+class DocumentCache:
+    """Open documents (in tab order) under a memory budget
+
+    Once the resident documents use more than `budget`, the least recently used ones
+    other than the shown one are chosen for eviction.
+    """
+
+    def __init__(self, budget = DOCUMENT_MEMORY_BUDGET):
+        self.budget = budget
+        self.documents = []
+        self.clock = itertools.count(1)
+        self.directory = None
+
+    def __len__(self):
+        return len(self.documents)
+
+    def __getitem__(self, index):
+        return self.documents[index]
+
+    def index(self, document):
+        return self.documents.index(document)
+
+    def add(self, document):
+        self.documents.append(document)
+        self.touch(document)
+
+    def remove(self, document):
+        self.documents.remove(document)
+        document.close()
+
+    def touch(self, document):
+        document.last_used = next(self.clock)
+
+    @property
+    def memory_used(self):
+        return sum(document.nbytes for document in self.documents)
+
+    @property
+    def spill_directory(self):
+        if self.directory is None:
+            self.directory = tempfile.TemporaryDirectory(prefix="edifyx-documents-")
+        return self.directory.name
+
+    def select_evictions(self, active):
+        """Marks least recently used documents as evicted until the budget is met; returns them"""
+        used = self.memory_used
+        evicted = []
+        candidates = sorted(self.documents, key=lambda document: document.last_used)
+        for document in candidates:
+            if used <= self.budget:
+                break
+            if document is active or document.evicted or document.restoring or document.pipeline is None:
+                continue
+            size = document.nbytes
+            document.evicted = True
+            document.preview_scale = document.keep_preview()
+            used -= size - document.nbytes
+            evicted.append(document)
+        return evicted
@@ -0,0 +1,288 @@
+import os
+import stat
+import struct
+import tempfile
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from lazy import LazyModule
+from profiling import profiler
+
+cv2 = LazyModule("cv2")
+np = LazyModule("numpy")
+
+CHUNK_SIZE = 4 * 1024 * 1024  # Bytes read or written between progress reports and cancellation checks
+PNG_COMPRESSION = 3  # Default export settings
+JPEG_QUALITY = 95
+PNG_CHUNK_SIZE = 1024 * 1024  # Largest IDAT chunk written (OpenCV rejects very large ones)
+
+
+def default_file_mode():
+    """Permissions a newly created file would get (mkstemp files are private by default)"""
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+FILE_MODE = default_file_mode()
+
+
+class Cancelled(Exception):
+    """Raised inside a read or write when the user cancelled it"""
+
+
+def check(cancelled):
+    if cancelled is not None and cancelled():
+        raise Cancelled()
+
+
+def encode_params(extension, png_compression = PNG_COMPRESSION, jpeg_quality = JPEG_QUALITY, progressive = False):
+    """cv2.imencode parameters for an output format (".png", ".jpg", ...)"""
+    extension = extension.lower()
+    if extension in (".jpg", ".jpeg"):
+        return [cv2.IMWRITE_JPEG_QUALITY, int(jpeg_quality), cv2.IMWRITE_JPEG_PROGRESSIVE, int(progressive)]
+    if extension == ".png":
+        return [cv2.IMWRITE_PNG_COMPRESSION, int(png_compression)]
+    return []
+
+
+def read_image(path, progress = None, cancelled = None):
+    """Reads a file in chunks (reporting progress, cancellable) and decodes it; returns None if it isn't an image"""
+    size = os.path.getsize(path)
+    data = bytearray(size)
+    view = memoryview(data)
+    offset = 0
+    with profiler.span("read"), open(path, "rb") as file:
+        while offset < size:
+            check(cancelled)
+            read = file.readinto(view[offset:offset + CHUNK_SIZE])
+            if not read:
+                break
+            offset += read
+            if progress is not None:
+                progress(offset / size)
+
+    check(cancelled)
+    if offset == 0:
+        return None  # cv2.imdecode raises for an empty buffer
+    with profiler.span("decode"):
+        try:
+            return cv2.imdecode(np.frombuffer(data, dtype=np.uint8, count=offset), cv2.IMREAD_COLOR)
+        except cv2.error:
+            return None
+
+
+def write_image(path, image, params = None, progress = None, cancelled = None):
+    """Encodes and saves an image atomically: the file is only replaced once it was written completely
+
+    The encoded bytes go to a temporary file next to the destination, which is renamed
+    over it at the end; errors and cancellation (raising Cancelled) leave any existing
+    file untouched.
+    """
+    extension = os.path.splitext(path)[1] or ".png"
+    with profiler.span("encode"):
+        ok, encoded = cv2.imencode(extension, image, params or [])
+    if not ok:
+        raise ValueError(f"Could not encode the image as {extension}")
+    check(cancelled)
+
+    data = memoryview(encoded)
+    with profiler.span("write"), replacing(path) as file:
+        for offset in range(0, len(data), CHUNK_SIZE):
+            check(cancelled)
+            file.write(data[offset:offset + CHUNK_SIZE])
+            if progress is not None:
+                progress(min(1.0, (offset + CHUNK_SIZE) / len(data)))
+
+
+@contextmanager
+def replacing(path):
+    """File to write that atomically replaces `path` once the block completes (nothing changes on errors)"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as file:
+            yield file
+            file.flush()
+            os.fsync(file.fileno())
+        os.chmod(temp_path, stat.S_IMODE(os.stat(path).st_mode) if os.path.exists(path) else FILE_MODE)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+class PNGWriter:
+    """Encodes an 8-bit PNG from strips of rows as they come, so the image never has to be in memory at once
+
+    Every strip is "Up" filtered and deflated on its own on a thread pool (like pigz
+    does), and the pieces are joined into the single zlib stream PNG requires.
+    """
+
+    def __init__(self, file, width, height, channels = 3, compression = PNG_COMPRESSION, workers = None):
+        self.file = file
+        self.width, self.height, self.channels = width, height, channels
+        self.compression = compression
+        self.rows = 0
+        self.previous = None  # Last row of the previous strip, the "Up" filter's reference
+        self.checksum = 1  # Adler-32 of the uncompressed stream
+        self.workers = workers or os.cpu_count() or 1
+        self.pool = ThreadPoolExecutor(self.workers, thread_name_prefix="edifyx-png")
+        self.pending = deque()  # Futures of compressed strips, in order
+
+        color_type = {1: 0, 3: 2, 4: 6}[channels]  # Grayscale, RGB, RGBA
+        file.write(b"\x89PNG\r\n\x1a\n")
+        self.chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0))
+        self.chunk(b"IDAT", b"\x78\x9c")  # zlib header
+
+    def chunk(self, kind, data):
+        self.file.write(png_chunk(kind, data))
+
+    def write(self, strip):
+        """Adds the next rows (BGR or BGRA like OpenCV images, or grayscale)"""
+        if self.channels == 3:
+            strip = cv2.cvtColor(strip, cv2.COLOR_BGR2RGB)
+        elif self.channels == 4:
+            strip = cv2.cvtColor(strip, cv2.COLOR_BGRA2RGBA)
+        rows = strip.reshape(len(strip), -1)
+        filtered = np.empty((len(rows), rows.shape[1] + 1), dtype=np.uint8)
+        filtered[:, 0] = 2  # "Up": every byte minus the one above it
+        np.subtract(rows[1:], rows[:-1], out=filtered[1:, 1:])
+        filtered[0, 1:] = rows[0] if self.previous is None else rows[0] - self.previous
+        self.previous = rows[-1].copy()
+        self.checksum = zlib.adler32(filtered, self.checksum)
+        self.rows += len(rows)
+
+        self.pending.append(self.pool.submit(self.deflate, filtered))
+        while len(self.pending) > self.workers * 2:  # Bounds the memory of strips waiting to be written
+            self.chunk(b"IDAT", self.pending.popleft().result())
+
+    def deflate(self, data):
+        compressor = zlib.compressobj(self.compression, zlib.DEFLATED, -15)  # Raw deflate, the header is written once
+        return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def close(self):
+        """Writes the rest of the data; all rows must have been written"""
+        try:
+            while self.pending:
+                self.chunk(b"IDAT", self.pending.popleft().result())
+        finally:
+            self.abort()
+        if self.rows != self.height:
+            raise ValueError(f"PNG has {self.rows} of its {self.height} rows")
+        self.chunk(b"IDAT", b"\x03\x00" + struct.pack(">I", self.checksum))  # Empty final block, Adler-32
+        self.chunk(b"IEND", b"")
+
+    def abort(self):
+        """Stops compressing (after an error or cancellation)"""
+        self.pending.clear()
+        self.pool.shutdown(cancel_futures=True)
+
+
+class PNGReader:
+    """Decodes a PNG strip by strip, so the whole image never has to be in memory at once
+
+    The zlib stream is inflated incrementally. Each strip of still filtered rows is then
+    decoded by OpenCV as a small uncompressed PNG of its own, headed by the last row
+    of the previous strip so the filters that refer to the row above still work. Only
+    8 and 16-bit grayscale, RGB and RGBA images without interlacing or transparency
+    chunks can be decoded this way (`streamable`); others need cv2.imread.
+    """
+
+    def __init__(self, file):
+        self.file = file
+        if file.read(8) != b"\x89PNG\r\n\x1a\n":
+            raise ValueError("Not a PNG file")
+        self.streamable = True
+        while True:
+            header = file.read(8)
+            if len(header) < 8:
+                raise ValueError("Truncated PNG")
+            length, kind = struct.unpack(">I4s", header)
+            if kind == b"IDAT":
+                self.remaining = length  # Bytes of the current IDAT chunk still to read
+                break
+            data = file.read(length)
+            file.read(4)  # CRC
+            if kind == b"IHDR":
+                self.width, self.height, self.depth, self.color_type, _, _, interlace = struct.unpack(">IIBBBBB", data)
+                self.streamable = self.depth in (8, 16) and self.color_type in (0, 2, 6) and not interlace
+            elif kind == b"tRNS":
+                self.streamable = False
+            elif kind == b"IEND":
+                raise ValueError("PNG without image data")
+        self.channels = {0: 1, 2: 3, 6: 4}.get(self.color_type, 1)
+        self.row_bytes = self.width * self.channels * self.depth // 8
+        self.inflater = zlib.decompressobj()
+        self.previous = None  # Last unfiltered row of the previous strip, in PNG byte order
+
+    def read_data(self, size):
+        """Up to `size` bytes of the compressed stream, b"" at its end"""
+        while self.remaining == 0:
+            self.file.read(4)  # CRC
+            header = self.file.read(8)
+            if len(header) < 8:
+                return b""
+            length, kind = struct.unpack(">I4s", header)
+            if kind != b"IDAT":
+                return b""
+            self.remaining = length
+        data = self.file.read(min(size, self.remaining))
+        if not data:
+            raise ValueError("Truncated PNG")
+        self.remaining -= len(data)
+        return data
+
+    def read(self, rows):
+        """The next `rows` rows as decoded by cv2.imread(path, cv2.IMREAD_UNCHANGED)"""
+        needed = rows * (self.row_bytes + 1)
+        raw = bytearray()
+        while len(raw) < needed:
+            if self.inflater.unconsumed_tail:
+                data = self.inflater.unconsumed_tail
+            else:
+                data = self.read_data(CHUNK_SIZE)
+                if not data:
+                    raise ValueError("Truncated PNG")
+            try:
+                raw += self.inflater.decompress(data, needed - len(raw))  # Bounded, however well the data compresses
+            except zlib.error:
+                raise ValueError("Corrupt PNG") from None
+
+        if self.previous is not None:
+            raw[:0] = b"\x00" + self.previous  # Filter "None": the row as it is
+        header = struct.pack(">IIBBBBB", self.width, len(raw) // (self.row_bytes + 1), self.depth, self.color_type, 0, 0, 0)
+        data = zlib.compress(raw, 0)
+        strip = b"".join([b"\x89PNG\r\n\x1a\n", png_chunk(b"IHDR", header)]
+                         + [png_chunk(b"IDAT", data[i:i + PNG_CHUNK_SIZE]) for i in range(0, len(data), PNG_CHUNK_SIZE)]
+                         + [png_chunk(b"IEND", b"")])
+        decoded = cv2.imdecode(np.frombuffer(strip, np.uint8), cv2.IMREAD_UNCHANGED)
+        if decoded is None:
+            raise ValueError("Corrupt PNG")
+        if self.previous is not None:
+            decoded = decoded[1:]
+
+        last = decoded[-1:]
+        if self.channels == 3:
+            last = cv2.cvtColor(last, cv2.COLOR_BGR2RGB)
+        elif self.channels == 4:
+            last = cv2.cvtColor(last, cv2.COLOR_BGRA2RGBA)
+        self.previous = last.astype(">u2" if self.depth == 16 else np.uint8).tobytes()
+        return decoded
+
+
+def png_chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(data, zlib.crc32(kind)))
+
+
+def to_color(image):
+    """An image as cv2.IMREAD_UNCHANGED decodes it, converted like cv2.IMREAD_COLOR would have (8-bit BGR)"""
+    if image.dtype == np.uint16:
+        image = (image >> 8).astype(np.uint8)
+    if image.ndim == 2:
+        return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    if image.shape[2] == 4:
+        return cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+    return image
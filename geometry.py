@@ -0,0 +1,197 @@
+import math
+
+from buffers import pool
+from lazy import LazyModule
+from parallel import executor
+
+cv2 = LazyModule("cv2")
+np = LazyModule("numpy")
+
+
+def crop_image(image, rect):
+    """Returns the (x1, y1, x2, y2) region of the image (a view, not a copy)"""
+    x1, y1, x2, y2 = rect
+    return image[y1:y2, x1:x2]
+
+
+def rotate_image(image, angle, interpolation = None):
+    """Rotates the image counter-clockwise around its center by `angle` degrees
+
+    Multiples of 90 degrees are lossless and swap width and height when needed; other
+    angles enlarge the image to fit its corners.
+    """
+    return apply_geometry(image, ("rotate", angle), interpolation)
+
+
+def clip_rect(rect, shape):
+    """Clips an (x, y, w, h) rectangle to an image shape, returning (x1, y1, x2, y2) or None if empty"""
+    x, y, w, h = rect
+    x1, y1 = max(0, x), max(0, y)
+    x2, y2 = min(shape[1], x + w), min(shape[0], y + h)
+    if x2 <= x1 or y2 <= y1:
+        return None
+    return x1, y1, x2, y2
+
+
+def union_rect(a, b):
+    """Smallest (x, y, w, h) rectangle containing both rectangles"""
+    x1, y1 = min(a[0], b[0]), min(a[1], b[1])
+    x2, y2 = max(a[0] + a[2], b[0] + b[2]), max(a[1] + a[3], b[1] + b[3])
+    return (x1, y1, x2 - x1, y2 - y1)
+
+
+def scale_geometry(geometry, scale):
+    """Crop/rotate operations for a version of the source `scale` times as large"""
+    scaled = []
+    for kind, value in geometry:
+        if kind == "crop":
+            x1, y1, x2, y2 = (round(coordinate * scale) for coordinate in value)
+            value = (x1, y1, max(x1 + 1, x2), max(y1 + 1, y2))
+        scaled.append((kind, value))
+    return scaled
+
+
+def quarter_turns(angle):
+    """Number of counter-clockwise 90 degree turns (0-3) for multiples of 90 degrees, else None"""
+    if angle % 90 != 0:
+        return None
+    return int(angle // 90) % 4
+
+
+def pixel_rect(x1, y1, x2, y2):
+    """Outline of the pixels in [x1, x2) x [y1, y2) as a polygon (pixel centers are at integer coordinates)"""
+    return np.float32([[x1 - 0.5, y1 - 0.5], [x2 - 0.5, y1 - 0.5], [x2 - 0.5, y2 - 0.5], [x1 - 0.5, y2 - 0.5]])
+
+
+def affine(M):
+    """3x3 version of a 2x3 affine matrix"""
+    return np.vstack([M, [0, 0, 1]])
+
+
+def rotation_step(w, h, angle):
+    """(3x3 matrix, (w, h)) rotating a w x h image counter-clockwise onto a canvas that fits its corners"""
+    turns = quarter_turns(angle)
+    if turns is not None:
+        # Exact pixel mappings, so quarter turns never resample
+        step = np.array([
+            [[1, 0, 0], [0, 1, 0]],
+            [[0, 1, 0], [-1, 0, w - 1]],
+            [[-1, 0, w - 1], [0, -1, h - 1]],
+            [[0, -1, h - 1], [1, 0, 0]],
+        ][turns] + [[0, 0, 1]], dtype=np.float64)
+        return step, ((h, w) if turns % 2 else (w, h))
+
+    cos, sin = abs(math.cos(math.radians(angle))), abs(math.sin(math.radians(angle)))
+    size = (max(1, round(w * cos + h * sin)), max(1, round(w * sin + h * cos)))
+    step = cv2.getRotationMatrix2D(((w - 1) / 2, (h - 1) / 2), angle, 1.0)
+    step[:, 2] += ((size[0] - w) / 2, (size[1] - h) / 2)  # Centered on the larger canvas
+    return affine(step), size
+
+
+def geometry_transform(geometry, shape):
+    """Composes crop/rotate operations into one transform from source to output pixels
+
+    Returns (M, size, bounds): the 2x3 affine matrix, the output (w, h) and the convex
+    polygon (in output pixel coordinates) the crops left of the source, or None without
+    crops. Rotations turn the source, or the last crop, by all the angles since then at
+    once onto a canvas fitting its corners, so nothing is clipped and consecutive
+    rotations give the same result as one rotation by their sum.
+    """
+    M = np.eye(3)
+    h, w = shape[:2]
+    bounds = None
+    frame, frame_M, frame_bounds, angle = (w, h), M, None, 0  # The source or the last crop, and the angle since
+
+    for kind, value in geometry:
+        if kind == "crop":
+            x1, y1, x2, y2 = value
+            crop = pixel_rect(x1, y1, x2, y2)
+            bounds = crop if bounds is None else cv2.intersectConvexConvex(bounds, crop)[1].reshape(-1, 2)
+            step = np.array([[1, 0, -x1], [0, 1, -y1], [0, 0, 1]], dtype=np.float64)
+            bounds = cv2.transform(bounds[None], step[:2])[0]
+            M = step @ M
+            w, h = x2 - x1, y2 - y1
+            frame, frame_M, frame_bounds, angle = (w, h), M, bounds, 0
+        else:
+            angle += value
+            step, (w, h) = rotation_step(*frame, angle)
+            M = step @ frame_M
+            if frame_bounds is not None:
+                bounds = cv2.transform(frame_bounds[None], step[:2])[0]
+
+    return M[:2], (w, h), bounds
+
+
+def map_points(points, M):
+    """(x, y) points moved by a 2x3 affine matrix, as an (n, 2) float64 array"""
+    return cv2.transform(np.float64(points).reshape(1, -1, 2), np.float64(M))[0]
+
+
+def map_rect(rect, M, margin = 1):
+    """(x, y, w, h) bounding box of the pixels of an (x, y, w, h) rectangle moved by M
+
+    Grown by `margin` pixels for the neighbors that interpolation reads.
+    """
+    x, y, w, h = rect
+    corners = map_points([(x, y), (x + w - 1, y), (x, y + h - 1), (x + w - 1, y + h - 1)], M)
+    x1, y1 = (int(value) - margin for value in np.floor(corners.min(axis=0)))
+    x2, y2 = (int(value) + margin + 1 for value in np.ceil(corners.max(axis=0)))
+    return (x1, y1, x2 - x1, y2 - y1)
+
+
+# cv2.rotate code (by name) for the linear part of a lossless transform
+QUARTER_TURN_CODES = {
+    (1, 0, 0, 1): None,
+    (0, 1, -1, 0): "ROTATE_90_COUNTERCLOCKWISE",
+    (-1, 0, 0, -1): "ROTATE_180",
+    (0, -1, 1, 0): "ROTATE_90_CLOCKWISE",
+}
+
+
+def whole_pixels(M):
+    """Whether a transform only moves whole pixels (crops and quarter turns), so it never resamples"""
+    return (np.allclose(M, np.round(M), atol=1e-6)
+            and tuple(np.round(M[:, :2]).astype(int).ravel()) in QUARTER_TURN_CODES)
+
+
+def apply_transform(image, M, size, bounds = None, interpolation = None):
+    """Resamples the image once through a composed transform (see geometry_transform)
+
+    Crops combined with quarter turns are done losslessly with slicing and cv2.rotate;
+    a pure crop returns a view. Other transforms use `interpolation` (default bilinear).
+    """
+    w, h = size
+    exact = np.allclose(M, np.round(M), atol=1e-6)  # Whole pixel offsets, no scaling or odd angles
+    code = QUARTER_TURN_CODES.get(tuple(np.round(M[:, :2]).astype(int).ravel()), False)
+
+    if exact and code is not False:
+        # Source rectangle covered by the output, from the inverse of the output's corners
+        corners = cv2.transform(np.float64([[[0, 0], [w - 1, h - 1]]]), cv2.invertAffineTransform(M))[0]
+        x1, y1 = np.round(corners.min(axis=0)).astype(int)
+        x2, y2 = np.round(corners.max(axis=0)).astype(int) + 1
+        if x1 >= 0 and y1 >= 0 and x2 <= image.shape[1] and y2 <= image.shape[0]:
+            region = image[y1:y2, x1:x2]
+            return region if code is None else cv2.rotate(region, getattr(cv2, code))
+
+    output = executor.warp_affine(image, M, (w, h), interpolation)
+
+    # Parts of the source that an earlier crop removed must stay empty
+    if bounds is not None:
+        area, _ = cv2.intersectConvexConvex(bounds, pixel_rect(0, 0, w, h)) if len(bounds) >= 3 else (0, None)
+        if area == 0:
+            output[:] = 0
+        elif area < w * h - 0.5:
+            mask = pool.zeros((h, w))
+            cv2.fillConvexPoly(mask, np.round(bounds * 16).astype(np.int32), 255, cv2.LINE_AA, shift=4)
+
+            def clear_outside(y1, y2):
+                outside = mask[y1:y2] == 0
+                np.copyto(output[y1:y2], 0, where=outside[:, :, None] if output.ndim == 3 else outside)
+            executor.map_rows(clear_outside, output.shape)
+            pool.give(mask)
+    return output
+
+
+def apply_geometry(image, op, interpolation = None):
+    """Applies a single ("crop", rect) or ("rotate", angle) operation"""
+    return apply_transform(image, *geometry_transform([op], image.shape), interpolation)
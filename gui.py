@@ -1,22 +1,169 @@
-from PyQt6.QtWidgets import QApplication, QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QFrame, QLabel, QFileDialog, QSlider,QInputDialog
-from PyQt6.QtGui import QIcon, QPixmap, QFont, QImage, QMouseEvent, QKeyEvent
-from PyQt6.QtCore import Qt, QSize, QPoint
-import sys, os
-import numpy as np
-import cv2
-
-MAIN_ICON = "./assets/icons/main_icon.png"
+from PyQt6.QtWidgets import QApplication, QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QFrame, QLabel, QFileDialog, QSlider,QInputDialog, QProgressBar, QListWidget, QListWidgetItem, QTabBar
+from PyQt6.QtGui import QIcon, QPixmap, QFont, QMouseEvent, QPainter, QPen, QColor, QKeySequence, QShortcut, QRegion
+from PyQt6.QtCore import Qt, QSize, QPoint, QRect, QThreadPool, QTimer, pyqtSignal
+import sys, os, math, threading, time
+
+from brush import BRUSH_SPACING, spaced_points
+from buffers import pool
+from display import DisplayBuffer
+from documents import Document, DocumentCache
+from fileio import JPEG_QUALITY, PNG_COMPRESSION, Cancelled, encode_params, read_image, write_image
+from geometry import rotate_image
+from history import GeometryEdit, History, LayerEdit, StrokeEdit
+from layers import AdjustmentLayer, PaintLayer
+from lazy import LazyModule
+from pipeline import Pipeline, make_proxy
+from previews import PREVIEW_SIZE, PreviewCache
+from profiling import profiled, profiler
+from project import PROJECT_EXTENSION, Project, autosave_path
+from pyramid import ImagePyramid
+from render import RenderScheduler
+from streaming import export_streaming, streams
+from tiles import TILED_LOAD_PIXELS, TiledImage, image_size, read_reduced
+
+# Imported by the first image operation, not at startup
+cv2 = LazyModule("cv2")
+np = LazyModule("numpy")
+
+# Assets are found relative to this file, so the editor can be started from any directory
+ICONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets", "icons")
+MAIN_ICON = os.path.join(ICONS_DIR, "main_icon.png")
+ICON_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "edifyx", "icons")  # SVG icons pre-rendered to PNG
+TOOLBAR_ICON_SIZE = 15
 
 BG_COLOR = "#121212"
 CANVAS_COLOR = "#212121"
 SPANEL_COLOR = "#282828"
 SPANEL_TXT_COLOR = "#787878"
 SPANEL_HEADING_COLOR = "#3d3b3b"
+SELECTION_COLOR = "#6B679C"
+CROP_COLOR = "#FFFF00"
+
+VIEWPORT_MARGIN = 128  # Extra screen pixels rendered around the visible area so small pans don't re-render
+OVERLAY_REFRESH_MS = 500  # Update interval of the profiling statistics overlay
+BRUSH_FRAME_MS = 16  # Pointer samples are buffered and painted together at most once per this interval
+AUTOSAVE_INTERVAL_MS = 10_000  # What changed in the open documents is saved to their project files this often
+CLOSE_POLL_MS = 50  # How often a closing window checks whether its last saves are done
+
+# Shared by all buttons of a panel: set once on the panel instead of parsed again for every button
+BUTTON_STYLE = """
+    QPushButton {{
+        background-color: transparent;
+        color: {color};
+        padding: 5px;
+        border: none;
+    }}
+    QPushButton:hover {{
+        background-color: rgba(255, 255, 255, 0.1);  /* Light transparent white */
+        border-radius: 5px;
+    }}
+"""
+
+
+def cached_icon(file_name, size, ratio = 1.0):
+    """Icon from assets/icons; SVGs are rendered once and cached as PNGs, so later starts skip the SVG parser"""
+    source = os.path.join(ICONS_DIR, file_name)
+    pixels = round(size * ratio)
+    try:
+        stamp = int(os.path.getmtime(source))
+    except OSError:
+        return QIcon(source)
+    cached = os.path.join(ICON_CACHE_DIR, f"{os.path.splitext(file_name)[0]}-{pixels}-{stamp}.png")
+
+    pixmap = QPixmap(cached)
+    if pixmap.isNull():
+        pixmap = QIcon(source).pixmap(pixels, pixels)
+        try:
+            os.makedirs(ICON_CACHE_DIR, exist_ok=True)
+            pixmap.save(cached)
+        except OSError:
+            pass  # The cache is only an optimization
+    pixmap.setDevicePixelRatio(ratio)
+    return QIcon(pixmap)
+
+
+# Window attributes that belong to the shown document and are swapped on a tab switch
+DOCUMENT_STATE = ("cv_image", "original_image", "image_path", "pipeline", "history", "pyramid", "tiled_image",
+                  "zoom_factor", "image_pos", "active_layer", "proxy_scale", "project")
+
 
 class Window(QWidget):
+    image_loaded = pyqtSignal(object, str, object)  # Decoded image or TiledImage (None on failure), path, load job
+    image_saved = pyqtSignal(object, str)  # Exception (None on success), path
+    io_progress = pyqtSignal(object, float)  # Job, fraction done of the running load or save
+    document_restored = pyqtSignal(object, object, object)  # Document, image (None if it was closed), pyramid
+
     def __init__(self):
         super().__init__()
         self.zoom_factor = 1.0
+        self.cv_image = None
+        self.original_image = None
+        self.image_path = None
+        self.pipeline = None
+        self.proxy_editing = True  # Large images are edited through a screen sized proxy (Ctrl+Shift+P)
+        self.proxy_scale = 1.0  # Width of the original / width of the edited image
+        self.active_layer = None  # Layer selected in the layers panel (brush and sliders work on it)
+        self.pyramid = None  # Downsampled levels of cv_image used for display
+        self.preview_image = None  # Low resolution render shown until the full resolution one is ready
+        self.display = DisplayBuffer()  # Rendered viewport pixels, reused between repaints
+        self.display_mapping = None  # How display pixels map to the pyramid level they came from
+
+        # Slider changes are rendered in the background
+        self.renderer = RenderScheduler()
+        self.renderer.preview_ready.connect(self.show_preview)
+        self.renderer.result_ready.connect(self.show_result)
+
+        # Files are read, decoded, encoded and written in the background
+        self.loading_path = None  # Set while an image is being loaded
+        self.load_scale = 1.0  # Full resolution size / size of the reduced preview shown while loading
+        self.tiled_image = None  # Memory-mapped storage of the current large image
+        self.io_job = None  # threading.Event of the running load or save, set to cancel it
+        self.saving = False
+        self.saved_document = None  # (document, history version) of the image being saved
+        self.export_settings = {"png_compression": PNG_COMPRESSION, "jpeg_quality": JPEG_QUALITY, "progressive": False}
+        self.previews = PreviewCache()  # Pyramid levels of recently opened files, shown while they load
+        self.image_loaded.connect(self.finish_loading)
+        self.image_saved.connect(self.finish_saving)
+        self.io_progress.connect(self.show_io_progress)
+
+        # Open images, one per tab; inactive ones are evicted to disk beyond a memory budget
+        self.documents = DocumentCache()
+        self.document = None  # Shown document
+        self.document_restored.connect(self.finish_restoring)
+
+        # Edits are saved to .edx project files (Ctrl+S), or autosaved to a cache directory until then
+        self.project = None  # Project of the shown document
+        self.closing = False  # Set once the window was asked to close (it closes when its saves are done)
+        self.autosave_enabled = True  # Whether edited documents without a project are saved to the autosave directory
+        self.autosave_timer = QTimer(self)
+        self.autosave_timer.setInterval(AUTOSAVE_INTERVAL_MS)
+        self.autosave_timer.timeout.connect(self.autosave)
+        self.autosave_timer.start()
+        QShortcut(QKeySequence.StandardKey.Save, self).activated.connect(self.save_project)
+        QShortcut(QKeySequence("Ctrl+Shift+S"), self).activated.connect(self.save_project_as)
+
+        # Undo/redo (every document has its own history)
+        self.history = History()
+        self.stroke_edit = None  # Brush tiles saved during the stroke in progress
+        self.brush_hardness = 1.0  # 1 paints hard polylines, lower values soft stamps
+        self.stroke_samples = []  # Pointer positions (image pixels) not painted yet
+        self.stamp_offset = 0.0  # Distance along the stroke to its next soft stamp
+        self.stroke_timer = QTimer(self)
+        self.stroke_timer.setSingleShot(True)
+        self.stroke_timer.setInterval(BRUSH_FRAME_MS)
+        self.stroke_timer.timeout.connect(self.paint_samples)
+        QShortcut(QKeySequence.StandardKey.Undo, self).activated.connect(self.undo)
+        QShortcut(QKeySequence.StandardKey.Redo, self).activated.connect(self.redo)
+        QShortcut(QKeySequence("Ctrl+Y"), self).activated.connect(self.redo)
+        QShortcut(QKeySequence("Escape"), self).activated.connect(self.cancel_io)
+        QShortcut(QKeySequence("Ctrl+Shift+P"), self).activated.connect(self.toggle_proxy_editing)
+
+        # Profiling: F12 toggles it together with the statistics overlay, Ctrl+Shift+T saves a trace
+        QShortcut(QKeySequence("F12"), self).activated.connect(self.toggle_profiling)
+        QShortcut(QKeySequence("Ctrl+Shift+T"), self).activated.connect(self.export_trace)
+        self.overlay_timer = QTimer(self)
+        self.overlay_timer.setInterval(OVERLAY_REFRESH_MS)
+        self.overlay_timer.timeout.connect(self.update_profile_overlay)
         # Get screen size
         screen = QApplication.primaryScreen()
         screen_geometry = screen.geometry()
@@ -48,14 +195,20 @@ class Window(QWidget):
 
         self.image_selected = False
         self.dragging = False
-        self.image_pos = QPoint(0,0)
+        self.image_pos = QPoint(0,0)  # Position of the image's top-left corner on the canvas
         self.last_mouse_pos = QPoint(0,0)
+        self.rendered_rect = QRect()  # Canvas area currently covered by the rendered viewport
+        self.selection_rect = None  # Outline of an interactive selection (e.g. crop), in image label coordinates
+
+        if profiler.enabled:
+            self.profile_overlay.show()
+            self.overlay_timer.start()
 
     # ------- Left Toolbar ----------- #
     def create_toolbar(self):
         toolbar_widget = QWidget()  # Wrapper for styling
         toolbar_widget.setFixedWidth(45)  # Set toolbar width
-        toolbar_widget.setStyleSheet(f"background-color: {CANVAS_COLOR};")  # Apply background color
+        toolbar_widget.setStyleSheet(f"* {{ background-color: {CANVAS_COLOR}; }}" + BUTTON_STYLE.format(color="white"))
 
         toolbar_layout = QVBoxLayout()
         toolbar_layout.setSpacing(30)
@@ -73,22 +226,11 @@ class Window(QWidget):
             "Trash": "Trash.svg"
         }
 
+        ratio = self.devicePixelRatioF()
         for name, icon in icons.items():
             button = QPushButton()
-            button.setIcon(QIcon(f"./assets/icons/{icon}"))  # Set SVG as icon
-            button.setIconSize(QSize(15, 15))  # Adjust icon size
-            button.setStyleSheet("""
-                QPushButton {
-                    background-color: transparent; 
-                    color: white; 
-                    padding: 5px; 
-                    border: none;
-                }
-                QPushButton:hover {
-                    background-color: rgba(255, 255, 255, 0.1);  /* Light transparent white */
-                    border-radius: 5px;
-                }
-            """)
+            button.setIcon(cached_icon(icon, TOOLBAR_ICON_SIZE, ratio))
+            button.setIconSize(QSize(TOOLBAR_ICON_SIZE, TOOLBAR_ICON_SIZE))  # Adjust icon size
             if name == "Import":
                 button.clicked.connect(self.choose_image)
 
@@ -135,14 +277,34 @@ class Window(QWidget):
         canvas_layout = QVBoxLayout(canvas_wrapper)
         canvas_layout.setContentsMargins(30, 30, 30, 30)
 
+        # One tab per open document
+        self.tab_bar = QTabBar()
+        self.tab_bar.setStyleSheet(f"color: {SPANEL_TXT_COLOR};")
+        self.tab_bar.setTabsClosable(True)
+        self.tab_bar.setExpanding(False)
+        self.tab_bar.setDocumentMode(True)
+        self.tab_bar.currentChanged.connect(self.switch_document)
+        self.tab_bar.tabCloseRequested.connect(self.close_tab)
+        canvas_layout.addWidget(self.tab_bar)
+
         canvas = QFrame()
         canvas.setStyleSheet(f"background-color: {CANVAS_COLOR}; border: 2px solid {SPANEL_COLOR};")
         canvas.setMinimumSize(900, 500)
+        self.canvas_frame = canvas
 
         self.image_label = QLabel(canvas)
         self.image_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
         self.image_label.setGeometry(0, 0, 900, 500)
         self.image_label.setScaledContents(False)
+        self.image_label.paintEvent = self.paint_image_label
+
+        # Live profiling statistics, drawn above the image
+        self.profile_overlay = QLabel(canvas)
+        self.profile_overlay.setStyleSheet("background-color: rgba(0, 0, 0, 160); color: #d0d0d0; border: none; padding: 6px;")
+        self.profile_overlay.setFont(QFont("Monospace", 8))
+        self.profile_overlay.setAttribute(Qt.WidgetAttribute.WA_TransparentForMouseEvents)
+        self.profile_overlay.move(8, 8)
+        self.profile_overlay.hide()
         
         canvas_layout.addWidget(canvas, alignment = Qt.AlignmentFlag.AlignCenter)
 
@@ -177,24 +339,13 @@ class Window(QWidget):
         blending_layout.addStretch(1)  
 
         blending_box = QFrame()
-        blending_box.setStyleSheet(f"background-color: {SPANEL_COLOR}; border-radius: 8px; padding: 10px;")
+        blending_box.setStyleSheet(f"* {{ background-color: {SPANEL_COLOR}; border-radius: 8px; padding: 10px; }}"
+                                   + BUTTON_STYLE.format(color=SPANEL_TXT_COLOR))
         blending_box_layout = QVBoxLayout(blending_box)
 
         blending_options = ["Hue", "Saturation", "Luminosity"]
         for option in blending_options:
             btn = QPushButton(option)
-            btn.setStyleSheet("""
-                QPushButton {
-                    background-color: transparent; 
-                    color: #787878; 
-                    padding: 5px; 
-                    border: none;
-                }
-                QPushButton:hover {
-                    background-color: rgba(255, 255, 255, 0.1);  
-                    border-radius: 5px;
-                }
-            """)
             btn.clicked.connect(lambda checked, opt=option: self.adjust_blending(opt))  # Connect to adjust_blending method
             blending_box_layout.addWidget(btn)
 
@@ -231,65 +382,609 @@ class Window(QWidget):
         # -------- Adding to Side Panel Layout --------
         side_layout.addLayout(blending_layout)
 
+        # -------- Layers Section --------
+        layers_label = QLabel("Layers")
+        layers_label.setFont(QFont("Arial", 12, QFont.Weight.Bold))
+        layers_label.setStyleSheet(f"color: {SPANEL_HEADING_COLOR};")
+        layers_label.setAlignment(Qt.AlignmentFlag.AlignHCenter)
+        side_layout.addWidget(layers_label)
+
+        layers_box = QFrame()
+        layers_box.setStyleSheet(f"* {{ background-color: {SPANEL_COLOR}; border-radius: 8px; color: {SPANEL_TXT_COLOR}; }}"
+                                 + BUTTON_STYLE.format(color=SPANEL_TXT_COLOR))
+        layers_box_layout = QVBoxLayout(layers_box)
+
+        # Top layer first; the checkbox of an item toggles its visibility
+        self.layer_list = QListWidget()
+        self.layer_list.setFixedHeight(120)
+        self.layer_list.currentRowChanged.connect(self.select_layer)
+        self.layer_list.itemChanged.connect(self.toggle_layer_visibility)
+        layers_box_layout.addWidget(self.layer_list)
+
+        self.opacity_slider = QSlider(Qt.Orientation.Horizontal)
+        self.opacity_slider.setRange(0, 100)  # Opacity of the selected layer in percent
+        self.opacity_slider.setValue(100)
+        self.opacity_slider.setToolTip("Layer opacity")
+        self.opacity_slider.sliderPressed.connect(self.start_opacity_change)
+        self.opacity_slider.valueChanged.connect(self.set_layer_opacity)
+        layers_box_layout.addWidget(self.opacity_slider)
+
+        layer_buttons = QHBoxLayout()
+        for text, slot in (("+ Paint", self.add_paint_layer), ("+ Adjust", self.add_adjustment_layer), ("Delete", self.delete_layer)):
+            button = QPushButton(text)
+            button.clicked.connect(slot)
+            layer_buttons.addWidget(button)
+        layers_box_layout.addLayout(layer_buttons)
+        side_layout.addWidget(layers_box)
+
+        # -------- File Progress (shown while loading or saving) --------
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setStyleSheet(f"color: {SPANEL_TXT_COLOR}; background-color: {SPANEL_COLOR}; border-radius: 4px;")
+        self.progress_bar.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        self.progress_bar.setVisible(False)
+        side_layout.addWidget(self.progress_bar)
+
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.setStyleSheet(f"color: {SPANEL_TXT_COLOR}; padding: 5px;")
+        self.cancel_button.setVisible(False)
+        self.cancel_button.clicked.connect(self.cancel_io)
+        side_layout.addWidget(self.cancel_button)
+
         return side_panel_frame
 
     def choose_image(self):
         #open a file dialogue for image selection
         file_dialogue = QFileDialog()
-        file_path, _ = file_dialogue.getOpenFileName(self, "Select Image", "", "Images(*.png *.jpg *.jpeg )")
+        file_path, _ = file_dialogue.getOpenFileName(self, "Select Image", "",
+                                                     f"Images and projects(*.png *.jpg *.jpeg *{PROJECT_EXTENSION})")
 
         if file_path:
             print(f"Selected image: {file_path}")
             self.display_image(file_path)
     
-    def display_image(self, image_path):
-        self.cv_image = cv2.imread(image_path)  
-        if self.cv_image is not None:
-            self.image_path = image_path  
+    @profiled("tool open")
+    def display_image(self, image_path, project = None):
+        """Opens an image (or a project's image, applying its edits once loaded) in a new tab and loads it in the background"""
+        if self.saving:
+            print("Please wait until the image has been saved.")
+            return
+        if image_path.lower().endswith(PROJECT_EXTENSION):
+            self.open_project(image_path)
+            return
+        if self.loading_path is not None:
+            self.cancel_io()
+        self.new_document(image_path)
+        self.project = self.document.project = project
+        if project is None and os.path.exists(autosave_path(image_path)):
+            print(f"Unsaved edits of this image were autosaved to {autosave_path(image_path)} "
+                  "(open it to continue them, it is replaced once this image is edited).")
+
+        # A recently opened file is shown right away from the preview cache, until it is decoded
+        cached = self.previews.lookup(image_path)
+        size = image_size(image_path)
+        if size is not None and size[0] * size[1] >= TILED_LOAD_PIXELS:
+            self.load_large_image(image_path, cached)
+            return
 
+        self.loading_path = image_path
+        if cached is not None:
+            (width, _), levels = cached
+            self.show_load_preview(image_path, width, levels[0], ImagePyramid.from_levels(levels))
+        job = self.start_io("Opening")
 
-            self.original_image = self.cv_image.copy()
+        def load():
+            try:
+                image = read_image(image_path, self.progress_callback(job), job.is_set)
+            except Cancelled:
+                return
+            except Exception as error:  # Whatever happened, finish_loading() must close the tab
+                print(f"Error: {error}")
+                image = None
+            self.image_loaded.emit(image, image_path, job)
+        QThreadPool.globalInstance().start(load)
+
+    def load_large_image(self, image_path, cached = None):
+        """Shows a cached preview or a reduced resolution decode right away and decodes the full image in the background"""
+        self.loading_path = image_path
+        if cached is not None:
+            (width, _), levels = cached
+            self.show_load_preview(image_path, width, levels[0], ImagePyramid.from_levels(levels))
+        else:
+            preview = read_reduced(image_path)
+            if preview is not None:
+                self.show_load_preview(image_path, image_size(image_path)[0], preview)
+
+        print(f"Loading {image_path} in the background...")
+        job = self.start_io("Opening")
+
+        def load():
+            try:
+                image = TiledImage.from_file(image_path, self.progress_callback(job), job.is_set)
+            except Exception as error:  # Whatever happened, finish_loading() must replace the preview
+                print(f"Error: {error}")
+                image = None
+            self.image_loaded.emit(image, image_path, job)
+        QThreadPool.globalInstance().start(load)
+
+    def show_load_preview(self, image_path, width, preview, pyramid = None):
+        """Shows a reduced resolution version of the image being loaded"""
+        self.load_scale = width / preview.shape[1]
+        self.zoom_factor *= self.load_scale  # Same size on screen as the full image will have
+        self.set_image(preview, image_path, pyramid=pyramid)
+
+    def finish_loading(self, image, image_path, job):
+        """Shows a loaded image (swapping out the reduced preview of a large one)"""
+        if job is not self.io_job:
+            return  # Cancelled, or another image was opened in the meantime
+        shows_preview = self.load_scale != 1.0
+        self.cancel_loading()
+
+        if image is None:
+            print(f"Error: could not load {image_path}")
+            self.close_document(self.document)
+            return
+
+        if isinstance(image, TiledImage):
+            self.tiled_image = image
+            self.set_image(image.array, image_path, keep_adjustments=shows_preview)
+        else:
+            self.tiled_image = None
+            self.set_image(image, image_path, keep_adjustments=shows_preview)
+        print(f"Loaded {image_path}")
+
+        if self.cv_image is self.pipeline.source:  # Not adjusted while the preview was shown
+            self.cache_preview(image_path)
+        if self.project is not None and self.project.index is not None:
+            self.restore_project()
+
+    def open_project(self, project_path):
+        """Opens a project: loads its source image in a new tab and applies the saved edits once it is loaded"""
+        try:
+            project = Project.open(project_path)
+        except (OSError, ValueError) as error:
+            print(f"Error: could not open {project_path}: {error}")
+            return
+        if not os.path.exists(project.source_path):
+            print(f"Error: the image of {project_path} was not found at {project.source_path}")
+            return
+        self.display_image(project.source_path, project)
+
+    @profiled("tool open project")
+    def restore_project(self):
+        """Replaces the just loaded image's pipeline with the project's edits"""
+        with self.renderer.exclusive():
+            self.pipeline = self.project.restore(self.pipeline.source, self.pipeline.original)
+        self.renderer.set_pipeline(self.pipeline)
+        self.active_layer = self.pipeline.layers[-1]
+        self.history.clear()
+        self.refresh_layer_list()
+        self.render_pipeline()
+        self.store_document()
+        print(f"Opened project {self.project.path}")
+
+    def cache_preview(self, image_path):
+        """Saves the small pyramid levels of a just opened image to the preview cache (in the background)"""
+        size = (self.original_image.shape[1], self.original_image.shape[0])
+        levels = [level.copy() for level in self.pyramid.levels if max(level.shape[:2]) <= PREVIEW_SIZE]
+        QThreadPool.globalInstance().start(lambda: self.previews.store(image_path, size, levels))
+
+    def cancel_loading(self):
+        """Stops a running background load, undoing the preview's zoom compensation"""
+        if self.loading_path is not None:
+            self.finish_io()
+        self.loading_path = None
+        self.zoom_factor /= self.load_scale
+        self.load_scale = 1.0
+
+    def start_io(self, action):
+        """Shows the progress bar for a background load or save and returns its cancellation event"""
+        self.io_job = threading.Event()
+        self.progress_bar.setRange(0, 0)  # Busy indicator until the first progress report
+        self.progress_bar.setFormat(f"{action}... %p%")
+        self.progress_bar.setVisible(True)
+        self.cancel_button.setVisible(True)
+        return self.io_job
+
+    def finish_io(self):
+        """Cancels the running background load or save (if still running) and hides the progress bar"""
+        if self.io_job is not None:
+            self.io_job.set()
+        self.io_job = None
+        self.saving = False
+        self.progress_bar.setVisible(False)
+        self.cancel_button.setVisible(False)
+
+    def progress_callback(self, job):
+        """Progress reporter for a worker thread; reports of cancelled jobs are dropped"""
+        return lambda fraction: None if job.is_set() else self.io_progress.emit(job, fraction)
+
+    def show_io_progress(self, job, fraction):
+        if job is self.io_job:
+            self.progress_bar.setRange(0, 100)
+            self.progress_bar.setValue(round(fraction * 100))
+
+    def cancel_io(self):
+        """Cancels the running load or save (Escape or the Cancel button)"""
+        if self.document is not None and self.document.restoring:
+            return  # Restoring an evicted document can't be cancelled (its data only exists in the cache)
+        if self.loading_path is not None:
+            self.cancel_loading()
+            self.close_document(self.document)  # At most the reduced preview was loaded
+            print("Loading cancelled.")
+        elif self.saving:
+            self.finish_io()
+            print("Export cancelled, no file was written.")
+
+    def is_loading(self):
+        """Editing tools are unavailable while only the reduced preview of an image is shown"""
+        if self.loading_path is not None:
+            print("Image is still loading.")
+            return True
+        return False
+
+    def set_image(self, image, image_path, keep_adjustments = False, pyramid = None):
+        """Starts editing a decoded image in the current document (or a new one)
+
+        `pyramid` can hold already computed display levels of the image.
+        """
+        if self.document is None:
+            self.new_document(image_path)
+        self.image_path = image_path
+
+        self.original_image = image  # Never modified, all edits go through the pipeline
+        proxy = make_proxy(image) if self.proxy_editing else None
+        if proxy is None:
+            self.pipeline = Pipeline(image)
+            self.proxy_scale = 1.0
+        else:
+            # Edits are made on the proxy and replayed on the original when exporting
+            self.pipeline = Pipeline(proxy, image)
+            self.proxy_scale = image.shape[1] / proxy.shape[1]
+            self.zoom_factor *= self.proxy_scale  # Same size on screen as the original would have
+        self.cv_image = self.pipeline.source
+        self.history.clear()
+        if keep_adjustments:
+            for name, slider in self.adjustment_sliders().items():
+                self.pipeline.set_adjustment(name, slider.value())
+            self.cv_image = self.pipeline.render()
+        self.renderer.set_pipeline(self.pipeline)
+        self.active_layer = self.pipeline.layers[-1]
+        self.refresh_layer_list()
+        self.preview_image = None
+        if pyramid is not None:
+            self.pyramid = pyramid
             self.update_image_display()
+        else:
+            self.refresh_image()
 
-            # Enable selection by clicking on the image
-            self.image_label.mousePressEvent = self.select_image
-            self.image_label.mouseMoveEvent = self.move_image
-            self.image_label.mouseReleaseEvent = self.stop_moving
+        # Enable selection by clicking on the image
+        self.image_label.mousePressEvent = self.select_image
+        self.image_label.mouseMoveEvent = self.move_image
+        self.image_label.mouseReleaseEvent = self.stop_moving
+
+        # Enable deselection when clicking outside the image
+        self.canvas.mousePressEvent = self.deselect_image
+
+        self.store_document()
+        self.evict_documents()
+
+    def store_document(self):
+        """Saves the window's image and view state into the shown document"""
+        document = self.document
+        if document is None:
+            return
+        if document.restoring:
+            # Only the view: the image and pipeline are still being restored in the background
+            document.zoom_factor, document.image_pos = self.zoom_factor, QPoint(self.image_pos)
+            return
+        for name in DOCUMENT_STATE:
+            setattr(document, name, getattr(self, name))
+
+    def new_document(self, image_path):
+        """Opens an empty document in a new tab and shows it"""
+        self.store_document()
+        document = Document(image_path)
+        self.documents.add(document)
+        self.tab_bar.blockSignals(True)
+        self.tab_bar.addTab(document.name)
+        self.tab_bar.setCurrentIndex(len(self.documents) - 1)
+        self.tab_bar.blockSignals(False)
+        self.show_document(document)
+        return document
+
+    def switch_document(self, index):
+        """Shows the document of another tab"""
+        if not 0 <= index < len(self.documents) or self.documents[index] is self.document:
+            return
+        document = self.documents[index]
+        if self.loading_path is not None:
+            if self.document.restoring:
+                self.cancel_loading()  # Keeps restoring in the background, only the view is left
+            else:
+                self.cancel_io()  # Closes the tab of the image being opened
+        self.store_document()
+        self.show_document(document)
+        self.tab_bar.blockSignals(True)
+        self.tab_bar.setCurrentIndex(self.documents.index(document))
+        self.tab_bar.blockSignals(False)
+
+    @profiled("tool switch document")
+    def show_document(self, document):
+        """Puts a document's state into the window; evicted ones show their kept preview until restored"""
+        self.document = document
+        self.documents.touch(document)
+        self.reset_view()
+        for name in DOCUMENT_STATE:
+            setattr(self, name, getattr(document, name))
+        if self.image_pos is None:
+            self.image_pos = QPoint(0, 0)
+
+        if document.evicted or document.restoring:
+            self.restore_document(document)
+        else:
+            self.renderer.set_pipeline(self.pipeline)
+            if self.pipeline is not None and not self.pipeline.up_to_date:
+                self.render_pipeline()  # Adjustments that were still being rendered when it was left
+        self.refresh_layer_list()
+        if self.cv_image is not None and self.pyramid is None:
+            self.pyramid = ImagePyramid(self.cv_image)
+        self.update_image_display()
+        self.evict_documents()
+
+    def restore_document(self, document):
+        """Shows an evicted document's preview right away and brings it back in the background"""
+        self.pipeline = None  # Belongs to the restoring worker until finish_restoring
+        self.renderer.set_pipeline(None)
+        self.load_scale = document.preview_scale
+        self.zoom_factor *= self.load_scale  # Same size on screen as the full image will have
+        self.loading_path = document.image_path
+        self.start_io("Restoring")
+        self.cancel_button.setVisible(False)
+
+        if not document.restoring:  # Otherwise it is still being restored from an earlier switch
+            document.evicted = False  # An eviction that didn't start yet will now do nothing
+            document.restoring = True
+            QThreadPool.globalInstance().start(lambda: self.document_restored.emit(document, *document.restore()))
+
+    def finish_restoring(self, document, image, pyramid):
+        document.restoring = False
+        if image is None:
+            return  # Closed while it was being restored
+        document.cv_image, document.pyramid = image, pyramid
+        document.original_image = document.pipeline.full_source
+        if document is not self.document:
+            return
+
+        self.cancel_loading()
+        self.cv_image, self.pyramid = image, pyramid
+        self.original_image, self.pipeline = document.original_image, document.pipeline
+        self.renderer.set_pipeline(self.pipeline)
+        self.preview_image = None
+        self.refresh_layer_list()
+        self.update_image_display()
+
+    def evict_documents(self):
+        """Moves least recently used documents to the disk cache while over the memory budget"""
+        evicted = self.documents.select_evictions(self.document)
+        if evicted:
+            pool.clear()  # Idle scratch buffers go first
+        for document in evicted:
+            self.save_document(document)  # Its pipeline can't be saved while evicted
+            directory = self.documents.spill_directory
+            QThreadPool.globalInstance().start(lambda document=document: document.evict(directory))
+
+    def close_tab(self, index):
+        if 0 <= index < len(self.documents):
+            document = self.documents[index]
+            if document is self.document and self.loading_path is not None and not document.restoring:
+                self.cancel_loading()
+            self.close_document(document)
+
+    def close_document(self, document):
+        """Closes a document, showing its neighbour (or an empty canvas) if it was the shown one"""
+        index = self.documents.index(document)
+        shown = document is self.document
+        if shown:
+            self.cancel_loading()
+            self.document = None
+            self.renderer.set_pipeline(None)
+        self.documents.remove(document)
+        self.tab_bar.blockSignals(True)
+        self.tab_bar.removeTab(index)
+        self.tab_bar.blockSignals(False)
+
+        if not shown:
+            return
+        if len(self.documents):
+            index = min(index, len(self.documents) - 1)
+            self.tab_bar.blockSignals(True)
+            self.tab_bar.setCurrentIndex(index)
+            self.tab_bar.blockSignals(False)
+            self.show_document(self.documents[index])
+        else:
+            self.reset_view()
+
+
+    def render_pipeline(self, region = None):
+        """Re-runs the changed pipeline stages and shows the result"""
+        with self.renderer.exclusive():
+            self.cv_image = self.pipeline.render()
+        self.preview_image = None
+        self.refresh_image(region)
+
+    def show_preview(self, image, generation):
+        """Shows the low resolution render of a background request"""
+        if self.renderer.is_current(generation) and self.cv_image is not None:
+            pool.give(self.preview_image)
+            self.preview_image = image
+            self.update_image_display()
+        else:
+            pool.give(image)
 
-            # Enable deselection when clicking outside the image
-            self.canvas.mousePressEvent = self.deselect_image
+    def show_result(self, image, pyramid, generation, submitted_at):
+        """Shows the full resolution render of a background request"""
+        if not self.renderer.is_current(generation) or self.cv_image is None:
+            pool.give(image)
+            pyramid.release()
+            return
 
+        # The replaced result buffers are reused by the next render (arrays not from the pool are ignored)
+        pool.give(self.cv_image, self.preview_image)
+        if self.pyramid is not None:
+            self.pyramid.release()
+        self.cv_image = image
+        self.pyramid = pyramid
+        self.preview_image = None
+        self.update_image_display()
 
-    def update_image_display(self, image = None):
-        """Updates QLabel with the image"""
+        if profiler.enabled:
+            # From the input to its result on screen (dropped renders are counted by the scheduler)
+            profiler.record("render latency", submitted_at, time.perf_counter() - submitted_at)
+
+    def refresh_image(self, region = None):
+        """Rebuilds the display pyramid after cv_image changed (only `region` if given) and redraws"""
         if self.cv_image is None:
             return
-        
-        # Resize the image based on the zoom factor
-        height, width = self.cv_image.shape[:2]
-        new_width = int(width * self.zoom_factor)
-        new_height = int(height * self.zoom_factor)
-        
-        resized_image = cv2.resize(self.cv_image, (new_width, new_height))
-        rgb_image = cv2.cvtColor(resized_image, cv2.COLOR_BGR2RGB)
-        h, w, ch = rgb_image.shape
-        bytes_per_line = ch * w
-        qimage = QImage(rgb_image.data, w, h, bytes_per_line, QImage.Format.Format_RGB888)
-        pixmap = QPixmap.fromImage(qimage)
-
-        self.image_label.setPixmap(pixmap)
-        self.image_label.resize(w, h)  
-        self.image_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
 
+        if region is None and self.pyramid is not None and self.pyramid.base is self.cv_image:
+            self.pyramid.rebuild()  # The pipeline rendered into the same buffer again
+        elif region is None or self.pyramid is None or self.pyramid.base is not self.cv_image:
+            self.pyramid = ImagePyramid(self.cv_image)
+        else:
+            self.pyramid.invalidate(*region)
+            if self.display_mapping is not None:
+                # Small edit: only patch the touched part of the persistent display buffer
+                self.patch_image_display(region)
+                return
+
+        self.update_image_display()
 
-        if self.image_selected:
-            self.image_label.setStyleSheet("border: 3px solid #6B679C;")  # Green border
+    def update_image_display(self):
+        """Updates QLabel with the visible part of the image"""
+        if self.cv_image is None:
+            return
+
+        zoom = self.zoom_factor
+        if self.preview_image is not None:
+            level = self.preview_image
+            level_scale = level.shape[1] / self.cv_image.shape[1]
+            index = None
         else:
-            self.image_label.setStyleSheet("border: none;")
+            index, level = self.pyramid.level_for_zoom(zoom)
+            level_scale = self.pyramid.level_scale(index)
+        scale = zoom / level_scale  # Screen pixels per level pixel
+        level_h, level_w = level.shape[:2]
+
+        # Visible canvas area (plus margin) expressed in pixels of the chosen pyramid level
+        pos_x, pos_y = self.image_pos.x(), self.image_pos.y()
+        x1 = max(0, math.floor((-VIEWPORT_MARGIN - pos_x) / scale))
+        y1 = max(0, math.floor((-VIEWPORT_MARGIN - pos_y) / scale))
+        x2 = min(level_w, math.ceil((self.canvas_frame.width() + VIEWPORT_MARGIN - pos_x) / scale))
+        y2 = min(level_h, math.ceil((self.canvas_frame.height() + VIEWPORT_MARGIN - pos_y) / scale))
+
+        if x2 <= x1 or y2 <= y1:
+            # The image is panned completely out of view
+            self.display.clear()
+            self.display_mapping = None
+            self.image_label.update()
+            self.rendered_rect = QRect()
+            return
+
+        # Resample only the visible region, so cost and memory don't depend on image size or zoom
+        left, top = round(x1 * scale), round(y1 * scale)
+        new_width = max(1, round(x2 * scale) - left)
+        new_height = max(1, round(y2 * scale) - top)
+        interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+        # Resampled straight into the persistent BGR display buffer, which Qt shows without conversion
+        buffer = self.display.resize(new_width, new_height)
+        with profiler.span("viewport resize"):
+            cv2.resize(level[y1:y2, x1:x2], (new_width, new_height), dst=buffer, interpolation=interpolation)
+        h, w = buffer.shape[:2]
+
+        # Remember the resampling so later edits can patch the display buffer in place
+        if index is None:
+            self.display_mapping = None  # Previews are replaced as a whole
+        else:
+            self.display_mapping = (index, level_scale, x1, y1, (x2 - x1) / w, (y2 - y1) / h)
+
+        self.rendered_rect = QRect(pos_x + left, pos_y + top, w, h)
+        self.image_label.setGeometry(self.rendered_rect)
+        self.image_label.update()
+
+    def patch_image_display(self, region):
+        """Re-renders only the part of the display buffer covering an (x, y, w, h) image region"""
+        index, level_scale, x1, y1, step_x, step_y = self.display_mapping
+        level = self.pyramid.levels[index]
+        buffer = self.display.array
+        buffer_h, buffer_w = buffer.shape[:2]
+        x, y, w, h = region
+
+        # Display buffer pixels touched by the region (one extra pixel for interpolation)
+        left = max(0, math.floor((x * level_scale - x1) / step_x) - 1)
+        top = max(0, math.floor((y * level_scale - y1) / step_y) - 1)
+        right = min(buffer_w, math.ceil(((x + w) * level_scale - x1) / step_x) + 1)
+        bottom = min(buffer_h, math.ceil(((y + h) * level_scale - y1) / step_y) + 1)
+        if right <= left or bottom <= top:
+            return
 
+        # Same pixel mapping cv2.resize used for the full viewport, restricted to the patch
+        M = np.float32([
+            [step_x, 0, x1 + (left + 0.5) * step_x - 0.5],
+            [0, step_y, y1 + (top + 0.5) * step_y - 0.5],
+        ])
+        with profiler.span("viewport patch"):
+            cv2.warpAffine(level, M, (right - left, bottom - top), dst=buffer[top:bottom, left:right],
+                           flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP, borderMode=cv2.BORDER_REPLICATE)
+        self.image_label.update(QRect(left, top, right - left, bottom - top))
+
+    def paint_image_label(self, event):
+        """Paints the persistent display buffer (only the exposed part) onto the image label"""
+        if self.display.empty:
+            return
+        profiler.frame()
+
+        painter = QPainter(self.image_label)
+        rect = event.rect()
+        with profiler.span("upload"):
+            painter.drawImage(rect, self.display.qimage, rect)
+
+        if self.image_selected:
+            painter.setPen(QPen(QColor(SELECTION_COLOR), 3))
+            painter.drawRect(self.image_label.rect().adjusted(1, 1, -2, -2))
+
+        # Selection outlines are drawn over the display buffer, the image itself is never touched
+        if self.selection_rect is not None:
+            painter.setPen(QPen(QColor(CROP_COLOR), 1, Qt.PenStyle.DashLine))
+            painter.drawRect(self.selection_rect)
+        painter.end()
+
+    def set_selection_rect(self, rect):
+        """Shows (or with None hides) a selection outline, repainting only the pixels under its old and new edges"""
+        dirty = QRegion()
+        for outline in (self.selection_rect, rect):
+            if outline is not None:
+                dirty += QRegion(outline.adjusted(-2, -2, 2, 2)).subtracted(QRegion(outline.adjusted(2, 2, -2, -2)))
+        self.selection_rect = rect
+        self.image_label.update(dirty)
+
+    def visible_image_rect(self):
+        """Canvas area where the image is currently visible"""
+        zoom = self.zoom_factor
+        height, width = self.cv_image.shape[:2]
+        image_rect = QRect(self.image_pos.x(), self.image_pos.y(), round(width * zoom), round(height * zoom))
+        return image_rect.intersected(QRect(0, 0, self.canvas_frame.width(), self.canvas_frame.height()))
+
+    def label_to_image(self, point):
+        """Maps a position on the image label to pixel coordinates of cv_image"""
+        canvas_point = self.image_label.pos() + point
+        x = (canvas_point.x() - self.image_pos.x()) / self.zoom_factor
+        y = (canvas_point.y() - self.image_pos.y()) / self.zoom_factor
+        return x, y
 
     def enable_brush(self):
         """Activates brush mode and asks user for brush settings"""
+        if self.is_loading():
+            return
         print("Brush Mode Enabled")
 
         # Disable other tools
@@ -309,9 +1004,15 @@ class Window(QWidget):
             print("Invalid size! Defaulting to 3px.")
             size = 3  # Default size if input is invalid
 
+        # Ask for brush hardness (below 100% the edge fades out)
+        hardness, ok = QInputDialog.getInt(self, "Brush Hardness", "Enter Brush Hardness (%):", value=100, min=0, max=100)
+        if not ok:
+            hardness = 100
+
         # Convert hex color to BGR (OpenCV format)
         self.brush_color = tuple(int(color[i:i+2], 16) for i in (5, 3, 1))  # Convert hex to BGR
         self.brush_size = size
+        self.brush_hardness = hardness / 100
 
         # Enable drawing mode
         self.is_drawing = True
@@ -322,40 +1023,70 @@ class Window(QWidget):
         self.image_label.mouseReleaseEvent = self.stop_drawing
 
 
+    @profiled("tool brush")
     def start_drawing(self, event):
         """Starts drawing on the image"""
         if self.is_drawing and event.button() == Qt.MouseButton.LeftButton:
+            if self.is_loading():
+                return
+            if not isinstance(self.active_layer, PaintLayer):
+                print("Select a paint layer to draw on.")
+                return
             self.last_point = event.pos()
-
+            self.last_image_point = self.label_to_image(event.pos())
+            self.stroke_edit = StrokeEdit(self.active_layer)
+            self.stamp_offset = 0.0
+            self.stroke_samples = [self.last_image_point]  # A click alone leaves a dab
+            self.stroke_timer.start()
 
     def draw(self, event):
-        """Draws on the image with the brush"""
+        """Buffers a pointer position of the stroke; the buffered ones are painted once per frame"""
         if self.is_drawing and self.last_point is not None:
-            if self.cv_image is None:
-                return
-
-            img_height, img_width = self.cv_image.shape[:2]
-            label_width = self.image_label.width()
-            label_height = self.image_label.height()
-
-            scale_x = img_width / label_width
-            scale_y = img_height / label_height
-
-            x1 = int(self.last_point.x() * scale_x)
-            y1 = int(self.last_point.y() * scale_y)
-            x2 = int(event.pos().x() * scale_x)
-            y2 = int(event.pos().y() * scale_y)
+            self.last_point = event.pos()
+            self.stroke_samples.append(self.label_to_image(event.pos()))
+            profiler.count("brush samples")
+            if not self.stroke_timer.isActive():
+                self.stroke_timer.start()
+
+    @profiled("tool brush")
+    def paint_samples(self):
+        """Paints the buffered pointer positions as one polyline (hard brush) or evenly spaced stamps (soft brush)"""
+        if not self.stroke_samples or self.cv_image is None or self.stroke_edit is None:
+            self.stroke_samples = []
+            return
+        points = [self.last_image_point] + self.stroke_samples
+        self.last_image_point = self.stroke_samples[-1]
+        self.stroke_samples = []
+
+        # Strokes go to the selected paint layer, so later adjustments keep them
+        with self.renderer.exclusive(invalidate=True):
+            record = self.stroke_edit.tiles
+            if self.brush_hardness >= 1.0:
+                points = [(int(x), int(y)) for x, y in points]
+                region = self.pipeline.draw_polyline(self.active_layer, points, self.brush_color, self.brush_size, record)
+            else:
+                spacing = max(1.0, self.brush_size * BRUSH_SPACING)
+                centers, self.stamp_offset = spaced_points(points, spacing, self.stamp_offset)
+                if not centers:
+                    return
+                region = self.pipeline.draw_stamps(self.active_layer, centers, self.brush_color, self.brush_size,
+                                                   self.brush_hardness, record)
 
-            cv2.line(self.cv_image, (x1, y1), (x2, y2), self.brush_color, self.brush_size)  # Brush color: Blue, Thickness: 3px
-            
-            self.last_point = event.pos()  # Update last position
-            self.update_image_display()  # Refresh image display
+        # Only the bounding box of the segments has to be recomputed in the pyramid
+        self.render_pipeline(region)
 
     def stop_drawing(self, event):
         """Stops drawing when the mouse is released"""
         if self.is_drawing:
+            self.stroke_timer.stop()
+            self.paint_samples()  # What was buffered since the last frame
             self.last_point = None
 
+            # The whole stroke is one undo step
+            if self.stroke_edit is not None and self.stroke_edit.tiles:
+                self.history.push(self.stroke_edit)
+            self.stroke_edit = None
+
     
     def enable_selection(self):
         """Activates selection mode and disables other tools"""
@@ -365,7 +1096,7 @@ class Window(QWidget):
         self.is_drawing = False
 
         self.image_selected = True
-        self.update_image_display()
+        self.image_label.update()  # Only the selection border changes
 
         # Assign movement-related events to the image label
         self.image_label.mousePressEvent = self.select_image
@@ -376,7 +1107,7 @@ class Window(QWidget):
         """Selects the image and enables movement"""
         if self.image_selected:
             self.dragging = True
-            self.last_mouse_pos = event.pos()  # Store initial mouse position
+            self.last_mouse_pos = event.globalPosition().toPoint()  # Store initial mouse position
             print("Image Selected for Movement")
 
     def deselect_image(self, event):
@@ -384,15 +1115,24 @@ class Window(QWidget):
         print("Image Deselected")
         self.image_selected = False
         self.dragging = False
-        self.update_image_display()
+        self.image_label.update()
 
+    @profiled("tool move")
     def move_image(self, event: QMouseEvent):
         """Moves the image when dragging"""
         if self.dragging:
-            new_pos = event.pos() - self.last_mouse_pos
+            # Global positions, since the label itself moves (and is re-rendered) while dragging
+            mouse_pos = event.globalPosition().toPoint()
+            new_pos = mouse_pos - self.last_mouse_pos
             self.image_pos += new_pos  # Update image position
-            self.image_label.move(self.image_pos)  # Move QLabel
-            self.last_mouse_pos = event.pos() 
+            self.last_mouse_pos = mouse_pos
+
+            self.rendered_rect.translate(new_pos)
+            if self.rendered_rect.contains(self.visible_image_rect()):
+                self.image_label.move(self.rendered_rect.topLeft())  # Already rendered, just move QLabel
+                profiler.count("pans without render")
+            else:
+                self.update_image_display()
 
     def stop_moving(self, event):
         """Stops moving the image when mouse is released"""
@@ -400,12 +1140,14 @@ class Window(QWidget):
             self.dragging = False
             print("Stopped Moving Image")
 
+    @profiled("tool zoom")
     def zoom_in(self):
         """Zoom in on the image"""
         if self.cv_image is not None:
             self.zoom_factor *= 1.2  # Increase zoom factor
             self.update_image_display()
 
+    @profiled("tool zoom")
     def zoom_out(self):
         """Zoom out on the image"""
         if self.cv_image is not None:
@@ -413,31 +1155,240 @@ class Window(QWidget):
             self.update_image_display()
 
     def clear_canvas(self):
-        """Clear the canvas and reset the image label"""
+        """Closes the shown document (Trash button)"""
+        if self.document is not None:
+            self.close_document(self.document)
+        else:
+            self.reset_view()
+
+    def reset_view(self):
+        """Empties the canvas and resets the image label (open documents are kept)"""
         self.cv_image = None  # Clear the current image
+        self.original_image = None
+        self.image_path = None
+        self.pipeline = None
+        self.proxy_scale = 1.0
+        self.active_layer = None
+        self.refresh_layer_list()
+        self.tiled_image = None
+        self.cancel_loading()
+        self.history = History()
+        self.renderer.set_pipeline(None)
+        self.preview_image = None
+        self.pyramid = None
         self.zoom_factor = 1.0  # Reset zoom factor
-        self.image_label.clear()  # Clear the image label
-
+        self.image_pos = QPoint(0, 0)
+        self.rendered_rect = QRect()
+        self.display.clear()
+        self.display_mapping = None
+        self.selection_rect = None
+        self.image_label.update()  # Clear the image label
+
+    @profiled("tool export")
     def export_image(self):
         """Open a file dialog to save the modified image"""
         if self.cv_image is None:
             print("No image to export.")
             return  # Exit if there is no image to export
+        if self.is_loading():
+            return
+
+        if self.saving:
+            print("Please wait until the image has been saved.")
+            return
 
         # Open a file dialog to choose the save location
         file_dialogue = QFileDialog()
         file_path, _ = file_dialogue.getSaveFileName(self, "Save Image", "", "Images (*.png *.jpg *.jpeg)")
 
         if file_path:
-            # Save the current image to the chosen file path
-            success = cv2.imwrite(file_path, self.cv_image)
-            if success:
-                print(f"Image saved successfully at: {file_path}")
-            else:
-                print("Error saving the image.")
+            params = self.ask_encoder_settings(os.path.splitext(file_path)[1])
+            if params is None:
+                return
+
+            # Snapshot of the current result, or of the edits when editing a proxy or exporting strip by strip
+            # (including adjustments still being rendered), so editing can go on while saving
+            with self.renderer.exclusive():
+                original, source = self.pipeline.original, self.pipeline.full_source
+                stream = streams(file_path, source.shape)
+                if original is None and not stream:
+                    image = self.pipeline.render().copy()
+                else:
+                    image, edits = None, self.pipeline.edits()
+
+            job = self.start_io("Saving")
+            self.saving = True
+            self.saved_document = (self.document, self.history.version)
+
+            def save():
+                try:
+                    if stream:
+                        # The edits are rendered and encoded strip by strip, never holding the whole result
+                        with profiler.span("export stream"):
+                            export_streaming(file_path, source, edits, params, self.progress_callback(job), job.is_set)
+                    else:
+                        result = image
+                        if result is None:
+                            # The edits made on the proxy are replayed once on the full resolution original
+                            with profiler.span("export replay"):
+                                result = Pipeline.from_edits(original, edits).render(job.is_set)
+                            if result is None:
+                                raise Cancelled()
+                        write_image(file_path, result, params, self.progress_callback(job), job.is_set)
+                    error = None
+                except (Cancelled, OSError, ValueError) as exception:
+                    error = exception
+                self.image_saved.emit(error, file_path)
+            QThreadPool.globalInstance().start(save)
+
+    def save_project(self):
+        """Saves the shown document to its project file (Ctrl+S), asking for one the first time"""
+        if self.project is None or self.project.is_autosave:
+            self.save_project_as()
+        elif self.cv_image is not None and not self.is_loading():
+            self.store_document()
+            self.save_document(self.document, report=True)
+
+    def save_project_as(self):
+        """Saves the shown document to a new project file (Ctrl+Shift+S); later edits are saved there"""
+        if self.cv_image is None:
+            print("No image to save.")
+            return
+        if self.is_loading():
+            return
+        file_path, _ = QFileDialog.getSaveFileName(self, "Save Project", os.path.splitext(self.image_path)[0] + PROJECT_EXTENSION,
+                                                   f"Edify-X project (*{PROJECT_EXTENSION})")
+        if not file_path:
+            return
+        if not file_path.lower().endswith(PROJECT_EXTENSION):
+            file_path += PROJECT_EXTENSION
+
+        autosave = self.project if self.project is not None and self.project.is_autosave else None
+        self.project = Project(file_path, self.image_path)
+        self.store_document()
+        # The autosave is no longer needed to recover the edits once the project holds them
+        self.save_document(self.document, report=True, saved=None if autosave is None else autosave.delete)
+
+    def autosave(self):
+        """Saves what changed in every open document since the last save (timer)"""
+        self.store_document()
+        for document in self.documents:
+            if not document.evicted:
+                self.save_document(document)
+
+    def save_document(self, document, report = False, saved = None):
+        """Writes what changed in a document to its project file in the background
+
+        Edited documents without a project are saved to an autosave file. `saved` is
+        called (on a worker thread) once the project file holds the edits.
+        """
+        project = document.project
+        if project is None:
+            path = autosave_path(document.image_path)
+            edited = document.history.undo_stack and document.history.version != document.saved_version
+            if not self.autosave_enabled or not edited or any(other.project is not None and other.project.path == path
+                                                              for other in self.documents):
+                return  # Not edited (since the image was saved), or the same image is autosaved from another tab
+            project = document.project = Project(path, document.image_path)
+            if document is self.document:
+                self.project = project
+        if project.index is not None:
+            return  # Opened, but not applied to the image yet
+        if project.busy:
+            if report:
+                QTimer.singleShot(BRUSH_FRAME_MS, lambda: self.save_document(document, report, saved))
+            return
+
+        # An eviction in progress owns the pipeline; one that hasn't started waits until this is copied
+        if not document.lock.acquire(blocking=False):
+            return
+        try:
+            if document.pipeline is None or document.pipeline.source is None or document.restoring:
+                return
+            with profiler.span("project changes"):
+                changes = project.changes(document.pipeline)
+        finally:
+            document.lock.release()
+
+        if changes is None:
+            if report:
+                print(f"Project saved at {project.path}")
+            if saved is not None:
+                QThreadPool.globalInstance().start(saved)
+            return
+        project.busy = True
+
+        def save():
+            try:
+                project.write(changes)
+                if report:
+                    print(f"Project saved at {project.path}")
+                if saved is not None:
+                    saved()
+            except OSError as error:
+                print(f"Error saving {project.path}: {error}")
+            finally:
+                project.busy = False
+        QThreadPool.globalInstance().start(save)
+
+    def finish_saving(self, error, file_path):
+        document, version = self.saved_document
+        self.saved_document = None
+        if isinstance(error, Cancelled):
+            return  # Already reported by cancel_io
+        self.finish_io()
+        if error is None:
+            print(f"Image saved successfully at: {file_path}")
+            self.discard_autosave(document, version)
+        else:
+            print(f"Error saving the image: {error}")
+
+    def discard_autosave(self, document, version):
+        """Deletes the autosave file of a document whose edits (as of history `version`) were saved as an image
+
+        It is autosaved again once edited after that.
+        """
+        document.saved_version = version
+        path = autosave_path(document.image_path)
+        if any(other is not document and other.project is not None and other.project.path == path
+               for other in self.documents):
+            return  # Autosaved from another tab, with other edits
+        project = self.project if document is self.document else document.project
+        if project is not None and project.is_autosave:
+            document.project = None
+            if document is self.document:
+                self.project = None
+        else:
+            project = Project(path, document.image_path)  # Possibly left by an earlier session
+        QThreadPool.globalInstance().start(project.delete)
+
+    def ask_encoder_settings(self, extension):
+        """Asks for PNG compression or JPEG quality/progressive mode; returns cv2 parameters or None if cancelled"""
+        settings = self.export_settings
+        if extension.lower() == ".png":
+            level, ok = QInputDialog.getInt(self, "PNG Compression", "Compression level (0 = fastest, 9 = smallest file):",
+                                            settings["png_compression"], 0, 9)
+            if not ok:
+                return None
+            settings["png_compression"] = level
+
+        elif extension.lower() in (".jpg", ".jpeg"):
+            quality, ok = QInputDialog.getInt(self, "JPEG Quality", "Quality (1-100):", settings["jpeg_quality"], 1, 100)
+            if not ok:
+                return None
+            progressive, ok = QInputDialog.getItem(self, "JPEG Encoding", "Progressive JPEG:", ["No", "Yes"],
+                                                   int(settings["progressive"]), False)
+            if not ok:
+                return None
+            settings["jpeg_quality"] = quality
+            settings["progressive"] = progressive == "Yes"
+
+        return encode_params(extension, **settings)
 
     def start_crop(self):
         """Implementing crop"""
+        if self.is_loading():
+            return
         self.is_cropping = True
         self.start_point = None
         self.end_point = None
@@ -469,26 +1420,24 @@ class Window(QWidget):
             self.image_label.mouseMoveEvent = None
             self.image_label.mouseReleaseEvent = None
 
+    @profiled("tool crop")
     def crop_image(self):
         """Crops the selected area from the image"""
         if self.start_point and self.end_point:
 
-            if not hasattr(self, "original_image") or self.original_image is None:
-                print("Error: No original image to crop from!")
+            if self.cv_image is None:
+                print("Error: No image to crop from!")
                 return
 
-            label_width = self.image_label.width()
-            label_height = self.image_label.height()
             img_height, img_width = self.cv_image.shape[:2]
 
+            start_x, start_y = self.label_to_image(self.start_point)
+            end_x, end_y = self.label_to_image(self.end_point)
 
-            scale_x = img_width / label_width
-            scale_y = img_height / label_height
-
-            x1 = int(round(min(self.start_point.x(), self.end_point.x()) * scale_x))
-            y1 = int(round(min(self.start_point.y(), self.end_point.y()) * scale_y))
-            x2 = int(round(max(self.start_point.x(), self.end_point.x()) * scale_x))
-            y2 = int(round(max(self.start_point.y(), self.end_point.y()) * scale_y))
+            x1 = int(round(min(start_x, end_x)))
+            y1 = int(round(min(start_y, end_y)))
+            x2 = int(round(max(start_x, end_x)))
+            y2 = int(round(max(start_y, end_y)))
             
             # Ensure the coordinates are within the image bounds
             x1 = max(0, x1)
@@ -497,12 +1446,16 @@ class Window(QWidget):
             y2 = min(img_height, y2)
 
             # Crop the image
-            self.cv_image = self.original_image[y1:y2, x1:x2].copy()
-            self.update_image_display()
+            if x2 > x1 and y2 > y1:
+                with self.renderer.exclusive(invalidate=True):
+                    self.history.push(GeometryEdit(self.pipeline))
+                    self.pipeline.add_geometry(("crop", (x1, y1, x2, y2)))
+                self.render_pipeline()
             
             self.is_cropping = False
             self.start_point = None
             self.end_point = None
+            self.set_selection_rect(None)
 
             self.image_label.setCursor(Qt.CursorShape.ArrowCursor)
             self.image_label.mousePressEvent = self.select_image
@@ -510,26 +1463,9 @@ class Window(QWidget):
             self.image_label.mouseReleaseEvent = self.stop_moving
 
     def update_crop_rectangle(self):
+        """Moves the crop outline overlay; no image pixels are copied or re-rendered while dragging"""
         if self.start_point and self.end_point:
-
-            temp_image = self.cv_image.copy()
-
-            label_width = self.image_label.width()
-            label_height = self.image_label.height()
-            img_height, img_width = self.cv_image.shape[:2]
-
-            scale_x = img_width / label_width
-            scale_y = img_height / label_height
-
-            """Get the coordinates for the rectangle"""
-            x1 = int(min(self.start_point.x(), self.end_point.x()) * scale_x)
-            y1 = int(min(self.start_point.y(), self.end_point.y()) * scale_y)
-            x2 = int(max(self.start_point.x(), self.end_point.x()) * scale_x)
-            y2 = int(max(self.start_point.y(), self.end_point.y()) * scale_y)
-
-            cv2.rectangle(temp_image, (x1, y1), (x2, y2), (0, 255, 255), 2)  # White rectangle
-        
-            self.update_image_display(temp_image)
+            self.set_selection_rect(QRect(self.start_point, self.end_point).normalized())
 
 
     def adjust_blending(self, option):
@@ -548,79 +1484,170 @@ class Window(QWidget):
             self.saturation_slider.setVisible(False)  # Hide the saturation slider
 
     def update_hue(self):
-        if self.cv_image is not None:
-            hue_value = self.hue_slider.value()  # Get slider value (0-360)
+        """Shifts the image hue by the slider value (0-360 degrees)"""
+        self.set_adjustment("hue", self.hue_slider.value())
 
-            # OpenCV hue range is 0-179, so we scale it
-            hue_shift = int((hue_value / 100) * 50)
+    def update_saturation(self):
+        """Scales the image saturation from black & white (0%) to double saturation (200%)."""
+        self.set_adjustment("saturation", self.saturation_slider.value())
 
-            # Convert image to HSV
-            hsv_image = cv2.cvtColor(self.cv_image, cv2.COLOR_BGR2HSV)
+    def update_luminosity(self):
+        """Scales the image luminosity from dark (0%) to double brightness (200%)."""
+        self.set_adjustment("luminosity", self.luminosity_slider.value())
 
-            # Apply hue shift correctly
-            hsv_image[:, :, 0] = (hsv_image[:, :, 0] + hue_shift) % 180
+    @profiled("tool adjust")
+    def set_adjustment(self, name, value):
+        """Updates one adjustment of the selected adjustment layer, or of the image itself
 
-            # Convert back to BGR and update display
-            self.cv_image = cv2.cvtColor(hsv_image, cv2.COLOR_HSV2BGR)
-            self.update_image_display()  # Update the displayed image
+        Only the changed stage and the ones after it are recomputed.
+        """
+        if self.cv_image is not None and self.pipeline is not None:
+            layer = self.adjustment_layer()
 
-    def update_saturation(self):
-        """Adjusts the image saturation from black & white (-100) to max saturation (+100)."""
-        if self.cv_image is not None:
-            sat_value = self.saturation_slider.value()  # Get slider value (-100 to 100)
+            # A slider drag is recorded as a single undo step
+            slider = self.adjustment_sliders()[name]
+            old = self.renderer.adjustment(name, layer)
+            self.history.push_adjustment(name, old, value, merge=slider.isSliderDown(), layer=layer)
 
-            # Convert to HSV color space
-            hsv_image = cv2.cvtColor(self.original_image, cv2.COLOR_BGR2HSV)
-            h, s, v = cv2.split(hsv_image)  # Split into channels
+            # Rendered on the worker thread, results arrive in show_preview/show_result
+            self.renderer.submit(name, value, layer)
 
-            if sat_value == -100:
-                # Completely remove saturation by setting S channel to 0
-                s[:] = 0  
-            else:
-                if sat_value < 0:
-                    # Reduce saturation (fade to grayscale)
-                    scale = 1 + (sat_value / 100)  # Scale factor between 0 (B/W) and 1 (Original)
-                    s = (s * scale).astype(np.uint8)
-                else:
-                    # Increase saturation (boost colors)
-                    scale = 1 + (sat_value / 100)  # Scale factor between 1 (Original) and 2 (Max Boost)
-                    s = np.clip(s * scale, 0, 255).astype(np.uint8)  # Keep values within range
-                
-            # Merge modified channels back and convert to BGR
-            hsv_image = cv2.merge([h, s, v])
-            self.cv_image = cv2.cvtColor(hsv_image, cv2.COLOR_HSV2BGR)
-
-            # Update displayed image
-            self.update_image_display()
+    def adjustment_layer(self):
+        """The adjustment layer the blending sliders edit, or None for the image's own adjustments"""
+        return self.active_layer if isinstance(self.active_layer, AdjustmentLayer) else None
 
-    def update_luminosity(self):
-        """Adjusts the image luminosity from dark (-100) to bright (+100)."""
-        if self.cv_image is not None:
-            lum_value = self.luminosity_slider.value()  # Get slider value (-100 to 100)
+    def undo(self):
+        """Reverts the last edit"""
+        self.step_history(self.history.undo, "Nothing to undo.")
 
-            # Convert image to HSV
-            hsv_image = cv2.cvtColor(self.original_image, cv2.COLOR_BGR2HSV)
-            h, s, v = cv2.split(hsv_image)  # Split into channels
+    def redo(self):
+        """Re-applies the last undone edit"""
+        self.step_history(self.history.redo, "Nothing to redo.")
 
-            if lum_value < 0:
-                # Reduce brightness (darken image)
-                scale = 1 + (lum_value / 100)  # Scale factor between 0 (Dark) and 1 (Original)
-                v = (v * scale).astype(np.uint8)
-            else:
-                # Increase brightness (lighten image)
-                scale = 1 + (lum_value / 100)  # Scale factor between 1 (Original) and 2 (Max Brightness)
-                v = np.clip(v * scale, 0, 255).astype(np.uint8)  # Ensure valid range
-            
-            # Merge modified channels back and convert to BGR
-            hsv_image = cv2.merge([h, s, v])
-            self.cv_image = cv2.cvtColor(hsv_image, cv2.COLOR_HSV2BGR)
+    @profiled("tool undo/redo")
+    def step_history(self, step, empty_message):
+        if self.cv_image is None or self.is_loading():
+            return
 
-            # Update displayed image
-            self.update_image_display()
+        with self.renderer.exclusive(invalidate=True):
+            edit = step(self.pipeline)
+        if edit is None:
+            print(empty_message)
+            return
+
+        # Keep the layers panel and sliders in sync with undone/redone edits
+        if self.active_layer not in self.pipeline.layers:
+            self.active_layer = self.pipeline.layers[-1] if self.pipeline.layers else None
+        self.refresh_layer_list()
+        self.render_pipeline(edit.region)
+
+    def adjustment_sliders(self):
+        return {"hue": self.hue_slider, "saturation": self.saturation_slider, "luminosity": self.luminosity_slider}
+
+    def sync_adjustment_sliders(self):
+        """Moves the blending sliders to the values of what they edit, without triggering updates"""
+        layer = self.adjustment_layer()
+        for name, slider in self.adjustment_sliders().items():
+            slider.blockSignals(True)
+            slider.setValue(self.renderer.adjustment(name, layer))
+            slider.blockSignals(False)
+
+    def refresh_layer_list(self):
+        """Rebuilds the layers panel from the pipeline (top layer first) and syncs the sliders"""
+        self.layer_list.blockSignals(True)
+        self.layer_list.clear()
+        layers = self.pipeline.layers if self.pipeline is not None else []
+        for layer in reversed(layers):
+            item = QListWidgetItem(layer.name)
+            item.setFlags(item.flags() | Qt.ItemFlag.ItemIsUserCheckable)
+            item.setCheckState(Qt.CheckState.Checked if layer.visible else Qt.CheckState.Unchecked)
+            self.layer_list.addItem(item)
+        if self.active_layer in layers:
+            self.layer_list.setCurrentRow(len(layers) - 1 - layers.index(self.active_layer))
+        self.layer_list.blockSignals(False)
+
+        self.opacity_slider.blockSignals(True)
+        self.opacity_slider.setValue(round(self.active_layer.opacity * 100) if self.active_layer is not None else 100)
+        self.opacity_slider.blockSignals(False)
+        if self.pipeline is not None:
+            self.sync_adjustment_sliders()
+
+    def layer_at(self, row):
+        layers = self.pipeline.layers if self.pipeline is not None else []
+        return layers[len(layers) - 1 - row] if 0 <= row < len(layers) else None
+
+    def select_layer(self, row):
+        """Makes a layer the target of the brush and (for adjustment layers) the blending sliders"""
+        self.active_layer = self.layer_at(row)
+        self.refresh_layer_list()
+
+    def change_layers(self, change):
+        """Applies a layer stack change as one undo step and re-renders"""
+        if self.cv_image is None or self.is_loading():
+            self.refresh_layer_list()
+            return
+        with self.renderer.exclusive(invalidate=True):
+            self.history.push(LayerEdit(self.pipeline))
+            change()
+        self.refresh_layer_list()
+        self.render_pipeline()
+
+    def add_layer(self, layer):
+        """Puts a new layer right above the selected one (or on top) and selects it"""
+        def add():
+            layers = self.pipeline.layers
+            index = layers.index(self.active_layer) + 1 if self.active_layer in layers else len(layers)
+            self.pipeline.set_layers(layers[:index] + [layer] + layers[index:])
+            self.active_layer = layer
+        self.change_layers(add)
+
+    def add_paint_layer(self):
+        if self.pipeline is not None:
+            self.add_layer(PaintLayer(f"Paint {len(self.pipeline.layers) + 1}"))
+
+    def add_adjustment_layer(self):
+        if self.pipeline is not None:
+            self.add_layer(AdjustmentLayer(f"Adjustment {len(self.pipeline.layers) + 1}"))
+
+    def delete_layer(self):
+        if self.active_layer is None:
+            print("No layer selected.")
+            return
+        def delete():
+            layers = self.pipeline.layers
+            index = layers.index(self.active_layer)
+            self.pipeline.set_layers(layers[:index] + layers[index + 1:])
+            remaining = self.pipeline.layers
+            self.active_layer = remaining[min(index, len(remaining) - 1)] if remaining else None
+        self.change_layers(delete)
+
+    def toggle_layer_visibility(self, item):
+        layer = self.layer_at(self.layer_list.row(item))
+        if layer is not None:
+            visible = item.checkState() == Qt.CheckState.Checked
+            self.change_layers(lambda: self.pipeline.set_layer_property(layer, "visible", visible))
+
+    def start_opacity_change(self):
+        """A drag of the opacity slider is recorded as a single undo step"""
+        if self.active_layer is not None and self.cv_image is not None and not self.is_loading():
+            with self.renderer.exclusive():
+                self.history.push(LayerEdit(self.pipeline))
+
+    def set_layer_opacity(self, value):
+        layer = self.active_layer
+        if layer is None or self.cv_image is None or self.is_loading():
+            return
+        if not self.opacity_slider.isSliderDown():
+            self.change_layers(lambda: self.pipeline.set_layer_property(layer, "opacity", value / 100))
+            return
+        with self.renderer.exclusive(invalidate=True):
+            self.pipeline.set_layer_property(layer, "opacity", value / 100)
+        self.render_pipeline()
     
+    @profiled("tool rotate")
     def rotate_image(self):
         """Rotates the image by a user-defined angle."""
-        if self.cv_image is not None:
+        if self.cv_image is not None and not self.is_loading():
             # Create input dialog for rotation angle
             dialog = QInputDialog(self)
             dialog.setWindowTitle("Rotate Image")
@@ -631,21 +1658,105 @@ class Window(QWidget):
 
             if ok:  # Check if the user clicked OK
             # Rotate the image
-                self.cv_image = self.rotate_image_by_angle(self.cv_image, angle)
-                self.update_image_display()
+                with self.renderer.exclusive(invalidate=True):
+                    self.history.push(GeometryEdit(self.pipeline))
+                    self.pipeline.add_geometry(("rotate", angle))
+                self.render_pipeline()
                 print(f"Image Rotated by {angle} degrees")
 
+    def toggle_proxy_editing(self):
+        """Switches between editing a screen sized proxy and the full resolution image (Ctrl+Shift+P)"""
+        self.proxy_editing = not self.proxy_editing
+        print(f"Proxy editing {'enabled' if self.proxy_editing else 'disabled'}")
+        if self.pipeline is None or self.is_loading():
+            return
+
+        original = self.pipeline.full_source
+        proxy = make_proxy(original) if self.proxy_editing else None
+        if (proxy is None) == (self.pipeline.original is None):
+            return  # Small image, always edited at full resolution
+        with self.renderer.exclusive(invalidate=True):
+            if proxy is None:
+                self.pipeline.retarget(original)
+            else:
+                self.pipeline.retarget(proxy, original)
+        proxy_scale = original.shape[1] / self.pipeline.source.shape[1]
+        self.zoom_factor *= proxy_scale / self.proxy_scale  # Keeps the size on screen
+        self.proxy_scale = proxy_scale
+
+        # Stroke tiles and crop rectangles recorded at the other resolution no longer fit
+        self.history.clear()
+        print("Undo history cleared.")
+        self.render_pipeline()
+
+    def toggle_profiling(self):
+        """Switches profiling and the statistics overlay on or off"""
+        profiler.set_enabled(not profiler.enabled)
+        self.profile_overlay.setVisible(profiler.enabled)
+        if profiler.enabled:
+            self.overlay_timer.start()
+            self.update_profile_overlay()
+        else:
+            self.overlay_timer.stop()
+        print(f"Profiling {'enabled' if profiler.enabled else 'disabled'}")
+
+    def update_profile_overlay(self):
+        lines = profiler.statistics() or ["Profiling... (no events yet)"]
+        self.profile_overlay.setText("\n".join(lines))
+        self.profile_overlay.adjustSize()
+        self.profile_overlay.raise_()
+
+    def export_trace(self):
+        """Saves the recorded spans as a Chrome trace (open in chrome://tracing or Perfetto)"""
+        file_path, _ = QFileDialog.getSaveFileName(self, "Save Trace", "edifyx-trace.json", "Chrome trace (*.json)")
+        if file_path:
+            count = profiler.export_chrome_trace(file_path)
+            print(f"Saved {count} trace events to {file_path}")
+
+    def closeEvent(self, event):
+        """Hides the window, and closes it once the last changes and any export are saved
+
+        The saves run in the background like autosaves, so closing never waits for the disk.
+        """
+        if not self.closing:
+            self.closing = True
+            self.renderer.shutdown()
+            self.cancel_loading()
+            self.autosave_timer.stop()
+            if self.saving:
+                print("Finishing export...")
+            self.store_document()
+            if self.save_before_closing():
+                self.hide()
+                event.ignore()
+                QTimer.singleShot(CLOSE_POLL_MS, self.finish_closing)
+                return
+
+        for document in list(self.documents):
+            self.documents.remove(document)  # Deletes their cache files
+        trace_path = os.environ.get("EDIFYX_TRACE")
+        if trace_path and profiler.enabled:
+            profiler.export_chrome_trace(trace_path)
+            print(f"Trace saved to {trace_path}")
+        super().closeEvent(event)
+
+    def save_before_closing(self):
+        """Starts saving what changed in every document; returns whether saves or an export are still running"""
+        for document in self.documents:
+            if not document.evicted:
+                self.save_document(document)  # Nothing lost: also saves what changed during an earlier save
+        return self.saving or any(document.restoring or (document.project is not None and document.project.busy)
+                                  for document in self.documents)
+
+    def finish_closing(self):
+        if self.save_before_closing():
+            QTimer.singleShot(CLOSE_POLL_MS, self.finish_closing)
+        else:
+            self.close()
+
     def rotate_image_by_angle(self, image, angle):
         """Rotates the image by the specified angle."""
-        # Get the image dimensions
-        (h, w) = image.shape[:2]
-        # Calculate the center of the image
-        center = (w // 2, h // 2)
-        # Create the rotation matrix
-        M = cv2.getRotationMatrix2D(center, angle, 1.0)
-        # Perform the rotation
-        rotated_image = cv2.warpAffine(image, M, (w, h))
-        return rotated_image
+        return rotate_image(image, angle)
 
 def start():
     app = QApplication([])
@@ -0,0 +1,223 @@
+import os
+import pickle
+import tempfile
+import zlib
+
+from geometry import union_rect
+from layers import tile_rect
+
+HISTORY_MEMORY_LIMIT = 256 * 1024 * 1024  # Bytes of undo data kept in memory before spilling to disk
+HISTORY_MAX_ENTRIES = 500  # Oldest entries beyond this are forgotten
+
+
+def payload_size(value):
+    """Rough number of bytes held by nested tuples/lists/dicts of numpy arrays"""
+    if value is None:
+        return 0
+    if hasattr(value, "nbytes"):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(payload_size(item) for item in value.values())
+    if isinstance(value, (tuple, list)):
+        return sum(payload_size(item) for item in value)
+    return 0
+
+
+class Edit:
+    """An undoable change; apply() swaps the pipeline state with the saved one"""
+
+    def __init__(self, state = None):
+        self.state = state
+        self.spill_path = None
+        self.region = None  # Output region changed by the last apply()
+
+    @property
+    def nbytes(self):
+        return payload_size(self.state)
+
+    def spill(self, directory):
+        """Moves the saved state to a compressed file"""
+        if self.spill_path is None and self.nbytes:
+            fd, self.spill_path = tempfile.mkstemp(suffix=".undo", dir=directory)
+            with os.fdopen(fd, "wb") as file:
+                file.write(zlib.compress(pickle.dumps(self.state, pickle.HIGHEST_PROTOCOL), 1))
+            self.state = None
+
+    def load(self):
+        """Brings a spilled state back into memory"""
+        if self.spill_path is not None:
+            with open(self.spill_path, "rb") as file:
+                self.state = pickle.loads(zlib.decompress(file.read()))
+            self.discard()
+
+    def discard(self):
+        if self.spill_path is not None:
+            os.remove(self.spill_path)
+            self.spill_path = None
+
+    def apply(self, pipeline):
+        """Swaps state with the pipeline and returns the changed (x, y, w, h) output region or None"""
+        raise NotImplementedError
+
+
+class AdjustmentEdit(Edit):
+    """Hue, saturation or luminosity change (of the base image or an adjustment layer): only the value is stored"""
+
+    def __init__(self, name, old, new, layer = None):
+        super().__init__()
+        self.name = name
+        self.old = old
+        self.new = new
+        self.layer = layer
+
+    def apply(self, pipeline):
+        pipeline.set_adjustment(self.name, self.old, self.layer)
+        self.old, self.new = self.new, self.old
+        return None
+
+
+class GeometryEdit(Edit):
+    """Crop or rotation: only the previous operation list is stored (the layers are in source coordinates)"""
+
+    def __init__(self, pipeline):
+        super().__init__()
+        self.geometry = list(pipeline.geometry)
+
+    def apply(self, pipeline):
+        geometry, self.geometry = self.geometry, list(pipeline.geometry)
+        pipeline.set_geometry(geometry)
+        return None
+
+
+class StrokeEdit(Edit):
+    """Brush stroke: only the tiles of its paint layer that the stroke touched, as they were before it"""
+
+    def __init__(self, layer):
+        super().__init__({})
+        self.layer = layer
+        self.length = len(layer.strokes)  # The stroke's entries in the layer's log come after this
+        self.strokes = []  # Log entries to put back on the next apply()
+
+    @property
+    def tiles(self):
+        return self.state
+
+    def apply(self, pipeline):
+        region = None
+        for key, data in self.state.items():
+            current = self.layer.snapshot_tile(key)
+            self.layer.restore_tile(key, data)
+            self.state[key] = current
+
+            rect = tile_rect(key)
+            region = rect if region is None else union_rect(region, rect)
+
+        strokes = self.layer.strokes
+        strokes[self.length:], self.strokes = self.strokes, strokes[self.length:]
+
+        if region is None:
+            return None
+        return pipeline.invalidate_layers(region)
+
+
+class LayerEdit(Edit):
+    """Layer added, removed or changed in visibility or opacity: stores the previous stack"""
+
+    def __init__(self, pipeline):
+        super().__init__()
+        self.stack = self.save(pipeline)
+
+    @staticmethod
+    def save(pipeline):
+        return [(layer, layer.visible, layer.opacity) for layer in pipeline.layers]
+
+    def apply(self, pipeline):
+        stack, self.stack = self.stack, self.save(pipeline)
+        for layer, visible, opacity in stack:
+            layer.visible, layer.opacity = visible, opacity
+        pipeline.set_layers(layer for layer, _, _ in stack)
+        return None
+
+
+class History:
+    """Undo/redo stacks of compact edits with a memory cap
+
+    Once the in-memory payload exceeds `memory_limit`, the oldest entries are written to
+    compressed files in a private temporary directory and loaded back when needed.
+    """
+
+    def __init__(self, memory_limit = HISTORY_MEMORY_LIMIT, max_entries = HISTORY_MAX_ENTRIES):
+        self.memory_limit = memory_limit
+        self.max_entries = max_entries
+        self.undo_stack = []
+        self.redo_stack = []
+        self.directory = None
+        self.version = 0  # Changes whenever an edit is recorded, undone or redone
+
+    def clear(self):
+        for edit in self.undo_stack + self.redo_stack:
+            edit.discard()
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+
+    def push(self, edit):
+        """Records a new edit (this forgets everything that could be redone)"""
+        for undone in self.redo_stack:
+            undone.discard()
+        self.redo_stack.clear()
+
+        self.undo_stack.append(edit)
+        self.version += 1
+        if len(self.undo_stack) > self.max_entries:
+            self.undo_stack.pop(0).discard()
+        self.enforce_limit()
+
+    def push_adjustment(self, name, old, new, merge = False, layer = None):
+        """Records an adjustment; with `merge` it extends the previous one of the same slider (a drag)"""
+        last = self.undo_stack[-1] if self.undo_stack else None
+        if (merge and isinstance(last, AdjustmentEdit) and last.name == name and last.layer is layer
+                and not self.redo_stack):
+            last.new = new
+            self.version += 1
+        else:
+            self.push(AdjustmentEdit(name, old, new, layer))
+
+    def undo(self, pipeline):
+        return self.move(self.undo_stack, self.redo_stack, pipeline)
+
+    def redo(self, pipeline):
+        return self.move(self.redo_stack, self.undo_stack, pipeline)
+
+    def move(self, source, target, pipeline):
+        """Applies the newest edit of one stack and moves it to the other; returns it (or None)"""
+        if not source:
+            return None
+        edit = source.pop()
+        edit.load()
+        edit.region = edit.apply(pipeline)
+        target.append(edit)
+        self.version += 1
+        self.enforce_limit()
+        return edit
+
+    @property
+    def memory_used(self):
+        return sum(edit.nbytes for edit in self.undo_stack + self.redo_stack if edit.spill_path is None)
+
+    def enforce_limit(self):
+        """Spills the oldest in-memory entries to disk until the memory cap is respected"""
+        used = self.memory_used
+        if used <= self.memory_limit:
+            return
+
+        if self.directory is None:
+            self.directory = tempfile.TemporaryDirectory(prefix="edifyx-undo-")
+
+        # Entries furthest from the current state are the least likely to be needed soon
+        candidates = self.undo_stack[:-1] + self.redo_stack[:-1]
+        for edit in candidates:
+            if used <= self.memory_limit:
+                break
+            size = edit.nbytes
+            edit.spill(self.directory.name)
+            used -= size
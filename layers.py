@@ -0,0 +1,505 @@
+import math
+import threading
+
+from adjustments import ADJUSTMENT_DEFAULTS, adjust_in_place, hsv_lut
+from brush import brush_stamp
+from buffers import pool
+from geometry import apply_transform, clip_rect, geometry_transform, map_points, map_rect, whole_pixels
+from lazy import LazyModule
+from parallel import executor
+from profiling import profiler
+
+cv2 = LazyModule("cv2")
+np = LazyModule("numpy")
+
+LAYER_TILE_SIZE = 256  # Granularity of compositing, painted tile tracking and undo snapshots
+
+
+def tile_keys(rect, shape):
+    """(row, column) of every layer tile overlapping an (x, y, w, h) rectangle"""
+    clipped = clip_rect(rect, shape)
+    if clipped is None:
+        return []
+    x1, y1, x2, y2 = clipped
+    return [
+        (row, column)
+        for row in range(y1 // LAYER_TILE_SIZE, (y2 - 1) // LAYER_TILE_SIZE + 1)
+        for column in range(x1 // LAYER_TILE_SIZE, (x2 - 1) // LAYER_TILE_SIZE + 1)
+    ]
+
+
+def all_tile_keys(shape):
+    return tile_keys((0, 0, shape[1], shape[0]), shape)
+
+
+def tile_rect(key):
+    row, column = key
+    return (column * LAYER_TILE_SIZE, row * LAYER_TILE_SIZE, LAYER_TILE_SIZE, LAYER_TILE_SIZE)
+
+
+def tile_slice(key):
+    x, y, w, h = tile_rect(key)
+    return slice(y, y + h), slice(x, x + w)
+
+
+def to_layer(points, geometry, source_shape):
+    """Output coordinates after `geometry` (scaled to a source of the given shape) moved to the source's"""
+    if not geometry:
+        return points
+    M = geometry_transform(geometry, source_shape)[0]
+    return [tuple(point) for point in map_points(points, cv2.invertAffineTransform(M))]
+
+
+def copy_tile(paint, alpha, key):
+    """Copy of one tile's (paint, alpha), or None if nothing is painted there"""
+    rows, columns = tile_slice(key)
+    if not alpha[rows, columns].any():
+        return None
+    return paint[rows, columns].copy(), alpha[rows, columns].copy()
+
+
+class PaintLayer:
+    """Brush strokes kept apart from the image: painted colors plus an alpha plane
+
+    The planes have the size of the source image and stay in its coordinates: crops and
+    rotations move them when they are blended (see blend), like the source itself, so
+    they are resampled once however many there are, and undoing a crop brings back the
+    paint it hid. Paint outside the source (in the corners a rotation adds) is not kept.
+
+    The layer remembers which tiles hold paint, so compositing, snapshots and undo only
+    look at those. Next to the pixels it keeps a resolution independent log of what was
+    painted, so the strokes can be redrawn for another resolution of the image.
+    """
+
+    def __init__(self, name = "Paint"):
+        self.name = name
+        self.visible = True
+        self.opacity = 1.0
+        self.paint = None
+        self.alpha = None
+        self.painted = set()  # Keys of the tiles with any paint
+        self.pending = {}  # Key -> (paint, alpha) of restored tiles not copied into the planes yet
+        self.soft = False  # Whether any alpha is between 0 and 255 (soft brushes)
+        self.unsaved = None  # Keys of the tiles changed since the last project save (None: all of them)
+        self.lock = threading.Lock()  # Guards the loans
+        self.loans = set()  # TileLoans not closed yet
+        # ("polyline", geometry count, points, color, size) and ("stamps", geometry count, centers, color,
+        # size, hardness) with coordinates and size normalized to the output size after the first
+        # `geometry count` crops/rotations
+        self.strokes = []
+
+    @property
+    def empty(self):
+        return not self.painted
+
+    def prepare(self, shape, points, pad, record):
+        """Bounding box (x, y, w, h) of points grown by `pad`; allocates the planes and records the tiles under it
+
+        Tiles touched for the first time are snapshotted into `record` (if given) before
+        being painted, so the stroke can be undone.
+        """
+        xs, ys = [point[0] for point in points], [point[1] for point in points]
+        x, y = math.floor(min(xs)) - pad, math.floor(min(ys)) - pad
+        rect = (x, y, math.ceil(max(xs)) + pad + 1 - x, math.ceil(max(ys)) + pad + 1 - y)
+
+        keys = tile_keys(rect, shape)
+        if record is not None:
+            for key in keys:
+                if key not in record:
+                    record[key] = self.snapshot_tile(key)
+
+        if self.alpha is None:
+            self.paint = np.zeros(shape, dtype=np.uint8)
+            self.alpha = np.zeros(shape[:2], dtype=np.uint8)
+        self.keep_lent(keys)
+        self.load(keys)
+        self.painted.update(keys)
+        if self.unsaved is not None:
+            self.unsaved.update(keys)
+        return rect
+
+    def draw_polyline(self, shape, points, color, size, record = None, grid = None):
+        """Paints connected line segments with a hard brush and returns their bounding box (x, y, w, h)
+
+        The segments are drawn one tile of the source at a time: cv2 rasterizes the edges
+        of a polygon it clips depending on where the image ends, so they always have to
+        end at the same place for any renderer to get the same pixels. `grid` is the
+        ((x, y) origin, shape) of the source for planes covering only part of it.
+        """
+        rect = self.prepare(shape, points, size + 1, record)
+        (x0, y0), source_shape = grid or ((0, 0), shape)
+        x, y, w, h = rect
+        points = np.int32(points) + (x0, y0)
+        for key in tile_keys((x + x0, y + y0, w, h), source_shape):
+            x1, y1, x2, y2 = clip_rect(tile_rect(key), source_shape)
+            polyline = [(points - (x1, y1)).reshape(-1, 1, 2)]
+            inside = clip_rect((x1 - x0, y1 - y0, x2 - x1, y2 - y1), shape)
+            if inside is None:
+                continue
+            px1, py1, px2, py2 = inside
+            if (px2 - px1, py2 - py1) == (x2 - x1, y2 - y1):
+                cv2.polylines(self.paint[py1:py2, px1:px2], polyline, False, color, size)
+                cv2.polylines(self.alpha[py1:py2, px1:px2], polyline, False, 255, size)
+                continue
+            # The tile sticks out of the planes: drawn whole, then the part they hold is copied
+            mask = pool.zeros((y2 - y1, x2 - x1))
+            cv2.polylines(mask, polyline, False, 255, size)
+            drawn = mask[py1 + y0 - y1:py2 + y0 - y1, px1 + x0 - x1:px2 + x0 - x1] > 0
+            np.copyto(self.paint[py1:py2, px1:px2], np.uint8(color), where=drawn[:, :, None])
+            np.copyto(self.alpha[py1:py2, px1:px2], 255, where=drawn)
+            pool.give(mask)
+        return rect
+
+    def draw_stamps(self, shape, centers, color, size, hardness, record = None):
+        """Paints soft brush dabs (the alpha of brush_stamp) over the layer and returns their bounding box"""
+        stamp = brush_stamp(size, hardness)
+        radius = size // 2
+        rect = self.prepare(shape, centers, radius + 1, record)
+        color = np.float32(color)
+        for center_x, center_y in centers:
+            x, y = round(center_x) - radius, round(center_y) - radius
+            clipped = clip_rect((x, y, size, size), shape)
+            if clipped is None:
+                continue
+            x1, y1, x2, y2 = clipped
+            above = stamp[y1 - y:y2 - y, x1 - x:x2 - x]
+            paint, alpha = self.paint[y1:y2, x1:x2], self.alpha[y1:y2, x1:x2]
+
+            # The dab is composited over what is painted already ("over" with straight alpha)
+            below = alpha * np.float32(1 / 255) * (1 - above)
+            total = above + below
+            weight = np.divide(above, total, out=np.zeros_like(above), where=total > 0)
+            paint[...] = paint + (color - paint) * weight[:, :, None] + 0.5
+            alpha[...] = total * 255 + 0.5
+        self.soft = self.soft or hardness < 1
+        return rect
+
+    def snapshot_tile(self, key):
+        """Copy of one tile's (paint, alpha), or None if nothing is painted there"""
+        if key not in self.painted:
+            return None
+        if key in self.pending:
+            return self.pending[key]  # Never modified, so it needn't be copied
+        return copy_tile(self.paint, self.alpha, key)
+
+    def restore_tile(self, key, data):
+        """Puts back a tile saved with snapshot_tile"""
+        if self.alpha is None:
+            if data is None:
+                return
+            raise ValueError("Cannot restore a tile into an unallocated paint layer")
+        rows, columns = tile_slice(key)
+        self.keep_lent((key,))
+        self.pending.pop(key, None)
+        if data is None:
+            self.paint[rows, columns] = 0
+            self.alpha[rows, columns] = 0
+            self.painted.discard(key)
+        else:
+            self.paint[rows, columns], self.alpha[rows, columns] = data
+            self.painted.add(key)
+        if self.unsaved is not None:
+            self.unsaved.add(key)
+
+    def snapshot(self):
+        """Painted tiles and stroke log of the whole layer, or None if it is empty"""
+        if self.alpha is None:
+            return None
+        tiles = {}
+        for key in self.painted:
+            data = self.snapshot_tile(key)
+            if data is not None:
+                tiles[key] = data
+        return self.paint.shape, tiles, list(self.strokes)
+
+    def restore(self, snapshot):
+        """Replaces the layer contents with ones saved by snapshot()
+
+        The tiles are only copied into the planes once they are painted on (they are
+        blended from where they are), so the planes' pages stay untouched, and tiles
+        restored from views of a mapped project file are read from the disk when needed.
+        """
+        self.painted = set()
+        self.pending = {}
+        self.unsaved = None
+        if snapshot is None:
+            self.paint = self.alpha = None
+            self.strokes = []
+            self.soft = False
+            return
+        shape, tiles, strokes = snapshot
+        self.strokes = list(strokes)
+        self.soft = any(stroke[0] == "stamps" for stroke in strokes)
+        self.paint = np.zeros(shape, dtype=np.uint8)
+        self.alpha = np.zeros(shape[:2], dtype=np.uint8)
+        self.pending = {key: data for key, data in tiles.items() if data is not None}
+        self.painted = set(self.pending)
+
+    def load(self, keys):
+        """Copies the restored tiles among `keys` into the planes"""
+        if not self.pending:
+            return
+        for key in keys:
+            data = self.pending.pop(key, None)
+            if data is not None:
+                rows, columns = tile_slice(key)
+                self.paint[rows, columns], self.alpha[rows, columns] = data
+
+    def lend(self, keys):
+        """TileLoan of tiles as they are now, to be read on another thread without copying them here"""
+        loan = TileLoan(self, keys)
+        with self.lock:
+            self.loans.add(loan)
+        return loan
+
+    def keep_lent(self, keys):
+        """Copies the lent tiles among `keys`, which are about to change in place, for their readers"""
+        if not self.loans:
+            return
+        with self.lock:
+            for loan in self.loans:
+                for key in loan.keys.intersection(keys):
+                    loan.keys.discard(key)
+                    loan.copies[key] = copy_tile(*loan.planes, key)
+
+    def replay(self, strokes, geometry, source_shape):
+        """Paints a stroke log for a source of any resolution (`geometry` being scaled to it)"""
+        self.restore(None)
+        shape = tuple(source_shape[:2]) + (3,)
+        sizes = {}
+        for stroke in strokes:
+            if stroke[0] == "transform":
+                continue  # Format 1 projects logged geometry changes, which no longer touch the layers
+            kind, count, points, color, size = stroke[:5]
+            if count not in sizes:
+                sizes[count] = geometry_transform(geometry[:count], source_shape)[1]
+            w, h = sizes[count]
+            size = max(1, round(size * w))
+            if kind == "polyline":
+                points = to_layer([(round(x * w), round(y * h)) for x, y in points], geometry[:count], source_shape)
+                self.draw_polyline(shape, [(round(x), round(y)) for x, y in points], tuple(color), size)
+            else:
+                points = to_layer([(x * w, y * h) for x, y in points], geometry[:count], source_shape)
+                self.draw_stamps(shape, points, tuple(color), size, stroke[5])
+        self.strokes = list(strokes)
+
+    def describe(self):
+        return {"type": "paint", "name": self.name, "visible": self.visible, "opacity": self.opacity,
+                "strokes": list(self.strokes)}
+
+    def blend(self, output, key = None, transform = None):
+        """Draws the layer over one tile of `output` (or all of it, with no key)
+
+        `transform` is the (M, bounds) of geometry_transform moving the layer (in source
+        coordinates) onto the output; without it the two line up. Pending tiles must have
+        been loaded before blending a transformed layer.
+        """
+        if key is None:
+            for tile in (self.painted if transform is None else all_tile_keys(output.shape)):
+                self.blend(output, tile, transform)
+            return
+        rows, columns = tile_slice(key)
+        target = output[rows, columns]
+        if transform is not None:
+            self.blend_transformed(target, key, *transform)
+            return
+        if key not in self.painted:
+            return
+
+        if key in self.pending:
+            paint, alpha = self.pending[key]  # Blended from where it was restored from, without copying it
+        else:
+            paint, alpha = self.paint[rows, columns], self.alpha[rows, columns]
+        self.blend_tile(target, paint, alpha)
+
+    def blend_tile(self, target, paint, alpha):
+        if self.opacity >= 1.0 and not self.soft:
+            # Hard brush alpha is either 0 or 255, so fully opaque paint is a masked copy
+            np.copyto(target, paint, where=alpha[:, :, None] > 0)
+        else:
+            weights, inverse = pool.take(alpha.shape, np.float32), pool.take(alpha.shape, np.float32)
+            np.multiply(alpha, np.float32(self.opacity / 255), out=weights)
+            np.subtract(1, weights, out=inverse)
+            cv2.blendLinear(paint, target, weights, inverse, dst=target)
+            pool.give(weights, inverse)
+
+    def blend_transformed(self, target, key, M, bounds):
+        """Blends the part of the layer that M moves onto output tile `key`
+
+        Crops and quarter turns move whole pixels. Other angles interpolate color times
+        alpha (premultiplied), so edges don't pick up the black of unpainted pixels.
+        """
+        h, w = target.shape[:2]
+        x, y = tile_rect(key)[:2]
+        region = clip_rect(map_rect((x, y, w, h), cv2.invertAffineTransform(M)), self.alpha.shape)
+        if region is None:
+            return
+        x1, y1, x2, y2 = region
+        if not self.painted.intersection(tile_keys((x1, y1, x2 - x1, y2 - y1), self.alpha.shape)):
+            return
+        M = np.array(M, dtype=np.float64)
+        M[:, 2] += M[:, :2] @ (x1, y1) - (x, y)  # From the region's pixels to the tile's
+        if bounds is not None:
+            bounds = bounds - np.float32([x, y])
+        paint, alpha = self.paint[y1:y2, x1:x2], self.alpha[y1:y2, x1:x2]
+
+        if whole_pixels(M):
+            self.blend_tile(target, apply_transform(paint, M, (w, h), bounds), apply_transform(alpha, M, (w, h), bounds))
+            return
+        coverage = pool.take(alpha.shape, np.float32)
+        np.multiply(alpha, np.float32(1 / 255), out=coverage)
+        premultiplied = pool.take(paint.shape, np.float32)
+        np.multiply(paint, coverage[:, :, None], out=premultiplied)
+        color = apply_transform(premultiplied, M, (w, h), bounds)
+        weights = apply_transform(coverage, M, (w, h), bounds)
+        pool.give(coverage, premultiplied)
+
+        # target * (1 - weights * opacity) + color * opacity
+        np.multiply(weights, np.float32(self.opacity), out=weights)
+        blended = target * (1 - weights)[:, :, None]
+        blended += color * np.float32(self.opacity)
+        blended += 0.5
+        np.copyto(target, blended, casting="unsafe")
+
+
+class TileLoan:
+    """Tiles of a paint layer lent to another thread (see PaintLayer.lend)
+
+    Tiles are read straight from the layer's planes; one that is about to be changed
+    before it was read is copied first (copy-on-write), so read() returns the tiles as
+    snapshot_tile did when they were lent. Operations replacing the planes as a whole
+    leave the lent ones intact.
+    """
+
+    def __init__(self, layer, keys):
+        self.layer = layer
+        self.planes = (layer.paint, layer.alpha)
+        self.copies = {key: layer.pending[key] for key in keys if key in layer.pending}  # Key -> data
+        self.keys = set(keys) - set(self.copies)  # Still to be read from `planes`
+
+    def read(self, key):
+        with self.layer.lock:
+            if key in self.copies:
+                return self.copies.pop(key)
+            self.keys.discard(key)
+            return copy_tile(*self.planes, key)
+
+    def close(self):
+        with self.layer.lock:
+            self.layer.loans.discard(self)
+
+
+class AdjustmentLayer:
+    """Hue/saturation/luminosity applied to everything below it in the layer stack"""
+
+    def __init__(self, name = "Adjustment", adjustments = None):
+        self.name = name
+        self.visible = True
+        self.opacity = 1.0
+        self.adjustments = dict(adjustments or ADJUSTMENT_DEFAULTS)
+        self.lut = None  # Built on first use, dropped when a value changes
+
+    @property
+    def empty(self):
+        return self.adjustments == ADJUSTMENT_DEFAULTS
+
+    def set_adjustment(self, name, value):
+        """Changes one value; returns whether anything changed"""
+        if self.adjustments[name] == value:
+            return False
+        self.adjustments[name] = value
+        self.lut = None
+        return True
+
+    def describe(self):
+        return {"type": "adjustment", "name": self.name, "visible": self.visible, "opacity": self.opacity,
+                "adjustments": dict(self.adjustments)}
+
+    def blend(self, output, key = None):
+        """Adjusts one tile of `output` in place (or all of it, with no key)"""
+        if self.lut is None:
+            self.lut = hsv_lut(**self.adjustments)
+        target = output if key is None else output[tile_slice(key)]
+        if self.opacity >= 1.0:
+            adjust_in_place(target, self.lut)
+        else:
+            below = pool.take_like(target)
+            np.copyto(below, target)
+            adjust_in_place(target, self.lut)
+            cv2.addWeighted(target, self.opacity, below, 1 - self.opacity, 0, dst=target)
+            pool.give(below)
+
+
+def layer_from_description(description, geometry, source_shape, snapshot = None):
+    """Layer made from a describe() result, with its strokes replayed for a source of the given shape
+
+    A paint layer `snapshot` (see PaintLayer.snapshot) of the right size is restored
+    instead of replaying the strokes.
+    """
+    if description["type"] == "paint":
+        layer = PaintLayer(description["name"])
+        if snapshot is not None and tuple(snapshot[0]) == tuple(source_shape[:2]) + (3,):
+            layer.restore(snapshot)
+        else:
+            layer.replay(description["strokes"], geometry, source_shape)
+    else:
+        layer = AdjustmentLayer(description["name"], description["adjustments"])
+    layer.visible, layer.opacity = description["visible"], description["opacity"]
+    return layer
+
+
+class Compositor:
+    """Blends a layer stack over a base image, caching the result tile by tile
+
+    After a stroke only the tiles it touched are re-blended; anything else (a new base
+    image, a layer added, removed, hidden or re-adjusted) recomposites everything. Tiles
+    are independent, so they are blended in parallel on the tile executor.
+    """
+
+    def __init__(self):
+        self.output = None
+        self.everything = True
+        self.dirty = set()  # Keys of the output tiles to re-blend
+
+    def invalidate(self, rect = None):
+        """Marks an (x, y, w, h) part of the output (or all of it) as out of date"""
+        if rect is None or self.output is None:
+            self.everything = True
+            self.dirty.clear()
+        elif not self.everything:
+            self.dirty.update(tile_keys(rect, self.output.shape))
+
+    def composite(self, base, layers, transform = None):
+        """Blends the layers over the base; `transform` moves the paint layers onto it (see PaintLayer.blend)"""
+        layers = [layer for layer in layers if layer.visible and layer.opacity > 0 and not layer.empty]
+        if not layers:
+            self.everything = True  # The base is returned as is, so the cached output is not kept up to date
+            self.dirty.clear()
+            return base
+        if transform is not None:
+            for layer in layers:
+                if isinstance(layer, PaintLayer):
+                    layer.load(list(layer.pending))  # Transformed tiles are read from the planes
+
+        def blend_tile(key):
+            rows, columns = tile_slice(key)
+            np.copyto(self.output[rows, columns], base[rows, columns])
+            for layer in layers:
+                if isinstance(layer, PaintLayer):
+                    layer.blend(self.output, key, transform)
+                else:
+                    layer.blend(self.output, key)
+
+        if self.everything or self.output is None or self.output.shape != base.shape:
+            if self.output is None or self.output.shape != base.shape:
+                self.output = np.empty_like(base)
+            with profiler.span("composite"):
+                executor.map(blend_tile, all_tile_keys(base.shape))
+        else:
+            with profiler.span("composite tiles"):
+                executor.map(blend_tile, self.dirty)
+            profiler.count("composited tiles", len(self.dirty))
+
+        self.everything = False
+        self.dirty.clear()
+        return self.output
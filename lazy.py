@@ -0,0 +1,22 @@
+import importlib
+
+
+class LazyModule:
+    """Stand-in for a heavy module (OpenCV, NumPy) that imports it on first attribute access
+
+    Keeps startup fast: the editor window shows up before these are loaded, and they are
+    imported by the first image operation that needs them. Module level code must not
+    touch them (e.g. in constants or default argument values), or the import happens anyway.
+    """
+
+    def __init__(self, name):
+        self.__dict__["_name"] = name
+
+    def __getattr__(self, attribute):
+        module = importlib.import_module(self._name)
+        # Later lookups find the module's attributes directly, without going through here
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attribute)
+
+    def __repr__(self):
+        return f"<lazy module {self._name!r}>"
@@ -1,5 +1,12 @@
 #! /bin/env python3
 
+import sys
+
+if len(sys.argv) > 1 and sys.argv[1] == "batch":
+    # Headless mode, doesn't load PyQt6
+    import batch
+    sys.exit(batch.main(sys.argv[2:]))
+
 import gui
 
 
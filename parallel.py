@@ -0,0 +1,132 @@
+"""Tile-parallel execution of pixel operations on a thread pool
+
+OpenCV kernels (and NumPy copies of plain arrays) release the GIL, so running one per
+band of rows on several threads keeps every core busy. Each band writes a disjoint
+part of a preallocated output, so no locking is needed. Neighborhood operations are split
+by output rows, each band reading all the source pixels its rows depend on (the whole
+source for a warp, see TileExecutor.warp_affine), so band edges leave no seams.
+
+The worker count defaults to the number of cores and can be set with the
+EDIFYX_THREADS environment variable or executor.configure().
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from lazy import LazyModule
+from profiling import profiler
+
+cv2 = LazyModule("cv2")
+np = LazyModule("numpy")
+
+
+def default_workers():
+    """Worker count set with EDIFYX_THREADS, else (or for 0) the number of cores"""
+    setting = os.environ.get("EDIFYX_THREADS", "")
+    try:
+        workers = int(setting) if setting.strip() else 0
+    except ValueError:
+        workers = -1
+    if workers < 0:
+        print(f"Warning: ignoring EDIFYX_THREADS={setting!r}, it must be a number of threads")
+        workers = 0
+    return workers or os.cpu_count() or 1
+
+
+PARALLEL_WORKERS = default_workers()
+PARALLEL_TILE_ROWS = 256  # Height of the bands an image is split into
+PARALLEL_MIN_PIXELS = 512 * 1024  # Smaller images are processed in one piece (handing off costs more)
+
+
+class TileExecutor:
+    """Runs a function over row bands (or any work items) of an image on a shared thread pool"""
+
+    def __init__(self, workers = PARALLEL_WORKERS, tile_rows = PARALLEL_TILE_ROWS, min_pixels = PARALLEL_MIN_PIXELS):
+        self.workers = workers
+        self.tile_rows = tile_rows
+        self.min_pixels = min_pixels
+        self.pool = None  # Started on first parallel use
+        self.lock = threading.Lock()
+        self.local = threading.local()  # Marks the pool's own threads, so nested calls run inline
+
+    def configure(self, workers = None, tile_rows = None):
+        """Changes the worker count and/or band height (e.g. for benchmarks)"""
+        with self.lock:
+            if workers is not None and workers != self.workers:
+                if self.pool is not None:
+                    self.pool.shutdown()
+                    self.pool = None
+                self.workers = max(1, workers)
+            if tile_rows is not None:
+                self.tile_rows = max(1, tile_rows)
+
+    def start_worker(self):
+        self.local.worker = True
+
+    def parallel(self, count):
+        """Whether `count` work items should be spread over the pool"""
+        return self.workers > 1 and count > 1 and not getattr(self.local, "worker", False)
+
+    def map(self, function, items):
+        """Calls function(item) for every item (on the pool if worthwhile) and re-raises the first error"""
+        items = list(items)
+        if not self.parallel(len(items)):
+            for item in items:
+                function(item)
+            return
+        with self.lock:
+            if self.pool is None:
+                self.pool = ThreadPoolExecutor(self.workers, thread_name_prefix="edifyx-tile",
+                                               initializer=self.start_worker)
+            pool = self.pool
+        profiler.count("parallel tiles", len(items))
+        for future in [pool.submit(function, item) for item in items]:
+            future.result()
+
+    def bands(self, shape):
+        """(y1, y2) row ranges covering an image of the given shape"""
+        height = shape[0]
+        if shape[0] * shape[1] < self.min_pixels or self.workers == 1:
+            return [(0, height)]
+        rows = self.tile_rows
+        return [(y, min(y + rows, height)) for y in range(0, height, rows)]
+
+    def map_rows(self, function, shape):
+        """Calls function(y1, y2) for row bands covering an image of the given shape"""
+        self.map(lambda band: function(*band), self.bands(shape))
+
+    def lut(self, source, lut, output):
+        """cv2.LUT into a preallocated output"""
+        def run(y1, y2):
+            cv2.LUT(source[y1:y2], lut, dst=output[y1:y2])
+        self.map_rows(run, source.shape)
+        return output
+
+    def cvt_color(self, source, code, output):
+        """cv2.cvtColor into a preallocated output (per pixel conversions only)"""
+        def run(y1, y2):
+            cv2.cvtColor(source[y1:y2], code, dst=output[y1:y2])
+        self.map_rows(run, source.shape)
+        return output
+
+    def warp_affine(self, image, M, size, flags = None):
+        """cv2.warpAffine computed band by band of output rows
+
+        Every band maps its own output rows back into the whole source, so interpolation
+        near band edges reads the same neighbors as a single call would: no seams.
+        """
+        w, h = size
+        flags = cv2.INTER_LINEAR if flags is None else flags
+        output = np.empty((h, w) + image.shape[2:], dtype=image.dtype)
+
+        def run(y1, y2):
+            # M maps source to output pixels; moving the output up by y1 makes row 0 of the band row y1
+            shifted = np.array(M, dtype=np.float64)
+            shifted[1, 2] -= y1
+            cv2.warpAffine(image, shifted, (w, y2 - y1), dst=output[y1:y2], flags=flags)
+        self.map_rows(run, output.shape)
+        return output
+
+
+executor = TileExecutor()  # Shared by all pixel operations
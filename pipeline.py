@@ -0,0 +1,278 @@
+from adjustments import ADJUSTMENT_DEFAULTS, ADJUSTMENTS, HSVAdjuster, hue_lut, scale_lut
+from geometry import apply_transform, geometry_transform, map_rect, scale_geometry
+from layers import AdjustmentLayer, Compositor, PaintLayer, layer_from_description, to_layer
+from lazy import LazyModule
+from profiling import profiler
+
+cv2 = LazyModule("cv2")
+
+STAGES = ("geometry",) + ADJUSTMENTS + ("layers",)  # Pipeline stage order
+PROXY_SIZE = 2048  # Longest side of the proxy edited in place of larger images
+
+
+def make_proxy(image, size = PROXY_SIZE):
+    """Screen sized version of an image for interactive editing, or None if it is small enough already"""
+    scale = size / max(image.shape[:2])
+    if scale >= 1:
+        return None
+    proxy_size = (max(1, round(image.shape[1] * scale)), max(1, round(image.shape[0] * scale)))
+    with profiler.span("make proxy"):
+        return cv2.resize(image, proxy_size, interpolation=cv2.INTER_AREA)
+
+
+class Pipeline:
+    """Non-destructive edit stack (crop/rotate -> hue -> saturation -> luminosity -> layers)
+
+    The output of every stage is cached, so changing one parameter only recomputes the
+    stages after it. All crops and rotations form a single geometry stage that resamples
+    the source once through their composed transform. The last stage blends the paint
+    and adjustment layers (bottom to top) over the adjusted image; paint layers stay in
+    source coordinates and go through the same transform as they are blended.
+
+    The source can be a proxy of a larger `original`: edits are recorded independently of
+    the resolution (see edits()), so they can be replayed on the original for export.
+    """
+
+    def __init__(self, source, original = None):
+        self.source = source
+        self.original = original  # Full resolution image when `source` is a proxy of it
+        self.geometry = []  # ("crop", (x1, y1, x2, y2)) and ("rotate", angle) operations, in order
+        self.adjustments = dict(ADJUSTMENT_DEFAULTS)
+        self.layers = [PaintLayer("Paint 1")]  # Bottom to top
+        self.compositor = Compositor()
+        self.adjuster = None
+        self.outputs = []  # Cached result of every stage
+        self.dirty = 0  # Index of the first stage that has to be recomputed
+
+    def arrays(self):
+        """Every image buffer the pipeline holds (for memory accounting; may contain views and repeats)"""
+        arrays = [self.source, self.original] + [output for output in self.outputs if output is not None]
+        if self.adjuster is not None and self.adjuster.planes is not None:
+            adjuster = self.adjuster
+            arrays += list(adjuster.planes) + adjuster.adjusted_planes + [adjuster.hsv_buffer, adjuster.output]
+        if self.compositor.output is not None:
+            arrays.append(self.compositor.output)
+        for layer in self.paint_layers():
+            if layer.alpha is not None:
+                arrays += [layer.paint, layer.alpha]
+        return [array for array in arrays if array is not None]
+
+    @property
+    def full_source(self):
+        return self.source if self.original is None else self.original
+
+    def release(self):
+        """Drops the cached stage outputs and buffers; the next render recomputes everything"""
+        self.outputs = []
+        self.adjuster = None
+        self.compositor = Compositor()
+        self.dirty = 0
+
+    @property
+    def up_to_date(self):
+        return self.dirty >= len(STAGES)
+
+    def stage_index(self, name):
+        return STAGES.index(name)
+
+    def invalidate(self, name):
+        """Marks a stage (and everything after it) for recomputation"""
+        self.dirty = min(self.dirty, self.stage_index(name))
+        self.compositor.invalidate()
+
+    def set_adjustment(self, name, value, layer = None):
+        """Changes a base adjustment, or one of an adjustment layer"""
+        if layer is not None:
+            if layer.set_adjustment(name, value):
+                self.invalidate("layers")
+        elif self.adjustments[name] != value:
+            self.adjustments[name] = value
+            self.invalidate(name)
+
+    def sync_adjustments(self, other):
+        """Copies the base and adjustment layer values of another pipeline with the same layers"""
+        for name, value in other.adjustments.items():
+            self.set_adjustment(name, value)
+        for layer, other_layer in zip(self.layers, other.layers):
+            if isinstance(layer, AdjustmentLayer):
+                for name, value in other_layer.adjustments.items():
+                    self.set_adjustment(name, value, layer)
+
+    def add_geometry(self, op):
+        """Appends a crop or rotation (it is composed with the previous ones, not applied on top)"""
+        self.geometry.append(op)
+        self.invalidate("geometry")
+
+    def set_geometry(self, geometry):
+        """Replaces all crop/rotate operations"""
+        self.geometry = list(geometry)
+        self.invalidate("geometry")
+
+    def layer_transform(self):
+        """(M, bounds) moving the paint layers from source to output coordinates, or None if they line up"""
+        if not self.geometry:
+            return None
+        M, _, bounds = geometry_transform(self.geometry, self.source.shape)
+        return M, bounds
+
+    def to_layer(self, points):
+        """Output coordinates moved to the paint layers' (those of the source)"""
+        return to_layer(points, self.geometry, self.source.shape)
+
+    def paint_layers(self):
+        return [layer for layer in self.layers if isinstance(layer, PaintLayer)]
+
+    def snapshot_layers(self):
+        """Contents of every paint layer, in paint_layers() order"""
+        return [layer.snapshot() for layer in self.paint_layers()]
+
+    def restore_layers(self, layers, snapshots):
+        for layer, snapshot in zip(layers, snapshots):
+            layer.restore(snapshot)
+        self.invalidate("layers")
+
+    def set_layers(self, layers):
+        """Replaces the layer stack (adding, removing or reordering layers)"""
+        self.layers = list(layers)
+        self.invalidate("layers")
+
+    def set_layer_property(self, layer, name, value):
+        """Changes a layer's `visible` or `opacity`"""
+        if getattr(layer, name) != value:
+            setattr(layer, name, value)
+            self.invalidate("layers")
+
+    def draw_polyline(self, layer, points, color, size, record = None):
+        """Paints hard brush segments on a paint layer in output coordinates
+
+        Returns the bounding box of the output that changed. `record` gets the tiles in
+        the layer's own (source) coordinates, see PaintLayer.prepare.
+        """
+        shape = self.render().shape
+        moved = [(round(x), round(y)) for x, y in self.to_layer(points)]
+        rect = layer.draw_polyline(self.source.shape, moved, color, size, record)
+        self.log_stroke(layer, "polyline", shape, points, color, size)
+        return self.invalidate_layers(rect)
+
+    def draw_stamps(self, layer, centers, color, size, hardness, record = None):
+        """Paints soft brush dabs on a paint layer in output coordinates, like draw_polyline"""
+        shape = self.render().shape
+        rect = layer.draw_stamps(self.source.shape, self.to_layer(centers), color, size, hardness, record)
+        self.log_stroke(layer, "stamps", shape, centers, color, size, hardness)
+        return self.invalidate_layers(rect)
+
+    def log_stroke(self, layer, kind, shape, points, color, size, *extra):
+        """Appends a stroke to the layer's log, normalized to the output size"""
+        h, w = shape[:2]
+        points = tuple((x / w, y / h) for x, y in points)
+        layer.strokes.append((kind, len(self.geometry), points, tuple(color), size / w) + extra)
+
+    def invalidate_layers(self, rect = None):
+        """Marks an (x, y, w, h) part of the layers (or all of them) as changed
+
+        The rectangle is in layer (source) coordinates. Only the compositor tiles under it
+        are blended again; returns it in output coordinates.
+        """
+        transform = self.layer_transform()
+        if rect is not None and transform is not None:
+            rect = map_rect(rect, transform[0])
+        self.dirty = min(self.dirty, self.stage_index("layers"))
+        self.compositor.invalidate(rect)
+        return rect
+
+    def edits(self):
+        """Resolution independent description of the edit stack (crops are in pixels of `size`)"""
+        return {
+            "size": (self.source.shape[1], self.source.shape[0]),
+            "geometry": list(self.geometry),
+            "adjustments": dict(self.adjustments),
+            "layers": [layer.describe() for layer in self.layers],
+        }
+
+    @classmethod
+    def from_edits(cls, source, edits, original = None, snapshots = None):
+        """Pipeline applying described edits to a source of any resolution; strokes are replayed for it
+
+        `snapshots` can hold saved contents of the paint layers (one per layer, None for
+        adjustment layers), restored instead of replaying when they fit the source.
+        """
+        pipeline = cls(source, original)
+        pipeline.geometry = scale_geometry(edits["geometry"], source.shape[1] / edits["size"][0])
+        pipeline.adjustments = dict(edits["adjustments"])
+        snapshots = snapshots or [None] * len(edits["layers"])
+        pipeline.layers = [layer_from_description(description, pipeline.geometry, source.shape, snapshot)
+                           for description, snapshot in zip(edits["layers"], snapshots)]
+        return pipeline
+
+    def scaled(self, source):
+        """Copy of the edit stack applied to another resolution of the source (previews, export)"""
+        return Pipeline.from_edits(source, self.edits())
+
+    def retarget(self, source, original = None):
+        """Switches to another resolution of the source in place, replaying the strokes
+
+        The layer objects are kept, but pixel based undo data (stroke tiles, crop
+        rectangles) recorded before no longer fits.
+        """
+        edits = self.edits()
+        self.source, self.original = source, original
+        self.geometry = scale_geometry(edits["geometry"], source.shape[1] / edits["size"][0])
+        for layer, description in zip(self.layers, edits["layers"]):
+            if isinstance(layer, PaintLayer):
+                layer.replay(description["strokes"], self.geometry, source.shape)
+        self.release()
+
+    def render(self, cancelled = None):
+        """Recomputes the dirty stages and returns the final image
+
+        `cancelled` is checked between stages; when it returns True rendering stops early
+        (keeping the stages finished so far) and None is returned.
+        """
+        count = len(STAGES)
+        self.outputs.extend([None] * (count - len(self.outputs)))
+
+        for index in range(self.dirty, count):
+            if cancelled is not None and cancelled():
+                return None
+            with profiler.span(f"stage {self.stage_name(index)}"):
+                self.outputs[index] = self.run_stage(index)
+            self.dirty = index + 1
+
+        return self.outputs[-1]
+
+    def run_stage(self, index):
+        name = self.stage_name(index)
+        if name == "geometry":
+            if not self.geometry:
+                return self.source
+            return apply_transform(self.source, *geometry_transform(self.geometry, self.source.shape))
+
+        geometry_output = self.outputs[0]
+        if name == "hue":
+            if self.adjuster is None or self.adjuster.source is not geometry_output:
+                if self.adjuster is not None:
+                    self.adjuster.release()
+                self.adjuster = HSVAdjuster(geometry_output)
+            return self.adjust_plane(0, hue_lut)
+
+        if name == "saturation":
+            return self.adjust_plane(1, scale_lut)
+
+        if name == "luminosity":
+            planes = self.outputs[1:3] + [self.adjust_plane(2, scale_lut)]
+            if all(plane is None for plane in planes):
+                return geometry_output  # Nothing to adjust, skip the HSV round trip
+            return self.adjuster.compose(planes)
+
+        return self.compositor.composite(self.outputs[index - 1], self.layers, self.layer_transform())
+
+    def stage_name(self, index):
+        return STAGES[index]
+
+    def adjust_plane(self, channel, make_lut):
+        """Result plane of an adjustment stage, or None when it leaves the plane unchanged"""
+        name = ADJUSTMENTS[channel]
+        value = self.adjustments[name]
+        if value == ADJUSTMENT_DEFAULTS[name]:
+            return None
+        return self.adjuster.adjust_plane(channel, make_lut(value))
@@ -0,0 +1,137 @@
+import hashlib
+import os
+import pickle
+import tempfile
+
+from lazy import LazyModule
+from profiling import profiler
+
+cv2 = LazyModule("cv2")
+
+PREVIEW_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "edifyx", "previews")
+PREVIEW_CACHE_LIMIT = 512 * 1024 * 1024  # Bytes on disk; least recently used entries are deleted beyond this
+PREVIEW_SIZE = 2048  # Longest side of the largest stored pyramid level (about screen resolution)
+PREVIEW_QUALITY = 90  # JPEG quality of the stored levels (they are only shown until the real image is decoded)
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def content_hash(path):
+    """Hex digest of a file's bytes"""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def stat_key(path):
+    """Name of the file linking a path, as it is now (size and modification time), to its content hash"""
+    info = os.stat(path)
+    text = f"{os.path.realpath(path)}\0{info.st_size}\0{info.st_mtime_ns}"
+    return hashlib.blake2b(text.encode(), digest_size=20).hexdigest() + ".key"
+
+
+class PreviewCache:
+    """On-disk cache of the downsampled pyramid levels of opened images
+
+    Entries are addressed by a hash of the file content, so copies and renamed files
+    share one. A small key file per (path, size, modification time) remembers that hash,
+    so a lookup never has to read the image file itself.
+    """
+
+    def __init__(self, directory = PREVIEW_CACHE_DIR, limit = PREVIEW_CACHE_LIMIT):
+        self.directory = directory
+        self.limit = limit
+
+    def entry_path(self, digest):
+        return os.path.join(self.directory, digest + ".levels")
+
+    def lookup(self, path):
+        """Returns ((width, height) of the full image, levels largest first) for a file, or None"""
+        with profiler.span("preview cache lookup"):
+            try:
+                with open(os.path.join(self.directory, stat_key(path))) as file:
+                    entry_path = self.entry_path(file.read())
+                with open(entry_path, "rb") as file:
+                    size, encoded = pickle.load(file)
+                os.utime(entry_path)  # Marks the entry as recently used
+            except (OSError, pickle.UnpicklingError, ValueError, EOFError):
+                return None
+
+        with profiler.span("preview decode"):
+            levels = [cv2.imdecode(level, cv2.IMREAD_COLOR) for level in encoded]
+        if any(level is None for level in levels):
+            return None
+        return size, levels
+
+    def store(self, path, size, levels):
+        """Saves pyramid levels (largest first, none above PREVIEW_SIZE) of a freshly decoded image
+
+        Meant for a worker thread: hashes the file (unless its key file knows the hash
+        already), encodes the levels unless a copy of the same file is cached already, and
+        trims the cache.
+        """
+        if not levels:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            key_path = os.path.join(self.directory, stat_key(path))
+            try:
+                with open(key_path) as file:
+                    digest, known = file.read(), True  # Same path, size and modification time
+            except FileNotFoundError:
+                with profiler.span("preview hash"):
+                    digest, known = content_hash(path), False
+            entry_path = self.entry_path(digest)
+            if known and os.path.exists(entry_path):
+                return
+            if not os.path.exists(entry_path):
+                with profiler.span("preview encode"):
+                    params = [cv2.IMWRITE_JPEG_QUALITY, PREVIEW_QUALITY]
+                    encoded = [cv2.imencode(".jpg", level, params)[1] for level in levels]
+                self.write(entry_path, pickle.dumps((size, encoded), pickle.HIGHEST_PROTOCOL))
+            if not known:
+                self.write(key_path, digest.encode())
+            self.trim()
+        except OSError as error:
+            print(f"Could not cache the preview of {path}: {error}")
+
+    def write(self, path, data):
+        """Writes a cache file atomically, so concurrent editors never read a partial one"""
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                file.write(data)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def trim(self):
+        """Deletes the least recently used entries (and key files pointing nowhere) beyond the size limit"""
+        entries = []
+        keys = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".levels"):
+                info = entry.stat()
+                entries.append((info.st_mtime, info.st_size, entry.path))
+            elif entry.name.endswith(".key"):
+                keys.append(entry.path)
+
+        used = sum(size for _, size, _ in entries)
+        if used <= self.limit:
+            return
+        entries.sort()
+        for _, size, entry_path in entries:
+            if used <= self.limit:
+                break
+            os.remove(entry_path)
+            used -= size
+
+        for key_path in keys:
+            try:
+                with open(key_path) as file:
+                    if not os.path.exists(self.entry_path(file.read())):
+                        os.remove(key_path)
+            except OSError:
+                pass
@@ -0,0 +1,169 @@
+"""Lightweight instrumentation: timed spans, frame times and event counters
+
+Profiling is off by default and every hook is a single flag check while it is off. It is
+switched on with the EDIFYX_PROFILE=1 environment variable or, in the editor, with F12
+(which also shows the statistics overlay). Recorded spans can be saved as a Chrome trace
+(chrome://tracing or https://ui.perfetto.dev).
+"""
+
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+
+MAX_TRACE_EVENTS = 200_000  # Oldest spans are forgotten beyond this
+RECENT_SAMPLES = 120  # Durations per span name kept for the live statistics
+IDLE_FRAME_GAP = 0.5  # Seconds between repaints after which the gap isn't counted as a frame
+
+NO_SPAN = nullcontext()  # Shared do-nothing context manager used while profiling is disabled
+CO_VARARGS = 0x04  # inspect.CO_VARARGS (inspect itself is slow to import)
+
+
+class Span:
+    """Times a `with` block and records it in a Profiler"""
+
+    __slots__ = ("profiler", "name", "started")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, self.started, time.perf_counter() - self.started)
+        return False
+
+
+class Profiler:
+    """Collects timed spans from any thread, repaint intervals and counters of dropped/coalesced events"""
+
+    def __init__(self, enabled = False):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.events = deque(maxlen=MAX_TRACE_EVENTS)  # (name, start, duration, thread id)
+            self.recent = {}  # Span name -> deque of recent durations
+            self.totals = {}  # Span name -> (count, total seconds)
+            self.counters = {}
+            self.frame_times = deque(maxlen=RECENT_SAMPLES)
+            self.last_frame = None
+
+    def set_enabled(self, enabled):
+        if enabled and not self.enabled:
+            self.reset()
+        self.enabled = enabled
+
+    def span(self, name):
+        """Context manager timing a block under `name` (a shared no-op while disabled)"""
+        if not self.enabled:
+            return NO_SPAN
+        return Span(self, name)
+
+    def record(self, name, started, duration):
+        with self.lock:
+            self.events.append((name, started, duration, threading.get_ident()))
+            if name not in self.recent:
+                self.recent[name] = deque(maxlen=RECENT_SAMPLES)
+                self.totals[name] = (0, 0.0)
+            self.recent[name].append(duration)
+            count, total = self.totals[name]
+            self.totals[name] = (count + 1, total + duration)
+
+    def count(self, name, amount = 1):
+        """Adds to an event counter (e.g. dropped renders, coalesced input)"""
+        if self.enabled:
+            with self.lock:
+                self.counters[name] = self.counters.get(name, 0) + amount
+
+    def frame(self):
+        """Marks a repaint; the time between consecutive repaints is the frame time"""
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        with self.lock:
+            if self.last_frame is not None and now - self.last_frame < IDLE_FRAME_GAP:
+                self.frame_times.append(now - self.last_frame)
+            self.last_frame = now
+
+    def statistics(self):
+        """Text lines summarizing frame times, the slowest spans and the counters"""
+        with self.lock:
+            frames = sorted(self.frame_times)
+            recent = {name: sorted(durations) for name, durations in self.recent.items()}
+            totals = dict(self.totals)
+            counters = dict(self.counters)
+
+        lines = []
+        if frames:
+            average = sum(frames) / len(frames)
+            lines.append(f"frame  {average * 1000:6.1f} ms avg  {percentile(frames, 90) * 1000:6.1f} ms p90"
+                         f"  {1 / average:5.1f} fps")
+        for name, durations in sorted(recent.items(), key=lambda item: -percentile(item[1], 50)):
+            lines.append(f"{name:<22} {percentile(durations, 50) * 1000:7.2f} ms p50"
+                         f" {durations[-1] * 1000:7.2f} ms max  n={totals[name][0]}")
+        for name, value in sorted(counters.items()):
+            lines.append(f"{name:<22} {value}")
+        return lines
+
+    def export_chrome_trace(self, path):
+        """Writes the recorded spans in the Chrome trace event format"""
+        with self.lock:
+            events = list(self.events)
+            counters = dict(self.counters)
+
+        pid = os.getpid()
+        trace = [
+            {"name": name, "ph": "X", "ts": (started - self.origin) * 1e6, "dur": duration * 1e6,
+             "pid": pid, "tid": thread}
+            for name, started, duration, thread in events
+        ]
+        trace.extend(
+            {"name": name, "ph": "C", "ts": (time.perf_counter() - self.origin) * 1e6, "pid": pid,
+             "args": {name: value}}
+            for name, value in counters.items()
+        )
+        with open(path, "w") as file:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, file)
+        return len(events)
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of an already sorted list"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * q / 100))]
+
+
+profiler = Profiler(enabled=os.environ.get("EDIFYX_PROFILE", "") not in ("", "0"))
+
+
+def profiled(name):
+    """Decorator timing every call of a function (tool handlers, loaders) under `name`
+
+    Like PyQt does for plain slots, surplus positional arguments (e.g. the `checked` flag
+    of QPushButton.clicked) are dropped, so decorated methods can still be connected to signals.
+    """
+    def decorator(function):
+        code = function.__code__
+        accepts = None if code.co_flags & CO_VARARGS else code.co_argcount
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if accepts is not None:
+                args = args[:accepts]
+            if not profiler.enabled:
+                return function(*args, **kwargs)
+            with Span(profiler, name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,314 @@
+"""Edify-X project files (.edx): the edits made to an image, saved incrementally
+
+A project refers to its source image by path and stores the edit stack as an operation
+log (Pipeline.edits(): crops, rotations, adjustments, layers and their brush stroke logs)
+plus the painted tiles of every paint layer, so reopening doesn't replay the strokes.
+
+The file is append-only. A save appends the tiles and stroke log entries that changed
+since the previous save, then a JSON index pointing at all current data, then a trailer
+locating the index:
+
+    magic | tiles, strokes | index | trailer | tiles, strokes | index | trailer ...
+
+A save cut short leaves the previous index in place (opening looks for the last complete
+trailer). Tiles are stored raw, so an opened project memory-maps the file and only the
+pages of the tiles it restores are ever read. Once superseded data makes up most of the
+file, the next save rewrites it compactly.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import stat
+import struct
+import tempfile
+import threading
+import weakref
+import zlib
+
+from fileio import FILE_MODE
+from layers import PaintLayer
+from lazy import LazyModule
+from pipeline import Pipeline
+from profiling import profiled, profiler
+
+np = LazyModule("numpy")
+
+PROJECT_EXTENSION = ".edx"
+PROJECT_MAGIC = b"EDX\x01"
+PROJECT_FORMAT = 2
+OUTPUT_LAYERS_FORMAT = 1  # Saved paint layer tiles in output instead of source coordinates; strokes are replayed
+TRAILER_MAGIC = b"EDXINDEX"
+TRAILER = struct.Struct("<QQ8s")  # Index offset, index length, TRAILER_MAGIC
+PROJECT_COMPACT_RATIO = 2  # A save rewrites the file once it is this many times larger than its current data
+AUTOSAVE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "edifyx", "autosave")
+
+
+def autosave_path(image_path):
+    """Project file edits of an image are autosaved to until it is saved as a project"""
+    digest = hashlib.blake2b(os.path.realpath(image_path).encode(), digest_size=8).hexdigest()
+    name = os.path.splitext(os.path.basename(image_path))[0]
+    return os.path.join(AUTOSAVE_DIR, f"{name}-{digest}{PROJECT_EXTENSION}")
+
+
+def read_index(mapping):
+    """(index, end of its trailer) of the last complete save in a mapped project file"""
+    if mapping[:len(PROJECT_MAGIC)] != PROJECT_MAGIC:
+        raise ValueError("Not an Edify-X project")
+    end = len(mapping)
+    while True:
+        position = mapping.rfind(TRAILER_MAGIC, 0, end)
+        start = position + len(TRAILER_MAGIC) - TRAILER.size
+        if position < 0 or start < len(PROJECT_MAGIC):
+            raise ValueError("The project contains no complete save")
+        offset, length, _ = TRAILER.unpack_from(mapping, start)
+        if offset + length == start:
+            try:
+                return json.loads(mapping[offset:start]), start + TRAILER.size
+            except ValueError:
+                pass
+        end = position  # Torn or accidental match, try the save before
+
+
+class Project:
+    """An image's edit stack saved to an .edx file
+
+    changes() notes what changed since the last save (on the GUI thread, without copying
+    any tiles: the paint layers lend them, see TileLoan) and write() appends it to
+    the file (on a worker thread), so saving never waits for the disk or copies the
+    layers on the GUI thread. Only one write() may run at a time.
+    """
+
+    def __init__(self, path, source_path):
+        self.path = path
+        self.source_path = os.path.abspath(source_path)
+        self.lock = threading.Lock()
+        self.busy = False  # Set while a write() started from the GUI runs
+        self.index = None  # Contents of an opened file, until restore() applies them
+        self.mapping = None
+        self.end = None  # End of the last complete save in the file; None: the next save rewrites it
+        self.file_bytes = self.live_bytes = 0
+        self.saved = weakref.WeakKeyDictionary()  # Paint layer -> what the file holds of it
+        self.signature = None  # Everything but the paint layers, as of the last save
+
+    @property
+    def is_autosave(self):
+        return os.path.dirname(os.path.abspath(self.path)) == AUTOSAVE_DIR
+
+    @classmethod
+    def open(cls, path):
+        """Reads a project's index; its tiles stay in the file until restore() (raises OSError or ValueError)"""
+        with open(path, "rb") as file:
+            mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        index, end = read_index(mapping)
+        if index.get("format") not in (OUTPUT_LAYERS_FORMAT, PROJECT_FORMAT):
+            raise ValueError(f"Unsupported project format {index.get('format')}")
+
+        source = index["source"]
+        source_path = source["path"]
+        relative = os.path.join(os.path.dirname(os.path.abspath(path)), source["relative"] or "")
+        if not os.path.exists(source_path) and source["relative"] and os.path.exists(relative):
+            source_path = relative  # The project was moved together with its image
+
+        project = cls(path, source_path)
+        project.index, project.mapping = index, mapping
+        project.end = project.file_bytes = end
+        project.live_bytes = len(PROJECT_MAGIC) + TRAILER.size + TRAILER.unpack_from(mapping, end - TRAILER.size)[1]
+        for entry in index["layers"]:
+            if entry is not None:
+                project.live_bytes += sum(4 * h * w for _, _, _, h, w in entry["tiles"])
+                project.live_bytes += sum(length for _, length in entry["strokes"])
+        return project
+
+    def read_strokes(self, chunks):
+        strokes = []
+        for offset, length in chunks:
+            strokes += json.loads(zlib.decompress(self.mapping[offset:offset + length]))
+        return strokes
+
+    def read_tiles(self, entry):
+        """Tiles of a saved paint layer as (paint, alpha) views of the mapped file"""
+        tiles = {}
+        for row, column, offset, h, w in entry["tiles"]:
+            paint = np.frombuffer(self.mapping, np.uint8, h * w * 3, offset).reshape(h, w, 3)
+            alpha = np.frombuffer(self.mapping, np.uint8, h * w, offset + h * w * 3).reshape(h, w)
+            tiles[(row, column)] = (paint, alpha)
+        return tiles
+
+    @profiled("project restore")
+    def restore(self, source, original = None):
+        """Pipeline with the opened project's edits for the loaded source (a proxy of `original` if given)
+
+        Paint layers saved at the size they now have are restored from their tiles,
+        others (e.g. saved while editing at another resolution) replay their strokes.
+        """
+        index = self.index
+        tiled = index["format"] != OUTPUT_LAYERS_FORMAT
+        if not tiled:
+            self.end = None  # The next save rewrites the file in the current format
+        edits = dict(index["edits"], layers=[dict(description) for description in index["edits"]["layers"]])
+        snapshots = []
+        for description, entry in zip(edits["layers"], index["layers"]):
+            if entry is None:
+                snapshots.append(None)
+                continue
+            description["strokes"] = strokes = self.read_strokes(entry["strokes"])
+            if entry["shape"] is None or not tiled:
+                snapshots.append(None)
+            else:
+                snapshots.append((tuple(entry["shape"]), self.read_tiles(entry), strokes))
+        pipeline = Pipeline.from_edits(source, edits, original, snapshots)
+
+        # What the file already holds doesn't have to be written again
+        shape = source.shape[:2] + (3,)
+        for layer, entry in zip(pipeline.layers, index["layers"]):
+            if tiled and entry is not None and entry["shape"] is not None and tuple(entry["shape"]) == shape:
+                layer.unsaved = set()
+                self.saved[layer] = {
+                    "shape": layer.paint.shape,
+                    "tiles": {(row, column): (offset, h, w) for row, column, offset, h, w in entry["tiles"]},
+                    "strokes": [tuple(chunk) for chunk in entry["strokes"]],
+                    "count": len(layer.strokes),
+                    "last": layer.strokes[-1] if layer.strokes else None,
+                }
+        self.signature = self.describe(pipeline)[1]
+        self.index = self.mapping = None  # The mapping closes once the restored tiles are garbage collected
+        return pipeline
+
+    def describe(self, pipeline):
+        """(edits without the stroke logs, their signature for change detection)"""
+        edits = pipeline.edits()
+        for description in edits["layers"]:
+            description.pop("strokes", None)
+        return edits, (json.dumps(edits), [id(layer) for layer in pipeline.layers])
+
+    def changes(self, pipeline, full = False):
+        """What changed since the last save, for write(); None if nothing did (GUI thread)
+
+        With `full` (or when the file has to be rewritten anyway) everything is included.
+        The file isn't compacted while restored layers still read tiles from it.
+        """
+        compact = self.file_bytes > self.live_bytes * PROJECT_COMPACT_RATIO and not any(
+            isinstance(layer, PaintLayer) and layer.pending for layer in pipeline.layers)
+        full = full or self.end is None or compact
+        edits, signature = self.describe(pipeline)
+        changed = full or signature != self.signature
+        layers = []
+        saved = weakref.WeakKeyDictionary()
+        for layer in pipeline.layers:
+            if not isinstance(layer, PaintLayer):
+                layers.append(None)  # Adjustment layers are fully described by the edits
+                continue
+            shape = None if layer.alpha is None else layer.paint.shape
+            old = None if full else self.saved.get(layer)
+            if old is None or layer.unsaved is None or old["shape"] != shape:
+                keys, tiles = layer.painted, {}
+            else:
+                keys, tiles = layer.unsaved, dict(old["tiles"])
+            strokes = layer.strokes
+            count = 0 if old is None else old["count"]
+            if old is not None and count <= len(strokes) and (count == 0 or strokes[count - 1] is old["last"]):
+                new_strokes, chunks = strokes[count:], list(old["strokes"])
+            else:
+                new_strokes, chunks = list(strokes), []  # Undone past the last save, or never saved
+
+            record = {"shape": shape, "tiles": tiles, "strokes": chunks, "count": len(strokes),
+                      "last": strokes[-1] if strokes else None}
+            saved[layer] = record
+            keys = list(keys)
+            changed = changed or old is None or bool(keys) or bool(new_strokes)
+            layers.append({"record": record, "keys": keys, "tiles": layer.lend(keys), "strokes": new_strokes})
+            layer.unsaved = set()
+
+        if not changed:
+            for entry in layers:
+                if entry is not None:
+                    entry["tiles"].close()
+            return None
+        source = {"path": self.source_path, "size": list(pipeline.full_source.shape[1::-1]), "relative": None}
+        try:
+            source["relative"] = os.path.relpath(self.source_path, os.path.dirname(os.path.abspath(self.path)))
+        except ValueError:
+            pass  # On another drive
+        self.signature = signature
+        return {"full": full, "source": source, "edits": edits, "layers": layers, "saved": saved}
+
+    def write(self, changes):
+        """Saves changes() to the file: appended, or as a new compact file for a full save (worker thread)"""
+        with self.lock, profiler.span("project save"):
+            try:
+                self.write_changes(changes)
+            except BaseException:
+                self.end = None  # What the file holds is unknown now, the next save rewrites it
+                raise
+            finally:
+                for entry in changes["layers"]:
+                    if entry is not None:
+                        entry["tiles"].close()
+
+    def write_changes(self, changes):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        full = changes["full"]
+        if full:
+            fd, temp_path = tempfile.mkstemp(prefix=f".{os.path.basename(self.path)}.", suffix=".tmp", dir=directory)
+            file = os.fdopen(fd, "w+b")
+            file.write(PROJECT_MAGIC)
+        else:
+            file = open(self.path, "r+b")
+            file.truncate(self.end)  # Drops whatever a failed save left behind
+            file.seek(self.end)
+
+        try:
+            with file:
+                live = len(PROJECT_MAGIC)
+                layers = []
+                for entry in changes["layers"]:
+                    if entry is None:
+                        layers.append(None)
+                        continue
+                    record = entry["record"]
+                    for key in entry["keys"]:
+                        data = entry["tiles"].read(key)
+                        if data is None:
+                            record["tiles"].pop(key, None)  # Erased (undone) since the last save
+                            continue
+                        paint, alpha = data
+                        record["tiles"][key] = (file.tell(),) + alpha.shape
+                        file.write(paint)
+                        file.write(alpha)
+                    if entry["strokes"]:
+                        data = zlib.compress(json.dumps(entry["strokes"], separators=(",", ":")).encode())
+                        record["strokes"].append((file.tell(), len(data)))
+                        file.write(data)
+
+                    tiles = [[row, column, offset, h, w] for (row, column), (offset, h, w) in record["tiles"].items()]
+                    layers.append({"shape": record["shape"], "tiles": tiles, "strokes": record["strokes"]})
+                    live += sum(4 * h * w for _, _, _, h, w in tiles) + sum(length for _, length in record["strokes"])
+
+                index = json.dumps({"format": PROJECT_FORMAT, "source": changes["source"], "edits": changes["edits"],
+                                    "layers": layers}, separators=(",", ":")).encode()
+                offset = file.tell()
+                file.write(index)
+                file.write(TRAILER.pack(offset, len(index), TRAILER_MAGIC))
+                file.flush()
+                os.fsync(file.fileno())
+                end = file.tell()
+            if full:
+                os.chmod(temp_path, stat.S_IMODE(os.stat(self.path).st_mode) if os.path.exists(self.path) else FILE_MODE)
+                os.replace(temp_path, self.path)
+        except BaseException:
+            if full:
+                os.remove(temp_path)
+            raise
+
+        self.end = self.file_bytes = end
+        self.live_bytes = live + len(index) + TRAILER.size
+        self.saved = changes["saved"]
+
+    def delete(self):
+        """Removes the file (once a running write() is done)"""
+        with self.lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
@@ -0,0 +1,86 @@
+from buffers import pool
+from lazy import LazyModule
+from parallel import executor
+from profiling import profiled
+
+cv2 = LazyModule("cv2")
+
+MIN_LEVEL_SIZE = 256  # Stop downsampling once the longest side gets this small
+
+
+class ImagePyramid:
+    """Precomputed 2x downsampled copies (mipmaps) of an image for fast zoomed rendering"""
+
+    @profiled("pyramid build")
+    def __init__(self, image):
+        self.levels = [image]  # Level 0 is the full resolution image itself (not a copy)
+
+        while max(self.levels[-1].shape[:2]) > MIN_LEVEL_SIZE * 2:
+            self.levels.append(self.downsample(self.levels[-1]))
+
+    @classmethod
+    def from_levels(cls, levels):
+        """Pyramid made of already computed levels (e.g. the smaller levels of another pyramid)"""
+        pyramid = cls.__new__(cls)
+        pyramid.levels = list(levels)
+        return pyramid
+
+    @staticmethod
+    def downsample(image, output = None):
+        """Halves the image with INTER_AREA (exact 2x2 box average), into `output` if given"""
+        h, w = image.shape[:2]
+        half_w, half_h = max(1, w // 2), max(1, h // 2)
+        if output is None:
+            output = pool.take((half_h, half_w) + image.shape[2:], image.dtype)
+
+        # Cropping to an even size keeps the mapping between levels exactly 2:1, so every
+        # band of output rows only depends on the two source rows under each of them
+        def run(y1, y2):
+            cv2.resize(image[y1 * 2:y2 * 2, :half_w * 2], (half_w, y2 - y1), dst=output[y1:y2],
+                       interpolation=cv2.INTER_AREA)
+        executor.map_rows(run, output.shape)
+        return output
+
+    @profiled("pyramid build")
+    def rebuild(self):
+        """Recomputes every level in place after the base image changed as a whole"""
+        for index in range(1, len(self.levels)):
+            self.downsample(self.levels[index - 1], self.levels[index])
+
+    def release(self):
+        """Returns the downsampled levels to the buffer pool once the pyramid is no longer shown"""
+        pool.give(*self.levels[1:])
+
+    @property
+    def base(self):
+        return self.levels[0]
+
+    def level_for_zoom(self, zoom):
+        """Returns (index, image) of the smallest level that still has at least `zoom` resolution"""
+        index = 0
+        while index + 1 < len(self.levels) and 0.5 ** (index + 1) >= zoom:
+            index += 1
+        return index, self.levels[index]
+
+    def level_scale(self, index):
+        """Scale of a level relative to the full resolution image"""
+        return self.levels[index].shape[1] / self.levels[0].shape[1]
+
+    @profiled("pyramid update")
+    def invalidate(self, x, y, w, h):
+        """Recomputes the region (in full resolution pixels) of every level after an edit"""
+        x1, y1, x2, y2 = x, y, x + w, y + h
+
+        for index in range(1, len(self.levels)):
+            src = self.levels[index - 1]
+            dst = self.levels[index]
+            dst_h, dst_w = dst.shape[:2]
+
+            # Grow the region to even coordinates so it covers whole 2x2 blocks
+            x1, y1 = max(0, x1 // 2), max(0, y1 // 2)
+            x2, y2 = min(dst_w, (x2 + 1) // 2), min(dst_h, (y2 + 1) // 2)
+            if x2 <= x1 or y2 <= y1:
+                return
+
+            block = src[y1 * 2:y2 * 2, x1 * 2:x2 * 2]
+            cv2.resize(block, (x2 - x1, y2 - y1), dst=dst[y1:y2, x1:x2], interpolation=cv2.INTER_AREA)
@@ -0,0 +1,180 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from PyQt6.QtCore import QObject, QThreadPool, pyqtSignal
+
+from buffers import pool
+from lazy import LazyModule
+from profiling import profiled, profiler
+from pyramid import ImagePyramid
+
+cv2 = LazyModule("cv2")
+np = LazyModule("numpy")
+
+PREVIEW_SIZE = 1024  # Longest side of the low resolution preview
+FULL_RENDER_DELAY = 0.05  # Seconds without newer input before the full resolution render starts
+
+
+class RenderScheduler(QObject):
+    """Renders pipeline changes on a worker thread, keeping only the newest request
+
+    Every request first produces a fast low resolution preview and then, if no newer
+    request arrived in the meantime, the full resolution result. Outdated renders are
+    cancelled between pipeline stages.
+    """
+
+    preview_ready = pyqtSignal(object, int)  # preview image, generation
+    result_ready = pyqtSignal(object, object, int, float)  # image, pyramid, generation, submit time
+
+    def __init__(self):
+        super().__init__()
+        self.pool = QThreadPool()
+        self.pool.setMaxThreadCount(1)
+
+        self.lock = threading.Lock()  # Held while the pipeline is being used
+        self.pending_lock = threading.Lock()
+        self.wakeup = threading.Event()
+
+        self.pipeline = None
+        self.preview_pipeline = None
+        self.pending = {}  # (layer, name) -> adjustment value not yet applied to the pipeline
+        self.generation = 0
+        self.submitted_at = {}  # Generation -> time of the input that caused it
+        self.running = False
+        self.dropped = 0  # Requests replaced by newer ones before their result was shown
+
+    def set_pipeline(self, pipeline):
+        """Switches to another pipeline (or None), discarding pending work"""
+        with self.exclusive():
+            self.pipeline = pipeline
+            self.preview_pipeline = None
+            self.pending.clear()
+
+    def submit(self, name, value, layer = None):
+        """Requests an adjustment change (of an adjustment layer, if given); returns immediately"""
+        with self.pending_lock:
+            if (layer, name) in self.pending:
+                profiler.count("coalesced adjustments")  # Replaced before the worker picked it up
+            self.pending[layer, name] = value
+            self.generation += 1
+            self.submitted_at[self.generation] = time.perf_counter()
+            start = not self.running
+            self.running = True
+        self.wakeup.set()
+
+        if start:
+            self.pool.start(self.work)
+
+    def adjustment(self, name, layer = None):
+        """Latest requested value of an adjustment, including ones not rendered yet"""
+        with self.pending_lock:
+            if (layer, name) in self.pending:
+                return self.pending[layer, name]
+        return (layer or self.pipeline).adjustments[name]
+
+    def cancel(self):
+        """Makes the render in progress (if any) stop at the next stage"""
+        with self.pending_lock:
+            self.generation += 1
+
+    @contextmanager
+    def exclusive(self, invalidate = False):
+        """Gives the calling (GUI) thread the pipeline, with pending adjustments applied
+
+        Pass `invalidate` for geometry or layer changes: the preview pipeline is then
+        dropped before the lock is released, so the worker rebuilds it from the change.
+        """
+        self.cancel()
+        with self.lock:
+            self.apply_pending()
+            try:
+                yield self.pipeline
+            finally:
+                if invalidate:
+                    self.preview_pipeline = None
+
+    def apply_pending(self):
+        with self.pending_lock:
+            pending, self.pending = self.pending, {}
+            generation = self.generation
+        if self.pipeline is not None:
+            for (layer, name), value in pending.items():
+                self.pipeline.set_adjustment(name, value, layer)
+        return generation
+
+    def is_current(self, generation):
+        return generation == self.generation
+
+    def work(self):
+        """Worker loop: serves the newest request until nothing is pending"""
+        try:
+            while True:
+                with self.pending_lock:
+                    if not self.pending:
+                        self.running = False
+                        return
+                    self.wakeup.clear()
+
+                with self.lock:
+                    generation = self.apply_pending()
+                    if self.pipeline is None:
+                        continue
+                    self.render_preview(generation)
+
+                # Debounce: give newer input a moment to arrive before the expensive render
+                if self.wakeup.wait(FULL_RENDER_DELAY):
+                    continue
+
+                with self.lock, profiler.span("full render"):
+                    cancelled = lambda: not self.is_current(generation)
+                    image = self.pipeline.render(cancelled)
+                    if image is None:
+                        profiler.count("cancelled renders")
+                        continue
+                    # The pipeline reuses its buffers for the next render; the copy goes back to the pool once replaced
+                    result = pool.take_like(image)
+                    np.copyto(result, image)
+
+                pyramid = ImagePyramid(result)
+                if self.is_current(generation):
+                    self.result_ready.emit(result, pyramid, generation, self.take_submit_time(generation))
+                else:
+                    pool.give(result)
+                    pyramid.release()
+        except BaseException:
+            # Lets the next submit() start a worker again (normal exits reset it under the lock above)
+            with self.pending_lock:
+                self.running = False
+            raise
+
+    def take_submit_time(self, generation):
+        """Time of the input behind a finished render; older requests count as dropped"""
+        with self.pending_lock:
+            older = [key for key in self.submitted_at if key < generation]
+            for key in older:
+                del self.submitted_at[key]
+            self.dropped += len(older)
+            profiler.count("dropped renders", len(older))
+            return self.submitted_at.pop(generation, time.perf_counter())
+
+    @profiled("preview render")
+    def render_preview(self, generation):
+        if self.preview_pipeline is None:
+            source = self.pipeline.source
+            scale = min(1.0, PREVIEW_SIZE / max(source.shape[:2]))
+            size = (max(1, round(source.shape[1] * scale)), max(1, round(source.shape[0] * scale)))
+            proxy_source = cv2.resize(source, size, interpolation=cv2.INTER_AREA)
+            self.preview_pipeline = self.pipeline.scaled(proxy_source)
+
+        self.preview_pipeline.sync_adjustments(self.pipeline)
+        preview = self.preview_pipeline.render()
+
+        if self.is_current(generation):
+            copy = pool.take_like(preview)
+            np.copyto(copy, preview)
+            self.preview_ready.emit(copy, generation)
+
+    def shutdown(self):
+        self.cancel()
+        self.pool.waitForDone()
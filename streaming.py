@@ -0,0 +1,165 @@
+"""Out-of-core export: the edit stack rendered strip by strip into an incremental encoder
+
+Pipeline.render() keeps the output of every stage for the whole image in memory, several
+times the size of the result. For very large images the export instead renders strips
+of output rows, each through the same kernels (the composed warp, the HSV lookup tables,
+brush drawing and layer blending), and feeds them to a PNGWriter as they are done. Memory
+then depends on the strip size and the number of workers, not on the image size.
+Several strips are rendered at once on the tile executor.
+"""
+
+from adjustments import ADJUSTMENT_DEFAULTS, adjust_in_place, hsv_lut
+from fileio import PNG_COMPRESSION, PNGWriter, check, replacing
+from geometry import apply_transform, clip_rect, geometry_transform, map_rect, scale_geometry
+from layers import AdjustmentLayer, Compositor, PaintLayer, to_layer
+from lazy import LazyModule
+from parallel import executor
+from profiling import profiler
+from tiles import TILED_LOAD_PIXELS
+
+cv2 = LazyModule("cv2")
+np = LazyModule("numpy")
+
+STREAMING_EXTENSIONS = (".png",)  # Formats with an incremental encoder
+STREAMING_EXPORT_PIXELS = TILED_LOAD_PIXELS  # Sources at least this large are exported strip by strip
+STRIP_PIXELS = 2 * 1024 * 1024  # Output pixels per strip
+
+
+def streams(path, shape):
+    """Whether an export of a source of the given shape to `path` goes through export_streaming()"""
+    return path.lower().endswith(STREAMING_EXTENSIONS) and shape[0] * shape[1] >= STREAMING_EXPORT_PIXELS
+
+
+class StrokeStrips:
+    """A paint layer's stroke log in source coordinates, drawn one region at a time
+
+    Strokes are drawn where PaintLayer.replay draws them, so a strip blends the same
+    layer pixels through the same transform as Pipeline.render() does.
+    """
+
+    def __init__(self, description, geometry, source_shape):
+        self.name, self.opacity = description["name"], description["opacity"]
+        self.source_shape = source_shape
+        self.items = []  # (x1, y1, x2, y2, kind, arguments) of strokes, in source coordinates
+        for stroke in description["strokes"]:
+            if stroke[0] == "transform":
+                continue
+            kind, count, points, color, size = stroke[:5]
+            w, h = geometry_transform(geometry[:count], source_shape)[1]
+            size = max(1, round(size * w))
+            if kind == "polyline":
+                points = to_layer([(round(x * w), round(y * h)) for x, y in points], geometry[:count], source_shape)
+            else:
+                points = to_layer([(x * w, y * h) for x, y in points], geometry[:count], source_shape)
+            # Rounded where draw_polyline and draw_stamps round them, as .5 could round either way once shifted
+            points = np.round(points)
+            (x1, y1), (x2, y2) = points.min(axis=0) - size - 1, points.max(axis=0) + size + 1
+            self.items.append((x1, y1, x2, y2, kind, (points, tuple(color), size) + tuple(stroke[5:])))
+
+    def layer(self, region):
+        """PaintLayer with the strokes of an (x1, y1, x2, y2) region of the source (in its coordinates)"""
+        x1, y1, x2, y2 = region
+        layer = PaintLayer(self.name)
+        layer.opacity = self.opacity
+        shape = (y2 - y1, x2 - x1, 3)
+        for left, top, right, bottom, kind, arguments in self.items:
+            if right >= x1 and left < x2 and bottom >= y1 and top < y2:
+                points, color, size = arguments[:3]
+                points = points - (x1, y1)
+                if kind == "polyline":
+                    layer.draw_polyline(shape, [(round(x), round(y)) for x, y in points], color, size,
+                                        grid=((x1, y1), self.source_shape))
+                else:
+                    layer.draw_stamps(shape, [tuple(point) for point in points], color, size, arguments[3])
+        return layer
+
+
+class StripRenderer:
+    """Renders any rows of the result of described edits (see Pipeline.edits) on a source of any resolution"""
+
+    def __init__(self, source, edits):
+        self.source = source
+        self.geometry = scale_geometry(edits["geometry"], source.shape[1] / edits["size"][0])
+        self.M, self.size, self.bounds = geometry_transform(self.geometry, source.shape)
+        adjustments = edits["adjustments"]
+        self.lut = None if adjustments == ADJUSTMENT_DEFAULTS else hsv_lut(**adjustments)
+        self.layers = []  # StrokeStrips, and AdjustmentLayers (blended a strip at a time as they are)
+        for description in edits["layers"]:
+            if not description["visible"] or description["opacity"] <= 0:
+                continue
+            if description["type"] == "paint":
+                if any(stroke[0] != "transform" for stroke in description["strokes"]):
+                    self.layers.append(StrokeStrips(description, self.geometry, source.shape))
+            else:
+                layer = AdjustmentLayer(description["name"], description["adjustments"])
+                layer.opacity = description["opacity"]
+                self.layers.append(layer)
+
+    @property
+    def shape(self):
+        w, h = self.size
+        return (h, w) + self.source.shape[2:]
+
+    def render(self, y1, y2):
+        """Output rows y1..y2, as a new array"""
+        w, _ = self.size
+        M = np.array(self.M, dtype=np.float64)
+        M[1, 2] -= y1  # Row y1 of the output becomes row 0 of the strip
+        bounds = None if self.bounds is None else self.bounds - np.float32([0, y1])
+        strip = apply_transform(self.source, M, (w, y2 - y1), bounds)
+        if np.may_share_memory(strip, self.source):
+            strip = strip.copy()  # A crop's view of the source, which must not be adjusted in place
+
+        if self.lut is not None:
+            adjust_in_place(strip, self.lut)
+
+        if not self.geometry:
+            region, transform = (0, y1, w, y2), None  # The paint lines up with the strip
+        else:
+            # Source region the strip's paint comes from (with the neighbors interpolation reads)
+            region = clip_rect(map_rect((0, y1, w, y2 - y1), cv2.invertAffineTransform(self.M), 2), self.source.shape)
+            M[:, 2] += M[:, :2] @ (region or (0, 0))[:2]  # From the region's pixels to the strip's
+            transform = (M, bounds)
+        layers = []
+        for layer in self.layers:
+            if isinstance(layer, StrokeStrips):
+                if region is None:
+                    continue  # The strip shows none of the source, so none of its paint
+                layer = layer.layer(region)
+            layers.append(layer)
+        return Compositor().composite(strip, layers, transform)
+
+
+def export_streaming(path, source, edits, params = None, progress = None, cancelled = None):
+    """Applies described edits to a source and saves the result as PNG, strip by strip
+
+    Like write_image, the file is only replaced once it was written completely, and
+    cancellation raises Cancelled.
+    """
+    renderer = StripRenderer(source, edits)
+    height, width = renderer.shape[:2]
+    options = dict(zip(params[::2], params[1::2])) if params else {}
+    channels = renderer.shape[2] if len(renderer.shape) == 3 else 1
+    rows = max(1, min(height, STRIP_PIXELS // width))
+    strips = [(y, min(y + rows, height)) for y in range(0, height, rows)]
+
+    with replacing(path) as file:
+        writer = PNGWriter(file, width, height, channels, options.get(cv2.IMWRITE_PNG_COMPRESSION, PNG_COMPRESSION),
+                           executor.workers)
+        try:
+            # As many strips as there are workers are rendered at once, then handed to the encoder in order
+            for start in range(0, len(strips), executor.workers):
+                check(cancelled)
+                batch = strips[start:start + executor.workers]
+                rendered = {}
+                with profiler.span("render strips"):
+                    executor.map(lambda strip: rendered.__setitem__(strip, renderer.render(*strip)), batch)
+                with profiler.span("encode strips"):
+                    for strip in batch:
+                        writer.write(rendered.pop(strip))
+                if progress is not None:
+                    progress(batch[-1][1] / height)
+            writer.close()
+        except BaseException:
+            writer.abort()
+            raise
@@ -0,0 +1,46 @@
+"""Hue/saturation/luminosity LUTs against the per-pixel HSV math they replaced"""
+
+import cv2
+import numpy as np
+import pytest
+
+from adjustments import HSVAdjuster, hue_lut, scale_lut
+
+
+def per_pixel(image, hue, saturation, luminosity):
+    """The adjustments computed on every pixel, as the slider handlers used to"""
+    h, s, v = cv2.split(cv2.cvtColor(image, cv2.COLOR_BGR2HSV))
+    h = ((h.astype(np.int32) + int((hue / 100) * 50)) % 180).astype(np.uint8)
+    s = np.clip(s * (saturation / 100), 0, 255).astype(np.uint8)
+    v = np.clip(v * (luminosity / 100), 0, 255).astype(np.uint8)
+    return cv2.cvtColor(cv2.merge([h, s, v]), cv2.COLOR_HSV2BGR)
+
+
+@pytest.fixture
+def image():
+    return np.random.default_rng(3).integers(0, 256, (47, 61, 3), dtype=np.uint8)
+
+
+@pytest.mark.parametrize("hue, saturation, luminosity", [
+    (0, 100, 100), (40, 100, 100), (359, 100, 100), (360, 100, 100),
+    (0, 0, 100), (0, 37, 100), (0, 200, 100),
+    (0, 100, 0), (0, 100, 63), (0, 100, 200),
+    (120, 150, 80), (275, 20, 180),
+])
+def test_luts_match_per_pixel_math(image, hue, saturation, luminosity):
+    assert np.array_equal(HSVAdjuster(image).apply(hue, saturation, luminosity),
+                          per_pixel(image, hue, saturation, luminosity))
+
+
+def test_adjuster_reuses_its_planes(image):
+    adjuster = HSVAdjuster(image)
+    for hue, saturation, luminosity in [(200, 180, 50), (10, 90, 120), (0, 100, 100)]:
+        assert np.array_equal(adjuster.apply(hue, saturation, luminosity),
+                              per_pixel(image, hue, saturation, luminosity))
+
+
+def test_luts_leave_out_of_range_hues():
+    lut = hue_lut(100)
+    assert lut.dtype == np.uint8 and (lut[:180] < 180).all()
+    assert np.array_equal(lut[180:], np.arange(180, 256))
+    assert np.array_equal(scale_lut(100), np.arange(256))
@@ -0,0 +1,63 @@
+"""Brush strokes painted in batches, one per display frame, as the GUI does"""
+
+import numpy as np
+import pytest
+
+from brush import brush_stamp, spaced_points
+from pipeline import Pipeline
+
+SAMPLES = [(12, 15), (40, 22), (41, 23), (90, 80), (90, 80), (150, 60), (210, 140), (215, 190), (180, 230)]
+
+
+def frames(points, sizes):
+    """Batches of pointer samples, each starting at the last point of the one before"""
+    batches, start = [], 0
+    for size in sizes:
+        batches.append(points[max(0, start - 1):start + size])
+        start += size
+    return batches
+
+
+def test_spaced_points_carry_the_spacing_over():
+    whole, whole_offset = spaced_points(SAMPLES, 6.5)
+    positions, offset = [], 0.0
+    for batch in frames(SAMPLES, [2, 1, 3, 3]):
+        batch_positions, offset = spaced_points(batch, 6.5, offset)
+        positions += batch_positions
+    assert np.allclose(positions, whole)
+    assert offset == pytest.approx(whole_offset)
+    assert np.allclose(np.hypot(*np.diff(whole, axis=0).T)[:4], 6.5)  # Along the first, straight segment
+
+
+def test_spaced_points_of_a_single_point():
+    assert spaced_points([(5, 5)], 3) == ([], 0)
+    assert spaced_points([(5, 5), (5, 5)], 3) == ([(5, 5)], 3)
+
+
+@pytest.mark.parametrize("hardness", [1.0, 0.4])
+def test_stroke_painted_over_frames_matches_one_call(hardness):
+    source = np.random.default_rng(6).integers(0, 256, (256, 320, 3), dtype=np.uint8)
+    single, framed = Pipeline(source), Pipeline(source)
+
+    def paint(pipeline, points, offset):
+        layer = pipeline.layers[0]
+        if hardness >= 1.0:
+            pipeline.draw_polyline(layer, points, (0, 0, 255), 9)
+            return offset
+        centers, offset = spaced_points(points, 4.0, offset)
+        if centers:
+            pipeline.draw_stamps(layer, centers, (0, 0, 255), 17, hardness)
+        return offset
+
+    paint(single, SAMPLES, 0.0)
+    offset = 0.0
+    for batch in frames(SAMPLES, [1, 2, 1, 2, 3]):
+        if len(batch) > 1:
+            offset = paint(framed, batch, offset)
+    assert np.array_equal(framed.render(), single.render())
+
+
+def test_brush_stamp():
+    stamp = brush_stamp(21, 0.5)
+    assert stamp.shape == (21, 21) and stamp[10, 10] == 1 and stamp[0, 0] == 0
+    assert not stamp.flags.writeable
@@ -0,0 +1,56 @@
+"""Scratch buffer reuse by the shape-keyed BufferPool"""
+
+import numpy as np
+
+from buffers import BufferPool
+
+
+def test_reuse_is_keyed_by_shape_and_dtype():
+    pool = BufferPool()
+    array = pool.take((10, 20, 3))
+    pool.give(array)
+    assert pool.take((10, 20), np.uint8) is not array
+    assert pool.take((10, 20, 3), np.float32) is not array
+    assert pool.take((10, 20, 3), np.uint8) is array
+    assert pool.allocations == 3
+
+
+def test_zeros_clears_reused_buffers():
+    pool = BufferPool()
+    array = pool.take((4, 4))
+    array.fill(9)
+    pool.give(array)
+    assert pool.zeros((4, 4)) is array and not array.any()
+
+
+def test_full_pool_frees_the_least_recently_returned_shapes():
+    pool = BufferPool(limit=3000)
+    small, medium, large = pool.take((1000,)), pool.take((1500,)), pool.take((2000,))
+    pool.give(small)
+    pool.give(medium)
+    assert pool.idle_bytes == 2500
+    pool.give(large)  # Over the limit: the oldest shapes go until it fits
+    assert pool.idle_bytes == 2000
+    assert pool.take((2000,)) is large
+    assert pool.take((1000,)) is not small and pool.take((1500,)) is not medium
+
+    pool.give(pool.take((4000,)))  # Larger than the whole pool: not kept
+    assert pool.idle_bytes == 0
+
+
+def test_buffers_in_use_are_not_handed_out():
+    pool = BufferPool()
+    first, second = pool.take((8, 8)), pool.take((8, 8))
+    assert first is not second
+    pool.give(first)
+    pool.give(first)  # Given back twice: still only handed out once
+    assert pool.take((8, 8)) is first
+    assert pool.take((8, 8)) is not first
+
+
+def test_foreign_arrays_and_views_are_ignored():
+    pool = BufferPool()
+    array = pool.take((8, 8))
+    pool.give(np.empty((8, 8), np.uint8), array[:4], array.reshape(64), None)
+    assert pool.idle_bytes == 0
+    assert pool.take((8, 8)) is not array
@@ -0,0 +1,60 @@
+"""Streaming PNG encoding and decoding against OpenCV's"""
+
+import io
+
+import cv2
+import numpy as np
+import pytest
+
+from fileio import PNGReader, PNGWriter, read_image
+
+
+def encoded(image, strip_rows, workers = 2):
+    file = io.BytesIO()
+    writer = PNGWriter(file, image.shape[1], image.shape[0], image.shape[2] if image.ndim == 3 else 1, 6, workers)
+    for y in range(0, len(image), strip_rows):
+        writer.write(image[y:y + strip_rows])
+    writer.close()
+    return file.getvalue()
+
+
+@pytest.mark.parametrize("channels", [1, 3, 4])
+@pytest.mark.parametrize("strip_rows", [1, 7, 64])
+def test_png_writer_round_trip(channels, strip_rows):
+    shape = (61, 45) if channels == 1 else (61, 45, channels)
+    image = np.random.default_rng(channels).integers(0, 256, shape, dtype=np.uint8)
+    decoded = cv2.imdecode(np.frombuffer(encoded(image, strip_rows), np.uint8), cv2.IMREAD_UNCHANGED)
+    assert np.array_equal(decoded, image)
+
+
+def test_png_writer_needs_every_row():
+    writer = PNGWriter(io.BytesIO(), 10, 10, 3, workers=1)
+    writer.write(np.zeros((4, 10, 3), np.uint8))
+    with pytest.raises(ValueError):
+        writer.close()
+
+
+@pytest.mark.parametrize("shape, depth", [((50, 33), np.uint8), ((50, 33, 3), np.uint8), ((50, 33, 4), np.uint16)])
+def test_png_reader_matches_opencv(tmp_path, shape, depth):
+    image = np.random.default_rng(0).integers(0, np.iinfo(depth).max, shape, dtype=depth)
+    path = str(tmp_path / "image.png")
+    cv2.imwrite(path, image)
+    with open(path, "rb") as file:
+        reader = PNGReader(file)
+        strips = [reader.read(rows) for rows in (1, 16, 33)]
+    assert np.array_equal(np.concatenate(strips), image)
+
+
+@pytest.mark.parametrize("data", [b"", b"not an image", b"\x89PNG\r\n\x1a\n" + b"\x00" * 40, b"\xff\xd8\xff"])
+def test_read_image_of_unreadable_files(tmp_path, data):
+    path = tmp_path / "broken.png"
+    path.write_bytes(data)
+    assert read_image(str(path)) is None
+
+
+def test_read_image(tmp_path):
+    image = np.random.default_rng(1).integers(0, 256, (20, 30, 3), dtype=np.uint8)
+    cv2.imwrite(str(tmp_path / "image.png"), image)
+    progress = []
+    assert np.array_equal(read_image(str(tmp_path / "image.png"), progress.append), image)
+    assert progress[-1] == 1
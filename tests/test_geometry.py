@@ -0,0 +1,64 @@
+"""Composed crop/rotate transforms against the operations applied one at a time"""
+
+import cv2
+import numpy as np
+import pytest
+
+from geometry import apply_geometry, apply_transform, geometry_transform
+
+
+@pytest.fixture
+def image():
+    return np.random.default_rng(0).integers(0, 256, (37, 53, 3), dtype=np.uint8)
+
+
+def render(image, geometry):
+    return apply_transform(image, *geometry_transform(geometry, image.shape))
+
+
+@pytest.mark.parametrize("angle, code", [
+    (90, cv2.ROTATE_90_COUNTERCLOCKWISE), (180, cv2.ROTATE_180), (270, cv2.ROTATE_90_CLOCKWISE),
+    (-90, cv2.ROTATE_90_CLOCKWISE), (450, cv2.ROTATE_90_COUNTERCLOCKWISE)])
+def test_quarter_turns_are_exact(image, angle, code):
+    assert np.array_equal(render(image, [("rotate", angle)]), cv2.rotate(image, code))
+
+
+def test_quarter_turns_compose(image):
+    assert np.array_equal(render(image, [("rotate", 90)] * 4), image)
+    assert np.array_equal(render(image, [("rotate", 90), ("rotate", 180)]), cv2.rotate(image, cv2.ROTATE_90_CLOCKWISE))
+
+
+def test_crops_compose(image):
+    geometry = [("crop", (5, 3, 50, 30)), ("crop", (2, 4, 40, 20))]
+    composed = render(image, geometry)
+    assert np.array_equal(composed, image[7:23, 7:45])
+    assert np.array_equal(composed, apply_geometry(apply_geometry(image, geometry[0]), geometry[1]))
+
+
+def test_crops_and_quarter_turns_compose(image):
+    geometry = [("crop", (5, 3, 50, 30)), ("rotate", 90), ("crop", (2, 4, 20, 40)), ("rotate", 180)]
+    stepwise = image
+    for op in geometry:
+        stepwise = apply_geometry(stepwise, op)
+    assert np.array_equal(render(image, geometry), stepwise)
+
+
+def test_rotations_compose_like_their_sum(image):
+    for angles in [(45, 45), (30, 60), (12, -57)]:
+        composed = geometry_transform([("rotate", angle) for angle in angles], image.shape)
+        single = geometry_transform([("rotate", sum(angles))], image.shape)
+        assert composed[1] == single[1]
+        assert np.allclose(composed[0], single[0])
+    assert np.array_equal(render(image, [("rotate", 45), ("rotate", 45)]), render(image, [("rotate", 90)]))
+
+
+def test_rotations_fit_the_corners(image):
+    w, h = geometry_transform([("rotate", 45)], image.shape)[1]
+    assert (w, h) == (round((53 + 37) / 2 ** 0.5),) * 2
+
+
+def test_crop_after_rotation_keeps_cropped_area_empty(image):
+    geometry = [("crop", (10, 10, 40, 30)), ("rotate", 30)]
+    output = render(image, geometry)
+    assert output.shape[:2] == geometry_transform(geometry, image.shape)[1][::-1]
+    assert not output[0, 0].any()  # A corner outside the rotated crop
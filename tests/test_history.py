@@ -0,0 +1,137 @@
+"""Undo and redo of adjustments, brush strokes and crops/rotations, in memory and spilled to disk"""
+
+import os
+
+import numpy as np
+import pytest
+
+from history import GeometryEdit, History, StrokeEdit
+from pipeline import Pipeline
+
+
+@pytest.fixture
+def pipeline():
+    return Pipeline(np.random.default_rng(4).integers(0, 256, (300, 400, 3), dtype=np.uint8))
+
+
+def stroke(history, pipeline, points, color = (0, 0, 255), size = 9):
+    """Paints a hard stroke the way the GUI does, recording it in the history"""
+    layer = pipeline.layers[0]
+    edit = StrokeEdit(layer)
+    pipeline.draw_polyline(layer, points, color, size, edit.tiles)
+    history.push(edit)
+
+
+def geometry(history, pipeline, op):
+    history.push(GeometryEdit(pipeline))
+    pipeline.add_geometry(op)
+
+
+def rendered(pipeline):
+    return pipeline.render().copy()
+
+
+def check_round_trip(history, pipeline, states):
+    """Undoes back to the first of the rendered states and redoes up to the last one"""
+    for state in reversed(states[:-1]):
+        assert history.undo(pipeline) is not None
+        assert np.array_equal(pipeline.render(), state)
+    assert history.undo(pipeline) is None
+    for state in states[1:]:
+        assert history.redo(pipeline) is not None
+        assert np.array_equal(pipeline.render(), state)
+    assert history.redo(pipeline) is None
+
+
+def test_adjustments(pipeline):
+    history = History()
+    states = [rendered(pipeline)]
+    for name, value in [("hue", 30), ("saturation", 150), ("hue", -20)]:
+        history.push_adjustment(name, pipeline.adjustments[name], value)
+        pipeline.set_adjustment(name, value)
+        states.append(rendered(pipeline))
+    check_round_trip(history, pipeline, states)
+
+
+def test_slider_drags_merge(pipeline):
+    history = History()
+    for value in (10, 20, 30):
+        history.push_adjustment("luminosity", pipeline.adjustments["luminosity"], value, merge=True)
+        pipeline.set_adjustment("luminosity", value)
+    assert len(history.undo_stack) == 1
+    history.undo(pipeline)
+    assert pipeline.adjustments["luminosity"] == 100
+
+
+def test_brush_strokes(pipeline):
+    history = History()
+    states = [rendered(pipeline)]
+    for points in ([(10, 10), (390, 290)], [(10, 290), (390, 10)], [(200, 0), (200, 300)]):
+        stroke(history, pipeline, points)
+        states.append(rendered(pipeline))
+    check_round_trip(history, pipeline, states)
+
+
+def test_brush_strokes_undo_their_log(pipeline):
+    history = History()
+    stroke(history, pipeline, [(10, 10), (390, 290)])
+    strokes = list(pipeline.layers[0].strokes)
+    stroke(history, pipeline, [(10, 290), (390, 10)])
+    history.undo(pipeline)
+    assert pipeline.layers[0].strokes == strokes
+    history.redo(pipeline)
+    assert len(pipeline.layers[0].strokes) == len(strokes) + 1
+
+
+def test_crops_and_rotations(pipeline):
+    history = History()
+    states = [rendered(pipeline)]
+    stroke(history, pipeline, [(10, 10), (390, 290)])
+    states.append(rendered(pipeline))
+    geometry(history, pipeline, ("crop", (50, 40, 350, 260)))
+    states.append(rendered(pipeline))
+    geometry(history, pipeline, ("rotate", 30))
+    states.append(rendered(pipeline))
+    h, w = pipeline.render().shape[:2]
+    stroke(history, pipeline, [(0, h // 2), (w, h // 2)], (0, 255, 0))
+    states.append(rendered(pipeline))
+    geometry(history, pipeline, ("rotate", 90))
+    states.append(rendered(pipeline))
+    check_round_trip(history, pipeline, states)
+
+
+def test_geometry_edits_store_no_pixels(pipeline):
+    stroke(History(), pipeline, [(10, 10), (390, 290)])
+    assert GeometryEdit(pipeline).nbytes == 0
+
+
+def test_spilled_edits_reload(pipeline):
+    history = History(memory_limit=1024 * 1024)  # Every stroke's tiles take 400 KB
+    states = [rendered(pipeline)]
+    for i in range(8):
+        stroke(history, pipeline, [(0, 30 * i + 10), (400, 30 * i + 20)], (i * 30, 0, 255 - i * 30), 25)
+        states.append(rendered(pipeline))
+    spilled = [edit.spill_path for edit in history.undo_stack if edit.spill_path is not None]
+    assert spilled and all(os.path.exists(path) for path in spilled)
+    assert history.memory_used <= history.memory_limit
+
+    check_round_trip(history, pipeline, states)
+    assert history.memory_used <= history.memory_limit
+    history.clear()
+    assert not os.listdir(history.directory.name)
+
+
+def test_version_changes_with_every_edit(pipeline):
+    history = History()
+    versions = [history.version]
+    history.push_adjustment("hue", 0, 10, merge=True)
+    versions.append(history.version)
+    history.push_adjustment("hue", 10, 20, merge=True)  # Merged into the same edit, but still a change
+    versions.append(history.version)
+    history.undo(pipeline)
+    versions.append(history.version)
+    history.redo(pipeline)
+    versions.append(history.version)
+    assert len(set(versions)) == len(versions)
+    history.undo(pipeline)
+    assert history.undo(pipeline) is None and history.version == versions[-1] + 1
@@ -0,0 +1,28 @@
+"""Every module passes pyflakes (no unused or undefined names)"""
+
+import glob
+import os
+
+import pytest
+
+api = pytest.importorskip("pyflakes.api")
+reporter = pytest.importorskip("pyflakes.reporter")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = sorted(glob.glob(os.path.join(ROOT, "*.py")) + glob.glob(os.path.join(ROOT, "benchmarks", "*.py"))
+                 + glob.glob(os.path.join(ROOT, "tests", "*.py")))
+
+
+class Messages:
+    def __init__(self):
+        self.lines = []
+
+    def write(self, text):
+        self.lines.append(text)
+
+
+@pytest.mark.parametrize("path", MODULES, ids=lambda path: os.path.relpath(path, ROOT))
+def test_pyflakes(path):
+    messages = Messages()
+    warnings = api.checkPath(path, reporter.Reporter(messages, messages))
+    assert warnings == 0, "".join(messages.lines)
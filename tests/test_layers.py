@@ -0,0 +1,100 @@
+"""Paint layers under crops and rotations, and compositing them tile by tile"""
+
+import numpy as np
+import pytest
+
+from geometry import map_rect
+from layers import AdjustmentLayer, Compositor, PaintLayer, tile_keys
+from pipeline import Pipeline
+
+
+@pytest.fixture
+def source():
+    return np.random.default_rng(3).integers(0, 256, (200, 300, 3), dtype=np.uint8)
+
+
+def painted(source):
+    pipeline = Pipeline(source)
+    layer = pipeline.layers[0]
+    pipeline.draw_polyline(layer, [(20, 30), (150, 90), (280, 40)], (0, 0, 255), 7)
+    pipeline.draw_stamps(layer, [(60 + i * 4.3, 120 + i * 1.7) for i in range(30)], (0, 255, 0), 17, 0.4)
+    return pipeline
+
+
+def test_rotations_resample_the_layers_once(source):
+    steps, once = painted(source), painted(source)
+    for _ in range(5):
+        steps.add_geometry(("rotate", 10))
+    once.add_geometry(("rotate", 50))
+    assert np.array_equal(steps.render(), once.render())
+
+
+def test_undone_crop_brings_the_paint_back(source):
+    pipeline = painted(source)
+    before = pipeline.render().copy()
+    pipeline.add_geometry(("crop", (100, 50, 200, 150)))
+    pipeline.add_geometry(("rotate", 30))
+    pipeline.render()
+    pipeline.set_geometry([])
+    assert np.array_equal(pipeline.render(), before)
+
+
+@pytest.mark.parametrize("geometry", [
+    [("crop", (40, 20, 260, 180))],
+    [("rotate", 90), ("crop", (10, 30, 150, 250))],
+    [("rotate", 25), ("crop", (30, 30, 300, 220)), ("rotate", -40)],
+])
+def test_strokes_after_geometry_replay_where_they_were_painted(source, geometry):
+    pipeline = painted(source)
+    for op in geometry:
+        pipeline.add_geometry(op)
+    h, w = pipeline.render().shape[:2]
+    layer = pipeline.layers[0]
+    pipeline.draw_polyline(layer, [(5, 5), (w - 10, h - 10)], (255, 0, 0), 5)
+    pipeline.draw_stamps(layer, [(w // 2 + i * 2.5, 20 + i * 3.1) for i in range(20)], (255, 255, 0), 11, 0.6)
+    assert np.array_equal(Pipeline.from_edits(source, pipeline.edits()).render(), pipeline.render())
+
+
+def test_stroke_region_is_in_output_coordinates(source):
+    pipeline = Pipeline(source)
+    pipeline.add_geometry(("crop", (100, 50, 300, 200)))
+    pipeline.render()
+    x, y, w, h = pipeline.draw_polyline(pipeline.layers[0], [(10, 20), (30, 40)], (1, 2, 3), 3)
+    assert x <= 10 and y <= 20 and x + w > 30 and y + h > 40
+    assert x + w < 60 and y + h < 70
+
+
+@pytest.mark.parametrize("transform", [None, (np.float64([[1, 0, -40], [0, 1, -30]]), None)])
+def test_compositing_dirty_tiles_matches_full_composite(source, transform):
+    layer = painted(source).layers[0]
+    adjustment = AdjustmentLayer("Adjustment", {"hue": 20, "saturation": 120, "luminosity": 90})
+    adjustment.opacity = 0.5
+    base = source[30:, 40:] if transform is not None else source
+    compositor = Compositor()
+    compositor.composite(base, [layer, adjustment], transform)
+
+    rect = layer.draw_stamps(source.shape, [(200, 150), (230, 160)], (255, 0, 255), 31, 0.5)
+    if transform is not None:
+        rect = map_rect(rect, transform[0])
+    compositor.invalidate(rect)
+    assert compositor.dirty == set(tile_keys(rect, base.shape))
+    compositor.output[-1, -1] = 7  # A tile away from the stroke, which must not be blended again
+    output = compositor.composite(base, [layer, adjustment], transform)
+    assert not compositor.dirty
+    assert (output[-1, -1] == 7).all()
+    output[-1, -1] = Compositor().composite(base, [layer, adjustment], transform)[-1, -1]
+    assert np.array_equal(output, Compositor().composite(base, [layer, adjustment], transform))
+
+
+def test_compositor_invalidates_everything():
+    compositor = Compositor()
+    compositor.invalidate((0, 0, 10, 10))
+    assert compositor.everything  # Nothing composited yet
+    base = np.zeros((600, 600, 3), np.uint8)
+    layer = PaintLayer()
+    layer.draw_polyline(base.shape, [(10, 10), (20, 20)], (1, 2, 3), 3)
+    compositor.composite(base, [layer])
+    compositor.invalidate((300, 300, 10, 10))
+    assert not compositor.everything and compositor.dirty == {(1, 1)}
+    compositor.invalidate()
+    assert compositor.everything and not compositor.dirty
@@ -0,0 +1,21 @@
+"""Worker count of the tile executor"""
+
+import os
+
+import pytest
+
+from parallel import default_workers
+
+
+@pytest.mark.parametrize("setting, workers", [("3", 3), (" 2 ", 2), ("0", None), ("", None)])
+def test_threads_setting(monkeypatch, capsys, setting, workers):
+    monkeypatch.setenv("EDIFYX_THREADS", setting)
+    assert default_workers() == (workers or os.cpu_count() or 1)
+    assert not capsys.readouterr().out
+
+
+@pytest.mark.parametrize("setting", ["four", "2.5", "-1"])
+def test_invalid_threads_setting_falls_back_to_the_cores(monkeypatch, capsys, setting):
+    monkeypatch.setenv("EDIFYX_THREADS", setting)
+    assert default_workers() == (os.cpu_count() or 1)
+    assert "EDIFYX_THREADS" in capsys.readouterr().out
@@ -0,0 +1,80 @@
+"""On-disk cache of the preview pyramid levels of opened images"""
+
+import os
+
+import numpy as np
+import pytest
+
+import previews
+from previews import PreviewCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return PreviewCache(str(tmp_path / "cache"))
+
+
+@pytest.fixture
+def levels():
+    image = np.random.default_rng(7).integers(0, 256, (64, 96, 3), dtype=np.uint8)
+    return [image, image[::2, ::2].copy()]
+
+
+@pytest.fixture
+def hashed(monkeypatch):
+    """Paths content_hash() read"""
+    paths = []
+    content_hash = previews.content_hash
+    monkeypatch.setattr(previews, "content_hash", lambda path: paths.append(path) or content_hash(path))
+    return paths
+
+
+def image_file(tmp_path, name = "image.png", data = b"image bytes"):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_lookup_returns_stored_levels(tmp_path, cache, levels):
+    path = image_file(tmp_path)
+    assert cache.lookup(path) is None
+    cache.store(path, (96, 64), levels)
+    size, cached = cache.lookup(path)
+    assert size == (96, 64)
+    assert [level.shape for level in cached] == [level.shape for level in levels]
+
+
+def test_reopening_skips_the_hash(tmp_path, cache, levels, hashed):
+    path = image_file(tmp_path)
+    cache.store(path, (96, 64), levels)
+    cache.store(path, (96, 64), levels)
+    assert hashed == [path]
+
+
+def test_changed_file_is_hashed_again(tmp_path, cache, levels, hashed):
+    path = image_file(tmp_path)
+    cache.store(path, (96, 64), levels)
+    image_file(tmp_path, data=b"other image bytes")
+    cache.store(path, (96, 64), levels)
+    assert hashed == [path, path]
+    assert len([name for name in os.listdir(cache.directory) if name.endswith(".levels")]) == 2
+
+
+def test_trimmed_entry_is_stored_again_without_hashing(tmp_path, cache, levels, hashed):
+    path = image_file(tmp_path)
+    cache.store(path, (96, 64), levels)
+    for name in os.listdir(cache.directory):
+        if name.endswith(".levels"):
+            os.remove(os.path.join(cache.directory, name))
+    assert cache.lookup(path) is None
+    cache.store(path, (96, 64), levels)
+    assert hashed == [path]
+    assert cache.lookup(path) is not None
+
+
+def test_copies_share_an_entry(tmp_path, cache, levels):
+    first, second = image_file(tmp_path, "first.png"), image_file(tmp_path, "second.png")
+    cache.store(first, (96, 64), levels)
+    cache.store(second, (96, 64), levels)
+    assert len([name for name in os.listdir(cache.directory) if name.endswith(".levels")]) == 1
+    assert cache.lookup(second) is not None
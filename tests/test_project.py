@@ -0,0 +1,120 @@
+"""Saving .edx projects, reopening them and recovering from saves cut short"""
+
+import numpy as np
+import pytest
+
+from layers import AdjustmentLayer
+from pipeline import Pipeline
+from project import TRAILER, Project
+
+
+@pytest.fixture
+def source():
+    return np.random.default_rng(1).integers(0, 256, (300, 400, 3), dtype=np.uint8)
+
+
+def edited(source):
+    pipeline = Pipeline(source)
+    layer = pipeline.layers[0]
+    pipeline.draw_polyline(layer, [(10, 10), (200, 150), (390, 20)], (0, 0, 255), 9)
+    pipeline.draw_stamps(layer, [(100, 100), (110, 105), (300, 250)], (0, 255, 0), 31, 0.3)
+    pipeline.set_adjustment("saturation", 140)
+    pipeline.set_layers(pipeline.layers + [AdjustmentLayer("Adjustment", {"hue": 30, "saturation": 120,
+                                                                          "luminosity": 90})])
+    return pipeline
+
+
+def save(project, pipeline):
+    project.write(project.changes(pipeline))
+
+
+def reopened(path, source):
+    return Project.open(path).restore(source).render()
+
+
+def test_reopen(tmp_path, source):
+    path = str(tmp_path / "edits.edx")
+    pipeline = edited(source)
+    save(Project(path, str(tmp_path / "source.png")), pipeline)
+    assert np.array_equal(reopened(path, source), pipeline.render())
+
+
+def test_incremental_saves_append(tmp_path, source):
+    path = str(tmp_path / "edits.edx")
+    project = Project(path, str(tmp_path / "source.png"))
+    pipeline = edited(source)
+    save(project, pipeline)
+    before = (tmp_path / "edits.edx").read_bytes()
+    assert project.changes(pipeline) is None
+
+    pipeline.draw_polyline(pipeline.layers[0], [(50, 200), (60, 210)], (1, 2, 3), 3)
+    changes = project.changes(pipeline)
+    assert not changes["full"] and len(changes["layers"][0]["keys"]) == 1
+    project.write(changes)
+    assert (tmp_path / "edits.edx").read_bytes()[:len(before)] == before
+    assert np.array_equal(reopened(path, source), pipeline.render())
+
+
+@pytest.mark.parametrize("cut", [1, TRAILER.size, TRAILER.size + 7])
+def test_torn_save_falls_back_to_the_previous_one(tmp_path, source, cut):
+    path = str(tmp_path / "edits.edx")
+    project = Project(path, str(tmp_path / "source.png"))
+    pipeline = edited(source)
+    save(project, pipeline)
+    first = pipeline.render().copy()
+    pipeline.draw_polyline(pipeline.layers[0], [(20, 280), (380, 280)], (255, 0, 0), 5)
+    pipeline.set_adjustment("hue", 20)
+    save(project, pipeline)
+    assert np.array_equal(reopened(path, source), pipeline.render())
+
+    data = (tmp_path / "edits.edx").read_bytes()
+    (tmp_path / "edits.edx").write_bytes(data[:-cut])
+    assert np.array_equal(reopened(path, source), first)
+
+
+def test_torn_first_save_is_not_a_project(tmp_path, source):
+    path = str(tmp_path / "edits.edx")
+    save(Project(path, str(tmp_path / "source.png")), edited(source))
+    data = (tmp_path / "edits.edx").read_bytes()
+    (tmp_path / "edits.edx").write_bytes(data[:-1])
+    with pytest.raises(ValueError):
+        Project.open(path)
+
+
+def test_reopened_project_keeps_saving(tmp_path, source):
+    path = str(tmp_path / "edits.edx")
+    save(Project(path, str(tmp_path / "source.png")), edited(source))
+    project = Project.open(path)
+    pipeline = project.restore(source)
+    assert pipeline.layers[0].pending  # Tiles stay in the file until painted over
+    assert project.changes(pipeline) is None
+    pipeline.draw_polyline(pipeline.layers[0], [(200, 200), (220, 260)], (9, 9, 9), 4)
+    save(project, pipeline)
+    assert np.array_equal(reopened(path, source), pipeline.render())
+
+
+def test_layers_are_restored_under_geometry(tmp_path, source):
+    path = str(tmp_path / "edits.edx")
+    pipeline = edited(source)
+    pipeline.add_geometry(("rotate", 20))
+    pipeline.add_geometry(("crop", (30, 40, 350, 300)))
+    save(Project(path, str(tmp_path / "source.png")), pipeline)
+    restored = Project.open(path).restore(source)
+    assert restored.layers[0].pending
+    assert np.array_equal(restored.render(), pipeline.render())
+
+
+def test_format_1_layers_are_replayed(tmp_path, source):
+    path = str(tmp_path / "edits.edx")
+    pipeline = edited(source)
+    pipeline.add_geometry(("rotate", 20))
+    save(Project(path, str(tmp_path / "source.png")), pipeline)
+    data = (tmp_path / "edits.edx").read_bytes()
+    (tmp_path / "edits.edx").write_bytes(data.replace(b'"format":2', b'"format":1'))  # Tiles in output coordinates
+
+    project = Project.open(path)
+    restored = project.restore(source)
+    assert not restored.layers[0].pending
+    assert np.array_equal(restored.render(), pipeline.render())
+    save(project, restored)
+    assert b'"format":2' in (tmp_path / "edits.edx").read_bytes()
@@ -0,0 +1,26 @@
+"""Display pyramid: updating an edited region against rebuilding every level"""
+
+import numpy as np
+import pytest
+
+from pyramid import ImagePyramid
+
+
+@pytest.mark.parametrize("region", [
+    (0, 0, 1, 1),
+    (101, 57, 333, 211),
+    (1500, 900, 300, 300),  # Past the bottom right corner
+    (0, 0, 2047, 1233),
+])
+def test_invalidate_matches_rebuild(region):
+    rng = np.random.default_rng(5)
+    image = rng.integers(0, 256, (1233, 2047, 3), dtype=np.uint8)
+    pyramid = ImagePyramid(image)
+    assert len(pyramid.levels) > 2
+
+    x, y, w, h = region
+    image[y:y + h, x:x + w] = rng.integers(0, 256, image[y:y + h, x:x + w].shape, dtype=np.uint8)
+    pyramid.invalidate(*region)
+    rebuilt = ImagePyramid(image.copy())
+    for level, expected in zip(pyramid.levels, rebuilt.levels):
+        assert np.array_equal(level, expected)
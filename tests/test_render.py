@@ -0,0 +1,54 @@
+"""Background rendering of slider changes"""
+
+import sys
+
+import numpy as np
+import pytest
+
+from pipeline import Pipeline
+from render import RenderScheduler
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = RenderScheduler()
+    scheduler.set_pipeline(Pipeline(np.random.default_rng(0).integers(0, 256, (60, 80, 3), dtype=np.uint8)))
+    yield scheduler
+    scheduler.shutdown()
+
+
+def test_exclusive_invalidates_the_preview_under_the_lock(scheduler):
+    scheduler.submit("hue", 40)
+    scheduler.pool.waitForDone()
+    assert scheduler.preview_pipeline is not None
+    with scheduler.exclusive():
+        pass
+    assert scheduler.preview_pipeline is not None
+    with scheduler.exclusive(invalidate=True) as pipeline:
+        pipeline.add_geometry(("rotate", 90))
+        assert scheduler.preview_pipeline is not None  # Still usable until the change is done
+    assert scheduler.preview_pipeline is None
+
+    scheduler.submit("hue", 50)
+    scheduler.pool.waitForDone()
+    assert scheduler.preview_pipeline.render().shape[:2] == (80, 60)  # Rebuilt with the rotation
+
+
+def test_failed_render_does_not_stop_the_worker(scheduler, monkeypatch):
+    errors = []
+    monkeypatch.setattr(sys, "excepthook", lambda *error: errors.append(error))  # Instead of aborting
+    render_preview = scheduler.render_preview
+
+    def fail_once(generation):
+        if not errors:
+            raise RuntimeError("render failed")
+        render_preview(generation)
+    monkeypatch.setattr(scheduler, "render_preview", fail_once)
+
+    scheduler.submit("hue", 40)
+    scheduler.pool.waitForDone()
+    assert len(errors) == 1 and not scheduler.running
+    scheduler.submit("hue", 60)
+    scheduler.pool.waitForDone()
+    assert scheduler.pipeline.adjustments["hue"] == 60
+    assert scheduler.preview_pipeline.adjustments["hue"] == 60
@@ -0,0 +1,83 @@
+"""Strip by strip export against rendering the whole image in memory
+
+Both are allowed to differ where polygon filling depends on where a strip starts:
+along the edges of rotated crops, by a pixel, but never in a 2x2 block of pixels (the
+tolerance benchmarks/export.py --verify checks too). The paint layers must blend
+identically, whatever crops and rotations moved them.
+"""
+
+import cv2
+import numpy as np
+import pytest
+
+import streaming
+from layers import AdjustmentLayer
+from pipeline import Pipeline
+from streaming import export_streaming
+
+GEOMETRY = [
+    ([], []),
+    ([("crop", (20, 10, 330, 220))], []),
+    ([("rotate", 90)], []),
+    ([("crop", (20, 10, 330, 220)), ("rotate", 33)], []),
+    ([], [("crop", (20, 10, 330, 220))]),
+    ([], [("rotate", 270)]),
+    ([("rotate", 10)], [("crop", (60, 40, 300, 200)), ("rotate", 180)]),
+    ([("rotate", 10)], [("crop", (60, 40, 300, 200)), ("rotate", -25)]),
+]
+
+
+@pytest.fixture
+def source():
+    h, w = 240, 360
+    y, x = np.mgrid[:h, :w]
+    noise = np.random.default_rng(2).integers(0, 256, (h, w))
+    return np.dstack([x * 255 // w, y * 255 // h, noise]).astype(np.uint8)
+
+
+def edits(source, before, after):
+    pipeline = Pipeline(source)
+    for op in before:
+        pipeline.add_geometry(op)
+    layer = pipeline.layers[0]
+    h, w = pipeline.render().shape[:2]
+    pipeline.draw_polyline(layer, [(10, 12), (w // 2, h // 3), (w - 15, h - 20)], (0, 0, 255), 7)
+    pipeline.draw_stamps(layer, [(40 + i * 3.7, 60 + i * 1.3) for i in range(40)], (0, 255, 0), 21, 0.3)
+    for op in after:
+        pipeline.add_geometry(op)
+    h, w = pipeline.render().shape[:2]
+    pipeline.draw_polyline(layer, [(5, h - 8), (w - 5, 9)], (255, 0, 0), 3)
+    pipeline.draw_stamps(layer, [(5 + i * 9.3, h - 8 - i * 6.1) for i in range(30)], (255, 0, 0), 9, 0.5)
+    pipeline.set_adjustment("hue", 30)
+    pipeline.set_adjustment("saturation", 140)
+    adjustment = AdjustmentLayer("Adjustment", {"hue": 50, "saturation": 130, "luminosity": 80})
+    adjustment.opacity = 0.6
+    pipeline.set_layers(pipeline.layers + [adjustment])
+    return pipeline.edits()
+
+
+def export_both(tmp_path, source, described):
+    path = str(tmp_path / "export.png")
+    export_streaming(path, source, described)
+    expected = Pipeline.from_edits(source, described).render()
+    exported = cv2.imread(path)
+    assert exported.shape == expected.shape
+    return exported, expected
+
+
+@pytest.mark.parametrize("before, after", GEOMETRY)
+def test_streaming_matches_memory(tmp_path, monkeypatch, source, before, after):
+    monkeypatch.setattr(streaming, "STRIP_PIXELS", 37 * 360)  # Many strips, starting at odd rows
+    described = edits(source, before, after)
+    exported, expected = export_both(tmp_path, source, described)
+    base_exported, base_expected = export_both(tmp_path, source, dict(described, layers=[]))
+    differing = (exported != expected).any(axis=2)
+    # Only the edges of rotated crops may differ, where they do without the layers too
+    assert not (differing & ~(base_exported != base_expected).any(axis=2)).any()
+    assert not cv2.erode(differing.astype(np.uint8), np.ones((2, 2), np.uint8), borderValue=0).any()
+
+
+def test_streams():
+    assert streaming.streams("large.PNG", (10000, 10000, 3))
+    assert not streaming.streams("large.jpg", (10000, 10000, 3))
+    assert not streaming.streams("small.png", (100, 100, 3))
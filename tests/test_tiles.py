@@ -0,0 +1,40 @@
+"""Loading images into memory-mapped TiledImages"""
+
+import cv2
+import numpy as np
+import pytest
+
+from tiles import TILE_SIZE, TiledImage
+
+
+@pytest.mark.parametrize("name, shape, depth", [
+    ("gray.png", (TILE_SIZE * 2 + 17, 70), np.uint8),
+    ("color.png", (TILE_SIZE + 3, 90, 3), np.uint8),
+    ("alpha.png", (TILE_SIZE + 3, 90, 4), np.uint16),
+    ("photo.jpg", (TILE_SIZE + 3, 700, 3), np.uint8),
+])
+def test_from_file_matches_imread(tmp_path, name, shape, depth):
+    image = np.random.default_rng(0).integers(0, np.iinfo(depth).max, shape, dtype=depth)
+    path = str(tmp_path / name)
+    cv2.imwrite(path, image)
+    progress = []
+    store = TiledImage.from_file(path, progress.append)
+    assert np.array_equal(store.array, cv2.imread(path))
+    assert progress[-1] == 1
+
+
+def test_from_file_unreadable(tmp_path):
+    path = tmp_path / "broken.png"
+    path.write_bytes(b"\x89PNG\r\n\x1a\n" + b"\x00" * 20)
+    assert TiledImage.from_file(str(path)) is None
+
+
+def test_from_file_corrupt_stream(tmp_path):
+    image = np.random.default_rng(0).integers(0, 256, (TILE_SIZE * 2, 64, 3), dtype=np.uint8)
+    path = tmp_path / "corrupt.png"
+    cv2.imwrite(str(path), image)
+    data = bytearray(path.read_bytes())
+    start = data.index(b"IDAT") + 4 + 2000
+    data[start:start + 64] = b"\xff" * 64  # The chunk's CRC isn't checked, the deflate stream is broken
+    path.write_bytes(bytes(data))
+    assert TiledImage.from_file(str(path)) is None
@@ -0,0 +1,105 @@
+import tempfile
+
+from fileio import PNGReader, to_color
+from lazy import LazyModule
+from profiling import profiler
+
+cv2 = LazyModule("cv2")
+np = LazyModule("numpy")
+
+TILE_SIZE = 512
+TILED_LOAD_PIXELS = 24_000_000  # Images at least this large are loaded into a TiledImage
+REDUCED_DECODE_EXTENSIONS = (".jpg", ".jpeg")  # Formats where IMREAD_REDUCED_COLOR_4 is cheaper than a full decode
+
+
+def image_size(path):
+    """Returns (width, height) from the file header without decoding pixels, or None"""
+    from PIL import Image  # Only needed once a file is opened
+
+    try:
+        with Image.open(path) as image:
+            return image.size
+    except OSError:
+        return None
+
+
+def read_reduced(path):
+    """Fast 1/4 resolution decode for a first preview, or None when the format doesn't support it"""
+    if not path.lower().endswith(REDUCED_DECODE_EXTENSIONS):
+        return None
+    return cv2.imread(path, cv2.IMREAD_REDUCED_COLOR_4)
+
+
+class TiledImage:
+    """Image stored in a memory-mapped scratch file and handled in TILE_SIZE tiles
+
+    `array` is a regular (memory-mapped) ndarray, so the rest of the editor uses it like
+    any decoded image. Its pages are read lazily and, being file backed, can be dropped by
+    the OS under memory pressure instead of staying resident.
+    """
+
+    def __init__(self, height, width, channels = 3):
+        # Unlinked scratch file: it disappears once the mapping is garbage collected
+        self.file = tempfile.TemporaryFile(prefix="edifyx-", suffix=".tiles")
+        self.array = np.memmap(self.file, dtype=np.uint8, mode="w+", shape=(height, width, channels))
+        self.file.close()  # The mapping keeps the data alive
+
+    @property
+    def shape(self):
+        return self.array.shape
+
+    def tiles(self, tile_size = TILE_SIZE):
+        """Yields the (x1, y1, x2, y2) rectangle of every tile, row by row"""
+        height, width = self.array.shape[:2]
+        for y in range(0, height, tile_size):
+            for x in range(0, width, tile_size):
+                yield x, y, min(width, x + tile_size), min(height, y + tile_size)
+
+    def tile(self, rect):
+        x1, y1, x2, y2 = rect
+        return self.array[y1:y2, x1:x2]
+
+    @classmethod
+    def from_file(cls, path, progress = None, cancelled = None):
+        """Decodes an image into a new TiledImage, or returns None if it can't be read
+
+        PNGs are decoded a row of tiles at a time (see PNGReader), so only that much of
+        the image is ever in memory. OpenCV can only decode other files as a whole; their
+        pixels are copied tile by tile into the scratch file and the decoded image is
+        released right after.
+        """
+        try:
+            with open(path, "rb") as file:
+                reader = PNGReader(file) if path.lower().endswith(".png") else None
+                if reader is not None and reader.streamable:
+                    with profiler.span("decode"):
+                        store = cls(reader.height, reader.width)
+                        for y in range(0, reader.height, TILE_SIZE):
+                            if cancelled is not None and cancelled():
+                                return None
+                            store.array[y:y + TILE_SIZE] = to_color(reader.read(min(TILE_SIZE, reader.height - y)))
+                            if progress is not None:
+                                progress(min(1.0, (y + TILE_SIZE) / reader.height))
+                    store.array.flush()
+                    return store
+        except (OSError, ValueError):
+            return None
+
+        with profiler.span("decode"):
+            decoded = cv2.imread(path)
+        if decoded is None:
+            return None
+
+        store = cls(*decoded.shape)
+        rects = list(store.tiles())
+        for count, rect in enumerate(rects, 1):
+            if cancelled is not None and cancelled():
+                return None
+            x1, y1, x2, y2 = rect
+            store.tile(rect)[:] = decoded[y1:y2, x1:x2]
+            if progress is not None:
+                progress(count / len(rects))
+
+        del decoded
+        store.array.flush()
+        return store